@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+语音编码基准：比较各编码每秒语音在线上的字节数（base64文本和二进制帧）、服务端解码耗时和失真
+
+用法: python benchmarks/bench_audio_codec.py [--rate 16000] [--seconds 5] [-n 20]
+"""
+
+import argparse
+import base64
+import time
+
+import numpy as np
+
+import harness  # noqa: F401  把项目根目录加入 sys.path
+from functions import audio_codec
+
+
+def speech_like(seconds: float, rate: int) -> np.ndarray:
+    """音高缓慢变化的谐波 + 音节包络 + 底噪，比纯正弦音更接近语音的频谱"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12) if k * 170 < rate / 2)
+    envelope = np.clip(np.sin(2 * np.pi * 3 * t), 0, None) ** 0.5
+    signal = 0.3 * voice * envelope + 0.002 * rng.standard_normal(len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def encode_mulaw(pcm: np.ndarray) -> bytes:
+    x = pcm.astype(np.int32)
+    sign = np.where(x < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(x), 32635) + 0x84
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+
+def encode_alaw(pcm: np.ndarray) -> bytes:
+    x = pcm.astype(np.int32)
+    sign = np.where(x >= 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(x), 32767) >> 3
+    exponent = np.where(magnitude < 32, 0, np.floor(np.log2(np.maximum(magnitude, 1))).astype(np.int32) - 4)
+    mantissa = np.where(exponent == 0, magnitude >> 1, magnitude >> exponent) & 0x0F
+    return ((sign | (exponent << 4) | mantissa) ^ 0x55).astype(np.uint8).tobytes()
+
+
+def encode_ima_adpcm(pcm: np.ndarray, block_align: int) -> bytes:
+    """按WAV IMA-ADPCM的分块格式编码（客户端的参考实现，逐个采样）"""
+    steps = audio_codec.IMA_STEP_TABLE.tolist()
+    index_table = audio_codec.IMA_INDEX_TABLE.tolist()
+    per_block = (block_align - 4) * 2 + 1
+    samples = pcm.tolist()
+    out = bytearray()
+    index = 0
+    for beg in range(0, len(samples), per_block):
+        block = samples[beg:beg + per_block]
+        predictor = block[0]
+        out += int(predictor).to_bytes(2, "little", signed=True) + bytes((index, 0))
+        codes = []
+        for sample in block[1:]:
+            step = steps[index]
+            diff = sample - predictor
+            code = 8 if diff < 0 else 0
+            diff = abs(diff)
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+                delta += step >> 1
+            if diff >= step >> 2:
+                code |= 1
+                delta += step >> 2
+            predictor = max(-32768, min(32767, predictor - delta if code & 8 else predictor + delta))
+            index = max(0, min(88, index + index_table[code]))
+            codes.append(code)
+        if len(codes) % 2:
+            codes.append(0)
+        out += bytes(codes[i] | (codes[i + 1] << 4) for i in range(0, len(codes), 2))
+    return bytes(out)
+
+
+def decode_ima_adpcm_scalar(data: bytes, block_align: int) -> np.ndarray:
+    """逐个采样的纯Python解码，作为向量化解码的对照"""
+    steps = audio_codec.IMA_STEP_TABLE.tolist()
+    index_table = audio_codec.IMA_INDEX_TABLE.tolist()
+    out = []
+    for beg in range(0, len(data), block_align):
+        block = data[beg:beg + block_align]
+        predictor = int.from_bytes(block[0:2], "little", signed=True)
+        index = block[2]
+        out.append(predictor)
+        for byte in block[4:]:
+            for code in (byte & 0x0F, byte >> 4):
+                step = steps[index]
+                delta = step >> 3
+                if code & 4:
+                    delta += step
+                if code & 2:
+                    delta += step >> 1
+                if code & 1:
+                    delta += step >> 2
+                predictor = max(-32768, min(32767, predictor - delta if code & 8 else predictor + delta))
+                index = max(0, min(88, index + index_table[code]))
+                out.append(predictor)
+    return np.array(out, dtype=np.int16)
+
+
+def best_of(func, iterations: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def snr_db(reference: np.ndarray, decoded: np.ndarray) -> float:
+    reference = reference.astype(np.float64)
+    noise = reference - decoded[:len(reference)].astype(np.float64)
+    return 10 * np.log10(np.sum(reference ** 2) / max(np.sum(noise ** 2), 1e-9))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=int, default=16000, help="采样率")
+    parser.add_argument("--seconds", type=float, default=5.0, help="测试语音时长（秒）")
+    parser.add_argument("--block-align", type=int, default=audio_codec.DEFAULT_ADPCM_BLOCK_ALIGN,
+                        help="IMA-ADPCM 块大小")
+    parser.add_argument("-n", "--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    pcm = speech_like(args.seconds, args.rate)
+    encoded = {
+        "pcm": pcm.astype("<i2").tobytes(),
+        "mulaw": encode_mulaw(pcm),
+        "alaw": encode_alaw(pcm),
+        "ima_adpcm": encode_ima_adpcm(pcm, args.block_align),
+    }
+
+    print(f"{args.seconds}s @ {args.rate}Hz, numpy {np.__version__}")
+    print(f"{'encoding':<12}{'binary B/s':>12}{'base64 B/s':>12}{'vs pcm':>8}{'decode us/s':>14}{'SNR dB':>9}")
+    for name, data in encoded.items():
+        per_second = len(data) / args.seconds
+        wire = len(base64.b64encode(data)) / args.seconds
+        if name == "pcm":
+            decoded = np.frombuffer(data, dtype="<i2")
+            cost = 0.0
+        else:
+            decoded = audio_codec.decode(data, name, args.block_align)
+            cost = best_of(lambda: audio_codec.decode(data, name, args.block_align), args.iterations)
+        snr = "-" if name == "pcm" else f"{snr_db(pcm, decoded):.1f}"
+        print(f"{name:<12}{per_second:>12.0f}{wire:>12.0f}{len(encoded['pcm']) / len(data):>7.1f}x"
+              f"{cost / args.seconds * 1e6:>14.1f}{snr:>9}")
+
+    adpcm = encoded["ima_adpcm"]
+    assert np.array_equal(decode_ima_adpcm_scalar(adpcm, args.block_align),
+                          audio_codec.decode_ima_adpcm(adpcm, args.block_align))
+    scalar = best_of(lambda: decode_ima_adpcm_scalar(adpcm, args.block_align), max(1, args.iterations // 5))
+    vectorized = best_of(lambda: audio_codec.decode_ima_adpcm(adpcm, args.block_align), args.iterations)
+    print(f"\nIMA-ADPCM 逐采样解码 {scalar / args.seconds * 1e6:.1f} us/s，"
+          f"按块向量化 {vectorized / args.seconds * 1e6:.1f} us/s（{scalar / vectorized:.1f}x）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+消息分发微基准：对比原来的 if/elif + 两次 json.dumps 与现在的分发表 + 编解码器 + 预序列化响应
+
+用法: python benchmarks/bench_dispatch.py [-n 20000]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+
+from harness import FakeWebSocket, prepare_environment
+
+import message_codec as codec
+from server import WebSocketKeyServer
+
+
+class LegacyDispatcher:
+    """按原来的写法处理握手和文本命令，作为对照"""
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger("legacy")
+
+    async def handle_message(self, websocket, message):
+        data = json.loads(message)
+        command = data.get('command')
+        content = data.get('content')
+        msg_id = data.get('msg_id')
+        if command == 'handshake':
+            response = {"msg_id": msg_id, "result": "success", "content": self.config}
+        elif command == 'key' and content:
+            response = None
+        elif command == 'set' and content:
+            response = None
+        elif command == 'text' and content:
+            response = {"id": msg_id, "result": "success"}
+        else:
+            response = {"result": "error", "message": f"未知命令: {command}"}
+        await websocket.send(json.dumps(response))
+        self.logger.info(json.dumps(response))
+
+
+MESSAGES = {
+    "handshake": {"client_id": "bench", "msg_id": "m1", "command": "handshake"},
+    "text": {"client_id": "bench", "msg_id": "m2", "command": "text", "content": "下一页"},
+    "unknown": {"client_id": "bench", "msg_id": "m3", "command": "mouse", "content": "x"},
+}
+
+
+async def measure(handle, message: str, iterations: int) -> float:
+    """返回每条消息的CPU耗时（微秒）"""
+    start = time.process_time()
+    for _ in range(iterations):
+        await handle(message)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    # 日志级别与生产一致时 INFO 会写文件，这里只统计分发本身的开销
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = WebSocketKeyServer(prepare_environment(directory))
+        legacy = LegacyDispatcher(server.config)
+        websocket = FakeWebSocket()
+
+        print(f"codec: {codec.NAME}, iterations: {args.iterations}")
+        print(f"{'command':<12}{'before us/msg':>16}{'after us/msg':>16}{'speedup':>10}")
+        for name, data in MESSAGES.items():
+            message = json.dumps(data)
+            before = await measure(lambda m: legacy.handle_message(websocket, m), message, args.iterations)
+            after = await measure(lambda m: server.handle_message(websocket, m, "127.0.0.1"), message, args.iterations)
+            print(f"{name:<12}{before:>16.2f}{after:>16.2f}{before / after:>9.2f}x")
+        server.key_injector.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
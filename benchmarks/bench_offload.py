@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+大消息解码对按键延迟的影响：一台手机不停上传大段base64语音，其它手机同时翻页，
+比较 payload_decode 各档设置下的按键往返延迟和事件循环调度延迟
+
+- idle：没有语音上传，作为基线
+- inline：JSON解析和base64解码都在事件循环里（原来的做法）
+- thread：base64在线程池里分段解码，JSON仍在事件循环里解析
+- process：大消息整条交给进程池解析和解码（默认设置）
+
+用法: python benchmarks/bench_offload.py [--voice-seconds 60] [--key-clients 3] [--duration 5]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import websockets
+
+from harness import prepare_environment, start_fake_funasr
+from load_test import percentile, voice_clip
+
+import message_codec as codec
+from server import WebSocketKeyServer
+
+MODES = {
+    "idle": {},
+    "inline": {"inline_max_bytes": 1 << 40, "process_min_bytes": 0},
+    "thread": {"process_min_bytes": 0},
+    "process": {},
+}
+
+
+async def press_keys(uri: str, index: int, deadline: float, interval: float, latencies: list):
+    async with websockets.connect(uri, compression=None) as websocket:
+        count = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await websocket.send(codec.dumps({"command": "key", "msg_id": f"k{index}-{count}",
+                                              "client_id": f"keys-{index}", "content": "Right"}))
+            await websocket.recv()
+            latencies.append((time.perf_counter() - started) * 1000)
+            count += 1
+            await asyncio.sleep(interval)
+
+
+async def upload_voice(uri: str, deadline: float, message: str, latencies: list):
+    # 客户端和服务器在同一个进程里，关闭压缩，免得测到的是客户端压缩大消息的耗时
+    async with websockets.connect(uri, max_size=None, compression=None) as websocket:
+        count = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            # 每条消息的 msg_id 不同，不会命中重复消息缓存；语音相同，第一条之后命中识别缓存，只剩解码的开销
+            await websocket.send(message.replace('"msg_id":"v"', f'"msg_id":"v{count}"', 1))
+            await websocket.recv()
+            latencies.append((time.perf_counter() - started) * 1000)
+            count += 1
+
+
+async def run(mode: str, args, message: str) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        funasr_server, funasr_host = await start_fake_funasr()
+        config_path = prepare_environment(
+            directory,
+            bind_host="127.0.0.1",
+            funasr_host=funasr_host,
+            ssl_cert=os.path.join(directory, "missing.crt"),
+            ssl_key=os.path.join(directory, "missing.key"),
+            transport={"max_size": 0},
+            payload_decode=MODES[mode],
+        )
+        server = WebSocketKeyServer(config_path)
+        ws_server = await server.serve()
+        uri = f"ws://127.0.0.1:{ws_server.sockets[0].getsockname()[1]}"
+        keys, voices = [], []
+        try:
+            if mode != "idle":
+                # 进程池在后台启动，先等它就绪，再预热识别缓存
+                await upload_voice(uri, time.perf_counter() + 0.5, message, [])
+            deadline = time.perf_counter() + args.duration
+            tasks = [press_keys(uri, i, deadline, args.key_interval / 1000, keys) for i in range(args.key_clients)]
+            if mode != "idle":
+                tasks.append(upload_voice(uri, deadline, message, voices))
+            await asyncio.gather(*tasks)
+            lag = server.metrics.snapshot()["stages"].get("loop_lag", {})
+        finally:
+            await server.shutdown()
+            funasr_server.close()
+            await funasr_server.wait_closed()
+    keys.sort()
+    return {
+        "keys": len(keys),
+        "key_p50": percentile(keys, 0.5), "key_p99": percentile(keys, 0.99), "key_max": keys[-1] if keys else 0.0,
+        "voices": len(voices), "voice_avg": sum(voices) / len(voices) if voices else 0.0,
+        "lag_p99": lag.get("p99_ms", 0.0),
+        "decoder": server.decoder.snapshot(),
+    }
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.ERROR)
+    clip = voice_clip(args.voice_seconds)
+    message = codec.dumps({"command": "voice", "msg_id": "v", "client_id": "uploader", "content": clip})
+    print(f"语音消息 {len(message) / 1024 / 1024:.1f} MB，{args.key_clients} 台手机每 {args.key_interval} ms 翻一页，"
+          f"每种设置 {args.duration} 秒")
+    print(f"{'mode':<10}{'keys':>7}{'key p50':>10}{'key p99':>10}{'key max':>10}{'voices':>8}{'voice avg':>11}"
+          f"{'lag p99':>10}{'thread':>8}{'process':>9}")
+    for mode in args.modes:
+        r = await run(mode, args, message)
+        print(f"{mode:<10}{r['keys']:>7}{r['key_p50']:>10.2f}{r['key_p99']:>10.2f}{r['key_max']:>10.2f}"
+              f"{r['voices']:>8}{r['voice_avg']:>11.1f}{r['lag_p99']:>10.1f}"
+              f"{r['decoder']['thread']:>8}{r['decoder']['process']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--voice-seconds", type=float, default=60.0, help="上传语音的时长（16kHz 16位，60秒约2.5MB base64）")
+    parser.add_argument("--key-clients", type=int, default=3)
+    parser.add_argument("--key-interval", type=float, default=10.0, help="每台手机两次翻页的间隔（毫秒）")
+    parser.add_argument("--duration", type=float, default=5.0, help="每种设置的测试时长（秒）")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+多主机中继：在本机不同端口上启动 N 个实例，第一个实例把命令中继给其它实例，
+比较手机直连单台主机和经中继同时控制 N 台主机的翻页往返延迟，以及一台主机断开时的回复
+
+用法: python benchmarks/bench_relay.py [--hosts 4] [-n 500] [--press-delay 0.002]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import websockets
+
+from harness import prepare_environment
+from load_test import percentile
+
+import message_codec as codec
+from server import WebSocketKeyServer
+
+
+async def start_host(directory: str, name: str, press_delay: float, relay: dict = None):
+    os.makedirs(directory)
+    overrides = {
+        "bind_host": "127.0.0.1",
+        "host_name": name,
+        "ssl_cert": os.path.join(directory, "missing.crt"),
+        "ssl_key": os.path.join(directory, "missing.key"),
+        "key_injector": {"backend": "recording", "queue_size": 1024, "backend_options": {"press_delay": press_delay}},
+        "payload_decode": {"process_min_bytes": 0},
+    }
+    if relay:
+        overrides["relay"] = relay
+    server = WebSocketKeyServer(prepare_environment(directory, **overrides))
+    ws_server = await server.serve()
+    return server, ws_server, ws_server.sockets[0].getsockname()[1]
+
+
+async def stop_host(server):
+    await server.shutdown()
+
+
+async def press(uri: str, count: int, prefix: str) -> tuple:
+    latencies, last = [], None
+    async with websockets.connect(uri, compression=None) as websocket:
+        for i in range(count):
+            started = time.perf_counter()
+            await websocket.send(codec.dumps({"command": "key", "msg_id": f"{prefix}{i}", "client_id": "phone",
+                                              "content": "Right"}))
+            last = codec.loads(await websocket.recv())
+            latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return latencies, last
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as root:
+        peers = [await start_host(os.path.join(root, f"screen{i}"), f"screen{i}", args.press_delay)
+                 for i in range(1, args.hosts)]
+        relay = {"peers": [{"name": f"screen{i}", "uri": f"ws://127.0.0.1:{port}"}
+                           for i, (_, _, port) in enumerate(peers, 1)], "timeout": 1.0}
+        main_host = await start_host(os.path.join(root, "screen0"), "screen0", args.press_delay, relay)
+        try:
+            direct_uri = f"ws://127.0.0.1:{peers[0][2]}"
+            relay_uri = f"ws://127.0.0.1:{main_host[2]}"
+            print(f"{args.hosts} 个实例，每个按键 {args.count} 次（毫秒）")
+            print(f"{'mode':<20}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+            for label, uri in (("直连 1 台", direct_uri), (f"中继 {args.hosts} 台", relay_uri)):
+                latencies, last = await press(uri, args.count, label)
+                print(f"{label:<20}{percentile(latencies, 0.5):>8.2f}{percentile(latencies, 0.95):>8.2f}"
+                      f"{percentile(latencies, 0.99):>8.2f}{latencies[-1]:>8.2f}")
+            print("\n最后一次中继回复中各主机的耗时:")
+            for name, result in last["hosts"].items():
+                print(f"  {name:<10}{result['result']:<10}{result['ms']:>8.2f}")
+            presses = [len(server.key_injector.backend.records) for server, _, _ in [main_host, *peers]]
+            print(f"各主机注入的按键数: {presses}")
+
+            # 断开一台对端主机，回复变为 partial
+            await stop_host(peers[-1][0])
+            await asyncio.sleep(0.2)
+            _, last = await press(relay_uri, 1, "down")
+            print(f"\n{peers[-1][0].host_name} 断开后: result={last['result']}, {last.get('message')}")
+        finally:
+            await stop_host(main_host[0])
+            for server, _, _ in peers[:-1]:
+                await stop_host(server)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=4, help="实例数（含中继主机）")
+    parser.add_argument("-n", "--count", type=int, default=500)
+    parser.add_argument("--press-delay", type=float, default=0.002, help="假按键后端每次注入的耗时（秒）")
+    asyncio.run(main(parser.parse_args()))
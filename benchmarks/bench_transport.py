@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+传输层基准：
+1. 重连耗时：ws、wss 完整握手、wss 恢复TLS会话三种方式各连接 N 次，统计建连和收到握手回复的延迟
+2. 压缩策略：none / deflate / selective 下发送同样的按键和base64语音，统计线上字节数和CPU耗时
+
+用法: python benchmarks/bench_transport.py [-n 200] [--keys 2000] [--voices 20]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import ssl
+import tempfile
+import time
+
+import websockets
+
+from harness import client_ssl_context, create_self_signed_cert, prepare_environment, start_fake_funasr
+from load_test import percentile, voice_clip
+
+import message_codec as codec
+from server import WebSocketKeyServer
+
+
+class ResumingContext(ssl.SSLContext):
+    """客户端用：记住上一次连接的TLS会话，下次握手时带上（asyncio 建连时没有传 session 的参数）"""
+
+    session = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session=session or self.session)
+
+
+def resuming_context() -> ResumingContext:
+    context = ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+async def start(directory: str, transport: dict, tls: bool):
+    funasr_server, funasr_host = await start_fake_funasr()
+    overrides = {
+        "bind_host": "127.0.0.1",
+        "funasr_host": funasr_host,
+        "key_injector": {"backend": "recording", "queue_size": 1024},
+        "ssl_cert": os.path.join(directory, "missing.crt"),
+        "ssl_key": os.path.join(directory, "missing.key"),
+        "transport": transport,
+    }
+    if tls:
+        overrides["ssl_cert"], overrides["ssl_key"] = create_self_signed_cert(directory)
+    server = WebSocketKeyServer(prepare_environment(directory, **overrides))
+    ws_server = await server.serve()
+    server.funasr_server = funasr_server
+    return server, ws_server, ws_server.sockets[0].getsockname()[1]
+
+
+async def stop(server):
+    await server.shutdown()
+    server.funasr_server.close()
+    await server.funasr_server.wait_closed()
+
+
+async def measure_reconnects(mode: str, count: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        server, ws_server, port = await start(directory, {}, tls=mode != "ws")
+        uri = f"{'ws' if mode == 'ws' else 'wss'}://127.0.0.1:{port}"
+        context = resuming_context() if mode == "wss-resume" else None
+        opened, replied = [], []
+        resumed = 0
+        try:
+            for i in range(count):
+                ssl_context = context or (client_ssl_context() if mode == "wss" else None)
+                started = time.perf_counter()
+                async with websockets.connect(uri, ssl=ssl_context) as websocket:
+                    opened.append((time.perf_counter() - started) * 1000)
+                    await websocket.send(codec.dumps({"command": "handshake", "msg_id": f"h{i}"}))
+                    await websocket.recv()
+                    replied.append((time.perf_counter() - started) * 1000)
+                    ssl_object = websocket.transport.get_extra_info("ssl_object")
+                    if ssl_object is not None:
+                        resumed += ssl_object.session_reused
+                        if context is not None:
+                            # TLS 1.3 的票据在握手之后才收到，收到回复后再取会话
+                            context.session = ssl_object.session
+        finally:
+            await stop(server)
+    opened.sort()
+    replied.sort()
+    return {
+        "open_p50": percentile(opened, 0.5), "open_p95": percentile(opened, 0.95),
+        "reply_p50": percentile(replied, 0.5), "reply_p95": percentile(replied, 0.95),
+        "resumed": resumed, "count": count,
+    }
+
+
+async def measure_compression(policy: str, keys: int, voices: int, voice: str) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        server, ws_server, port = await start(directory, {"compression": policy}, tls=False)
+        sent = received = 0
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}", max_size=None) as websocket:
+                # 在 asyncio 传输层统计双向的实际字节数
+                write, data_received = websocket.transport.write, websocket.data_received
+
+                def counting_write(data):
+                    nonlocal sent
+                    sent += len(data)
+                    write(data)
+
+                def counting_received(data):
+                    nonlocal received
+                    received += len(data)
+                    data_received(data)
+
+                websocket.transport.write = counting_write
+                websocket.data_received = counting_received
+
+                cpu = time.process_time()
+                started = time.perf_counter()
+                for i in range(keys):
+                    await websocket.send(codec.dumps({"command": "key", "msg_id": f"k{i}", "content": "Right"}))
+                    await websocket.recv()
+                key_elapsed = time.perf_counter() - started
+                for i in range(voices):
+                    await websocket.send(codec.dumps({"command": "voice", "msg_id": f"v{i}", "content": voice}))
+                    await websocket.recv()
+                cpu = time.process_time() - cpu
+        finally:
+            await stop(server)
+    return {
+        "sent": sent, "received": received,
+        "key_rtt_us": key_elapsed / keys * 1e6,
+        "cpu_ms": cpu * 1000,
+        "server": server.transport.snapshot(),
+    }
+
+
+async def main(args):
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"重连 {args.count} 次（毫秒）")
+    print(f"{'mode':<12}{'open p50':>10}{'open p95':>10}{'reply p50':>11}{'reply p95':>11}{'resumed':>9}")
+    for mode in ("ws", "wss", "wss-resume"):
+        r = await measure_reconnects(mode, args.count)
+        print(f"{mode:<12}{r['open_p50']:>10.2f}{r['open_p95']:>10.2f}{r['reply_p50']:>11.2f}{r['reply_p95']:>11.2f}"
+              f"{r['resumed']:>6}/{r['count']}")
+
+    voice = voice_clip(args.voice_seconds)
+    print(f"\n压缩策略：{args.keys} 条按键 + {args.voices} 条 {args.voice_seconds}s base64语音")
+    print(f"{'policy':<12}{'sent KB':>10}{'recv KB':>10}{'key rtt us':>12}{'cpu ms':>10}")
+    for policy in ("none", "deflate", "selective"):
+        r = await measure_compression(policy, args.keys, args.voices, voice)
+        print(f"{policy:<12}{r['sent'] / 1024:>10.1f}{r['received'] / 1024:>10.1f}{r['key_rtt_us']:>12.1f}"
+              f"{r['cpu_ms']:>10.1f}")
+        if policy == "selective":
+            s = r["server"]
+            print(f"  服务端发送: 压缩 {s['compressed']} 条（{s['raw_bytes']} -> {s['wire_bytes']} 字节），"
+                  f"未压缩 {s['skipped']} 条（{s['skipped_bytes']} 字节）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=200, help="每种方式的重连次数")
+    parser.add_argument("--keys", type=int, default=2000, help="压缩测试的按键消息数")
+    parser.add_argument("--voices", type=int, default=20, help="压缩测试的语音消息数")
+    parser.add_argument("--voice-seconds", type=float, default=1.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+压测公共部分：在临时目录里准备配置文件和 slide monitor 运行配置，创建使用假后端的服务器
+"""
+
+import asyncio
+import json
+import os
+import ssl
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+RUNNING_CONFIG = {
+    "work_mode": "manual",
+    "work_mode_response": {"result": "success"},
+    "avatar_command": {"command": "stop"},
+    "avatar_command_response": {"result": "success"},
+    "active_scene": "default",
+    "active_scene_response": {"result": "success"},
+}
+
+
+def prepare_environment(directory: str, **overrides) -> str:
+    """写入压测用的 config.json 和运行配置文件，返回 config.json 路径"""
+    with open(os.path.join(ROOT, "config_template.json"), "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.update({
+        "host_port": 0,
+        "funasr_host": "",
+        "slide_monitor_dir": directory,
+        "key_injector": {"backend": "recording", "queue_size": 1024},
+        # 压测的客户端都来自 127.0.0.1，发送速度远超真实手机，默认不限速
+        "rate_limit": {"enabled": False},
+        # 识别缓存写在临时目录里，不留在仓库目录
+        "asr_cache": dict(config.get("asr_cache", {}), persist_path=os.path.join(directory, "asr_cache.json")),
+    })
+    config.update(overrides)
+
+    config_path = os.path.join(directory, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+    with open(os.path.join(directory, "slide_monitor_running_config.json"), "w", encoding="utf-8") as f:
+        json.dump(RUNNING_CONFIG, f, ensure_ascii=False, indent=4)
+    return config_path
+
+
+class FakeWebSocket:
+    """只记录发送内容的假连接"""
+    remote_address = ("127.0.0.1", 0)
+
+    def __init__(self):
+        self.sent = 0
+        self.last = None
+
+    async def send(self, message):
+        self.sent += 1
+        self.last = message
+
+
+async def start_fake_funasr(host: str = "127.0.0.1", delay: float = 0.0):
+    """本地假FunASR服务：收到结束标志后返回最终结果，文本中带收到的字节数"""
+    import websockets
+
+    async def handle(websocket):
+        received = 0
+        async for message in websocket:
+            if isinstance(message, bytes):
+                received += len(message)
+                continue
+            data = json.loads(message)
+            if data.get("is_speaking") is False:
+                if delay:
+                    await asyncio.sleep(delay)
+                await websocket.send(json.dumps({
+                    "mode": "2pass-offline",
+                    "text": f"收到{received}字节",
+                    "stamp_sents": [],
+                    "is_final": True,
+                }, ensure_ascii=False))
+                received = 0
+
+    server = await websockets.serve(handle, host, 0, subprotocols=["binary"], max_size=None)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"ws://{host}:{port}"
+
+
+async def fake_slide_monitor(directory: str, delay: float = 0.02, interval: float = 0.01):
+    """模拟 slide monitor：把运行配置中状态为 issue 的 *_response 改为 success"""
+    from functions.running_config import RunningConfigStore, CONFIG_FILE_NAME
+
+    # 单独的实例，相当于另一个进程
+    store = RunningConfigStore(os.path.join(directory, CONFIG_FILE_NAME))
+    loop = asyncio.get_running_loop()
+    while True:
+        config = await loop.run_in_executor(None, store.read)
+        issued = {key: {"result": "success"} for key, value in config.items()
+                  if key.endswith("_response") and isinstance(value, dict) and value.get("result") == "issue"}
+        if issued:
+            await asyncio.sleep(delay)
+            await loop.run_in_executor(None, store.update, issued)
+        await asyncio.sleep(interval)
+
+
+def create_self_signed_cert(directory: str):
+    """生成压测用的自签名证书，返回 (证书路径, 私钥路径)"""
+    from generate_cert import generate_self_signed_cert
+    from cryptography.hazmat.primitives import serialization
+
+    private_key, certificate = generate_self_signed_cert()
+    cert_path = os.path.join(directory, "server.crt")
+    key_path = os.path.join(directory, "server.key")
+    with open(key_path, "wb") as f:
+        f.write(private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=serialization.NoEncryption(),
+        ))
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    return cert_path, key_path
+
+
+def client_ssl_context() -> ssl.SSLContext:
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    return ssl_context
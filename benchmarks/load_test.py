@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+WebSocket 服务端压测：在进程内启动服务器（假按键后端、临时 slide monitor 运行配置、本地假FunASR服务），
+模拟 N 台手机按给定比例发送 key / function / voice / handshake 命令，统计每种命令的吞吐量和延迟分位数。
+
+用法:
+    python benchmarks/load_test.py -c 8 -d 10 --mix key=80,function=10,voice=5,handshake=5
+    python benchmarks/load_test.py --transport both --output result.json
+    python benchmarks/load_test.py --baseline result.json --tolerance 0.2
+
+指定 --baseline 时与之前保存的结果比较，p95 延迟变慢或吞吐量下降超过 tolerance 时以非零状态退出。
+"""
+
+import argparse
+import array
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import websockets
+
+from harness import (client_ssl_context, create_self_signed_cert, fake_slide_monitor,
+                     prepare_environment, start_fake_funasr)
+
+import message_codec as codec
+from server import WebSocketKeyServer
+
+COMMANDS = ("key", "function", "voice", "handshake")
+FUNCTIONS = ("switchWorkModeToManual", "switchWorkModeToCollaboration", "switchWorkModeToAuto",
+             "switchAvatarStatus", "switchScene")
+# 延迟变化小于这个值（毫秒）时不算退化，避免亚毫秒级的抖动误报
+MIN_REGRESSION_MS = 1.0
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"未知命令: {name}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("命令比例不能全为0")
+    return mix
+
+
+def percentile(sorted_values, q: float) -> float:
+    """线性插值计算分位数"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name in COMMANDS}
+        self.errors = {name: 0 for name in COMMANDS}
+
+    def summary(self, duration: float) -> dict:
+        result = {}
+        for name in COMMANDS:
+            values = sorted(self.latencies[name])
+            if not values and not self.errors[name]:
+                continue
+            result[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "throughput": round(len(values) / duration, 2),
+                "avg_ms": round(sum(values) / len(values), 3) if values else 0.0,
+                "p50_ms": round(percentile(values, 0.50), 3),
+                "p95_ms": round(percentile(values, 0.95), 3),
+                "p99_ms": round(percentile(values, 0.99), 3),
+                "max_ms": round(values[-1], 3) if values else 0.0,
+            }
+        return result
+
+
+class Phone:
+    """一台模拟手机：一个连接，发一条等一条回复"""
+
+    def __init__(self, index: int, uri: str, ssl_context, mix: dict, voice, recorder: Recorder):
+        self.client_id = f"bench-{index}"
+        self.uri = uri
+        self.ssl_context = ssl_context
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        # 返回语音base64的函数
+        self.voice = voice
+        self.recorder = recorder
+        self.random = random.Random(index)
+        self.ids = itertools.count()
+
+    def build(self, command: str) -> dict:
+        if command == "key":
+            content = self.random.choice(("Left", "Right"))
+        elif command == "function":
+            content = self.random.choice(FUNCTIONS)
+        elif command == "voice":
+            content = self.voice()
+        else:
+            content = "bench"
+        return {
+            "command": command,
+            "content": content,
+            "msg_id": f"{self.client_id}-{next(self.ids)}",
+            "client_id": self.client_id,
+        }
+
+    async def request(self, websocket, command: str):
+        message = self.build(command)
+        msg_id = message["msg_id"]
+        started = time.perf_counter()
+        await websocket.send(codec.dumps(message))
+        # 回复里的 id 字段名因命令而异；没有 id 的推送消息直接跳过
+        while True:
+            reply = codec.loads(await websocket.recv())
+            if reply.get("id") == msg_id or reply.get("msg_id") == msg_id:
+                break
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if reply.get("result") == "success":
+            self.recorder.latencies[command].append(elapsed_ms)
+        else:
+            self.recorder.errors[command] += 1
+
+    async def run(self, deadline: float):
+        async with websockets.connect(self.uri, ssl=self.ssl_context, max_size=None) as websocket:
+            await self.request(websocket, "handshake")
+            while time.perf_counter() < deadline:
+                command = self.random.choices(self.names, self.weights)[0]
+                await self.request(websocket, command)
+
+
+def voice_clip(seconds: float, sample_rate: int = 16000) -> str:
+    """生成一段带底噪的正弦音（16kHz单声道16位PCM）的base64"""
+    rng = random.Random(0)
+    samples = int(seconds * sample_rate)
+    frequency = 2 * math.pi * 440 / sample_rate
+    pcm = array.array("h", (int(8000 * math.sin(frequency * i)) + rng.randint(-50, 50) for i in range(samples)))
+    if sys.byteorder != "little":
+        pcm.byteswap()
+    return base64.b64encode(pcm.tobytes()).decode("ascii")
+
+
+def voice_source(args):
+    """返回生成语音内容的函数；默认每条语音开头3个字节不同，不会命中服务端的识别缓存"""
+    clip = voice_clip(args.voice_seconds)
+    if args.voice_cached:
+        return lambda: clip
+    counter = itertools.count()
+    return lambda: base64.b64encode((next(counter) % (1 << 24)).to_bytes(3, "little")).decode("ascii") + clip[4:]
+
+
+async def run_transport(transport: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        funasr_server, funasr_host = await start_fake_funasr(delay=args.asr_delay)
+        overrides = {
+            "bind_host": "127.0.0.1",
+            "funasr_host": funasr_host,
+            "key_injector": {
+                "backend": "recording",
+                "queue_size": 1024,
+                "backend_options": {"press_delay": args.press_delay},
+            },
+            # ws 模式指向不存在的证书，避免误用当前目录下的 server.crt
+            "ssl_cert": os.path.join(directory, "missing.crt"),
+            "ssl_key": os.path.join(directory, "missing.key"),
+        }
+        if transport == "wss":
+            overrides["ssl_cert"], overrides["ssl_key"] = create_self_signed_cert(directory)
+        config_path = prepare_environment(directory, **overrides)
+
+        server = WebSocketKeyServer(config_path)
+        ws_server = await server.serve()
+        monitor = asyncio.create_task(fake_slide_monitor(directory, delay=args.monitor_delay))
+        port = ws_server.sockets[0].getsockname()[1]
+        uri = f"{transport}://127.0.0.1:{port}"
+        ssl_context = client_ssl_context() if transport == "wss" else None
+
+        recorder = Recorder()
+        voice = voice_source(args)
+        phones = [Phone(i, uri, ssl_context, args.mix, voice, recorder) for i in range(args.clients)]
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(phone.run(started + args.duration) for phone in phones))
+            duration = time.perf_counter() - started
+        finally:
+            monitor.cancel()
+            await server.shutdown()
+            funasr_server.close()
+            await funasr_server.wait_closed()
+
+        return {
+            "duration_s": round(duration, 3),
+            "commands": recorder.summary(duration),
+            "server": server.metrics.snapshot()["commands"],
+        }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """返回退化项列表"""
+    regressions = []
+    for transport, current in results["transports"].items():
+        base = baseline.get("transports", {}).get(transport)
+        if not base:
+            continue
+        for command, stats in current["commands"].items():
+            old = base["commands"].get(command)
+            if not old or not old["count"]:
+                continue
+            if (stats["p95_ms"] > old["p95_ms"] * (1 + tolerance)
+                    and stats["p95_ms"] - old["p95_ms"] > MIN_REGRESSION_MS):
+                regressions.append(f"{transport}/{command} p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats["throughput"] < old["throughput"] * (1 - tolerance):
+                regressions.append(f"{transport}/{command} 吞吐量 {old['throughput']} -> {stats['throughput']} 条/秒")
+    return regressions
+
+
+def print_results(results: dict):
+    for transport, result in results["transports"].items():
+        print(f"\n[{transport}] {result['duration_s']}s")
+        print(f"{'命令':<10}{'次数':>8}{'错误':>6}{'条/秒':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for command, stats in result["commands"].items():
+            print(f"{command:<10}{stats['count']:>8}{stats['errors']:>6}{stats['throughput']:>10}"
+                  f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+
+async def main(args) -> int:
+    transports = ("ws", "wss") if args.transport == "both" else (args.transport,)
+    results = {
+        "meta": {
+            "clients": args.clients,
+            "duration_s": args.duration,
+            "mix": args.mix,
+            "press_delay": args.press_delay,
+            "voice_seconds": args.voice_seconds,
+            "voice_cached": args.voice_cached,
+            "codec": codec.NAME,
+            "python": platform.python_version(),
+            "websockets": websockets.__version__,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "transports": {},
+    }
+    for transport in transports:
+        results["transports"][transport] = await run_transport(transport, args)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n性能退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n与基线相比没有退化")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--clients", type=int, default=4, help="模拟手机数量")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="压测时长（秒）")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("key=80,function=10,voice=5,handshake=5"),
+                        help="命令比例，如 key=80,function=10,voice=5,handshake=5")
+    parser.add_argument("--transport", choices=("ws", "wss", "both"), default="ws")
+    parser.add_argument("--press-delay", type=float, default=0.0, help="假按键后端每次注入的耗时（秒）")
+    parser.add_argument("--asr-delay", type=float, default=0.05, help="假FunASR返回结果前的延迟（秒）")
+    parser.add_argument("--monitor-delay", type=float, default=0.02, help="假slide monitor确认前的延迟（秒）")
+    parser.add_argument("--voice-seconds", type=float, default=2.0, help="每条语音的时长（秒）")
+    parser.add_argument("--voice-cached", action="store_true", help="所有语音使用同一段音频（测试识别缓存命中）")
+    parser.add_argument("--output", help="结果写入的JSON文件")
+    parser.add_argument("--baseline", help="用于比较的基线结果JSON文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出服务器日志")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    sys.exit(asyncio.run(main(args)))
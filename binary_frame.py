@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+二进制消息帧
+
+格式: MAGIC(4字节) + 头部长度(4字节, 大端) + JSON头部 + 负载
+头部与文本消息的字段相同（command、msg_id、client_id 等），负载以 memoryview 返回，不做拷贝。
+"""
+
+import json
+import struct
+
+import message_codec as codec
+
+MAGIC = b"MSMF"
+_HEADER_LEN = struct.Struct(">I")
+PREFIX_SIZE = len(MAGIC) + _HEADER_LEN.size
+
+
+class FrameError(ValueError):
+    """二进制帧格式错误"""
+
+
+def is_framed(data) -> bool:
+    return len(data) >= PREFIX_SIZE and bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def parse_frame(data):
+    """解析二进制帧，返回 (头部字典, 负载 memoryview)"""
+    view = memoryview(data)
+    if not is_framed(view):
+        raise FrameError("不是有效的二进制帧")
+    (header_len,) = _HEADER_LEN.unpack_from(view, len(MAGIC))
+    header_end = PREFIX_SIZE + header_len
+    if header_end > len(view):
+        raise FrameError("二进制帧头部长度错误")
+    try:
+        header = codec.loads(bytes(view[PREFIX_SIZE:header_end]))
+    except (UnicodeDecodeError, codec.DecodeError) as e:
+        raise FrameError(f"二进制帧头部格式错误: {e}") from None
+    if not isinstance(header, dict):
+        raise FrameError("二进制帧头部应为字典")
+    return header, view[header_end:]
+
+
+def build_frame(header: dict, payload=b"") -> bytes:
+    """构造二进制帧（客户端和测试工具使用）"""
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    return b"".join((MAGIC, _HEADER_LEN.pack(len(header_bytes)), header_bytes, payload))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+config.json 的加载、监视和保存
+
+- config 属性始终是一份完整的配置快照，修改时整体替换而不是原地修改，
+  读到的配置不会一半是旧的一半是新的
+- 后台定期检查文件的 (mtime, size)，手动编辑后自动重新加载并回调 on_change
+- 修改先合并在内存里，延迟 save_delay 秒后在线程池中原子写入（临时文件 + 替换）
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+from functions.running_config import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigManager:
+    def __init__(self, path: str = 'config.json', on_change=None):
+        self.path = path
+        # on_change(旧配置, 新配置, 变化的字段列表)，文件被外部修改并重新加载后调用
+        self.on_change = on_change
+        self._stat_key = None
+        self.config = self._read()
+        options = self.config.get('config_reload', {})
+        self.poll_interval = options.get('poll_interval', 1.0)
+        self.save_delay = options.get('save_delay', 0.5)
+        # 已修改但还没写入文件的字段
+        self._pending = {}
+        self._save_task = None
+        self._watch_task = None
+        self.stats = {"reloads": 0, "reload_errors": 0, "writes": 0, "merged_updates": 0}
+
+    def _file_key(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self) -> dict:
+        """读取配置文件，文件不存在或格式错误时抛出异常"""
+        try:
+            key = self._file_key()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            logger.error(f"配置文件 {self.path} 未找到")
+            raise
+        except json.JSONDecodeError as e:
+            logger.error(f"配置文件格式错误: {e}")
+            raise
+        if not isinstance(config, dict):
+            raise ValueError("配置文件内容应为字典")
+        self._stat_key = key
+        return config
+
+    def get(self, key: str, default=None):
+        return self.config.get(key, default)
+
+    def update(self, changes: dict) -> dict:
+        """修改顶层字段并安排延迟保存，返回新的配置快照"""
+        if self._pending:
+            self.stats["merged_updates"] += 1
+        self._pending.update(changes)
+        self.config = {**self.config, **changes}
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+        return self.config
+
+    async def _save_later(self):
+        # 写文件期间又有修改时，再等一轮写入
+        while self._pending:
+            await asyncio.sleep(self.save_delay)
+            await self.flush()
+
+    async def flush(self):
+        """立即写入还没保存的修改"""
+        if not self._pending:
+            return
+        self._pending = {}
+        snapshot = self.config
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, snapshot)
+            logger.info(f"配置已保存到{self.path}")
+        except Exception as e:
+            logger.error(f"保存配置失败: {e}")
+
+    def _write(self, config: dict):
+        write_json_atomic(self.path, config)
+        # 记下自己写出的文件版本，监视时不把它当成外部修改
+        self._stat_key = self._file_key()
+        self.stats["writes"] += 1
+
+    def start(self):
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+        await self.flush()
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                key = await loop.run_in_executor(None, self._file_key)
+                if key == self._stat_key:
+                    continue
+                loaded = await loop.run_in_executor(None, self._read)
+            except (OSError, ValueError) as e:
+                # 编辑器保存到一半或格式写错了，保留当前配置，等下次修改
+                self.stats["reload_errors"] += 1
+                logger.warning(f"重新加载配置失败，继续使用当前配置: {e}")
+                try:
+                    self._stat_key = await loop.run_in_executor(None, self._file_key)
+                except OSError:
+                    pass
+                continue
+            await self._apply(loaded)
+
+    async def _apply(self, loaded: dict):
+        old = self.config
+        # 还没写入文件的修改优先
+        new = {**loaded, **self._pending}
+        changed = sorted(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+        if not changed:
+            return
+        self.config = new
+        self.stats["reloads"] += 1
+        logger.info(f"配置文件已修改，重新加载: {changed}")
+        if self.on_change is not None:
+            try:
+                await self.on_change(old, new, changed)
+            except Exception as e:
+                logger.error(f"应用配置修改失败: {e}")
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending": len(self._pending)}
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+在线连接登记和服务端推送
+
+连接建立时登记，收到带 client_id 的消息后按 client_id 建立索引。
+推送用 websockets.broadcast 一次序列化、批量写出；写缓冲区积压超过上限的慢客户端本次直接跳过，
+连续跳过太多次则断开它，避免一台卡住的手机拖住其它手机。
+"""
+
+import logging
+import time
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+
+class ClientInfo:
+    __slots__ = ("ip", "client_id", "subscribed", "connected_at", "skipped")
+
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.client_id = None
+        self.subscribed = False
+        self.connected_at = time.time()
+        # 连续因为写缓冲区积压而跳过的推送次数
+        self.skipped = 0
+
+
+class ConnectionRegistry:
+    def __init__(self, max_buffer: int = 256 * 1024, max_skipped: int = 10):
+        self.max_buffer = max_buffer
+        self.max_skipped = max_skipped
+        self.clients = {}
+        self.by_client_id = {}
+        self.stats = {"broadcasts": 0, "delivered": 0, "skipped_slow": 0, "closed_slow": 0}
+
+    def register(self, websocket, ip: str) -> ClientInfo:
+        info = self.clients[websocket] = ClientInfo(ip)
+        return info
+
+    def unregister(self, websocket):
+        info = self.clients.pop(websocket, None)
+        if info is not None and info.client_id is not None and self.by_client_id.get(info.client_id) is websocket:
+            del self.by_client_id[info.client_id]
+
+    def identify(self, websocket, client_id: str):
+        """记录连接对应的 client_id，同一 client_id 重连时指向新的连接"""
+        info = self.clients.get(websocket)
+        if info is None or info.client_id == client_id:
+            return
+        if info.client_id is not None and self.by_client_id.get(info.client_id) is websocket:
+            del self.by_client_id[info.client_id]
+        info.client_id = client_id
+        self.by_client_id[client_id] = websocket
+
+    def get(self, client_id: str):
+        return self.by_client_id.get(client_id)
+
+    def subscribe(self, websocket, enabled: bool = True):
+        info = self.clients.get(websocket)
+        if info is not None:
+            info.subscribed = enabled
+
+    def subscriber_count(self) -> int:
+        return sum(1 for info in self.clients.values() if info.subscribed)
+
+    def broadcast(self, message: str) -> int:
+        """推送给所有订阅的连接，返回实际写出的连接数"""
+        targets = []
+        for websocket, info in list(self.clients.items()):
+            if not info.subscribed:
+                continue
+            if _buffered(websocket) > self.max_buffer:
+                info.skipped += 1
+                self.stats["skipped_slow"] += 1
+                if info.skipped >= self.max_skipped:
+                    self._close_slow(websocket, info)
+                continue
+            info.skipped = 0
+            targets.append(websocket)
+        if targets:
+            websockets.broadcast(targets, message)
+        self.stats["broadcasts"] += 1
+        self.stats["delivered"] += len(targets)
+        return len(targets)
+
+    def _close_slow(self, websocket, info: ClientInfo):
+        logger.warning(f"客户端长时间未读取推送，断开连接 - IP: {info.ip}, client_id: {info.client_id}")
+        self.stats["closed_slow"] += 1
+        info.subscribed = False
+        # 缓冲区已满，不等关闭握手完成，直接断开底层连接
+        websocket.transport.abort()
+
+    def snapshot(self) -> dict:
+        return {
+            "connections": len(self.clients),
+            "identified": len(self.by_client_id),
+            "subscribers": self.subscriber_count(),
+            **self.stats,
+        }
+
+
+def _buffered(websocket) -> int:
+    transport = getattr(websocket, "transport", None)
+    return transport.get_write_buffer_size() if transport is not None else 0
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+功能命令注册表
+
+启动时根据 functions 包的 __all__ 和 config.json 中的 functions 列表建立一次，
+之后的功能命令只能调用表中的函数，并在独立线程池中执行，带超时、并发限制和调用统计。
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import functions
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownFunction(Exception):
+    """未注册的功能"""
+
+
+class FunctionTimeout(Exception):
+    """功能执行超时"""
+
+
+class RegisteredFunction:
+    def __init__(self, name: str, func, timeout: float, max_concurrency: int, ack_key: str = None):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.ack_key = ack_key
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, failed: bool = False, timed_out: bool = False):
+        self.calls += 1
+        self.failures += failed
+        self.timeouts += timed_out
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class FunctionRegistry:
+    def __init__(self, entries: dict, max_workers: int = 4):
+        self.entries = entries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="function")
+
+    @classmethod
+    def from_config(cls, config: dict) -> "FunctionRegistry":
+        """只注册同时出现在 functions.__all__ 和配置 functions 列表中的函数"""
+        options = config.get('function_pool', {})
+        default_timeout = options.get('timeout', 5.0)
+        default_concurrency = options.get('max_concurrency', 1)
+
+        configured = config.get('functions')
+        if configured is None:
+            configured = [{"function": name} for name in functions.__all__]
+
+        entries = {}
+        for item in configured:
+            name = item.get('function')
+            if name not in functions.__all__:
+                logger.warning(f"配置中的功能不存在，已忽略: {name}")
+                continue
+            entries[name] = RegisteredFunction(
+                name,
+                getattr(functions, name),
+                timeout=item.get('timeout', default_timeout),
+                max_concurrency=item.get('max_concurrency', default_concurrency),
+                ack_key=functions.ACK_KEYS.get(name),
+            )
+        logger.info(f"已注册功能: {', '.join(entries)}")
+        return cls(entries, max_workers=options.get('max_workers', 4))
+
+    def get(self, name: str) -> RegisteredFunction:
+        try:
+            return self.entries[name]
+        except KeyError:
+            raise UnknownFunction(f"未知功能: {name}") from None
+
+    async def call(self, name: str, *args):
+        """在线程池中执行功能，超时后立即返回，但线程执行完之前不释放并发名额"""
+        entry = self.get(name)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        deadline = loop.time() + entry.timeout
+        try:
+            await asyncio.wait_for(entry.semaphore.acquire(), timeout=entry.timeout)
+        except asyncio.TimeoutError:
+            entry.record((time.perf_counter() - started) * 1000, failed=True, timed_out=True)
+            raise FunctionTimeout(f"功能 {name} 排队超时") from None
+
+        future = loop.run_in_executor(self.executor, entry.func, *args)
+        future.add_done_callback(lambda _: entry.semaphore.release())
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            entry.record((time.perf_counter() - started) * 1000, failed=True, timed_out=True)
+            raise FunctionTimeout(f"功能 {name} 执行超时 ({entry.timeout}s)") from None
+        except Exception:
+            entry.record((time.perf_counter() - started) * 1000, failed=True)
+            raise
+        entry.record((time.perf_counter() - started) * 1000)
+        return result
+
+    def stats(self) -> dict:
+        return {name: entry.stats() for name, entry in self.entries.items()}
+
+    def shutdown(self, cancel_futures: bool = True):
+        """关闭线程池；替换注册表时传 cancel_futures=False，让已提交的调用执行完"""
+        self.executor.shutdown(wait=False, cancel_futures=cancel_futures)
@@ -8,4 +8,13 @@ __all__ = ["switchWorkModeToManual",
             "switchAvatarStatus",
             "switchAvatarStatusToStop",
             "sendAvatarText",
-            "switchScene"]
\ No newline at end of file
+            "switchScene"]
+
+# 各功能对应的 slide monitor 应答字段，slide monitor 执行完成后会把该字段改为 success
+ACK_KEYS = {"switchWorkModeToManual": "work_mode_response",
+            "switchWorkModeToAuto": "work_mode_response",
+            "switchWorkModeToCollaboration": "work_mode_response",
+            "switchAvatarStatus": "avatar_command_response",
+            "switchAvatarStatusToStop": "avatar_command_response",
+            "sendAvatarText": "avatar_command_response",
+            "switchScene": "active_scene_response"}
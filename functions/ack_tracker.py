@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from .running_config import RunningConfigStore
+
+
+class Issued(str):
+    """功能把应答字段写为 issue 后返回的结果文本，只有这种结果才需要等待 slide monitor 确认
+
+    没有下发命令的结果（已经处于该模式、上一次切换还没完成等）返回普通字符串，应答字段里是上一条命令的结果。
+    """
+
+
+class AckTracker:
+    """等待 slide monitor 把 *_response 字段改为 success
+
+    只在有等待者时轮询运行配置文件，轮询间隔可配置；文件没变时只做一次 stat。
+    """
+
+    def __init__(self, store: RunningConfigStore, poll_interval: float = 0.05, timeout: float = 3.0):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._waiters = {}
+        self._cache_key = None
+        self._poller = None
+
+    async def wait_for(self, response_key: str, timeout: float = None) -> dict:
+        """等待指定应答字段变为 success，返回是否确认及耗时"""
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(response_key, []).append(future)
+        # 下一次轮询重新检查整个文件，应答可能在登记之前就已写入
+        self._cache_key = None
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout or self.timeout)
+            acknowledged = True
+        except asyncio.TimeoutError:
+            acknowledged = False
+        finally:
+            waiters = self._waiters.get(response_key, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(response_key, None)
+        return {
+            "acknowledged": acknowledged,
+            "ack_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            try:
+                self._cache_key, config = await loop.run_in_executor(
+                    None, self.store.changed_since, self._cache_key
+                )
+            except (OSError, ValueError) as e:
+                # 文件正被替换或内容不完整，下次再读
+                print(f"读取运行配置失败: {e}")
+                config = None
+            if config is not None:
+                self._resolve(config)
+            await asyncio.sleep(self.poll_interval)
+
+    def _resolve(self, config: dict):
+        for response_key, waiters in list(self._waiters.items()):
+            response = config.get(response_key)
+            if isinstance(response, dict) and response.get("result") == "success":
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(True)
@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import struct
+import time
+from collections import OrderedDict
+
+from .running_config import write_json_atomic
+
+# 每条缓存除文本外的大致开销（键、时间戳、字典槽位）
+ENTRY_OVERHEAD = 128
+
+
+def pcm_payload(view: memoryview) -> memoryview:
+    """取出WAV文件data块中的PCM数据，不是WAV时原样返回
+
+    同一段录音的WAV头可能不同（文件名、LIST块等），只按PCM内容计算缓存键。
+    """
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        return view
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        (chunk_size,) = struct.unpack_from("<I", view, pos + 4)
+        if chunk_id == b"data":
+            return view[pos + 8:pos + 8 + chunk_size]
+        # 块按偶数字节对齐
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return view
+
+
+class ASRCache:
+    """语音识别结果缓存：按PCM内容的哈希查找，LRU + TTL 淘汰，限制总内存，可选持久化到文件"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 1024 * 1024, ttl: float = 7 * 24 * 3600,
+                 max_audio_bytes: int = 10 * 1024 * 1024, persist_path: str = "", save_delay: float = 5.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # 超过这个长度的语音不太可能重复，不计算哈希
+        self.max_audio_bytes = max_audio_bytes
+        self.persist_path = persist_path
+        self.save_delay = save_delay
+        # key -> (text, 写入时间)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self._dirty = False
+        self._save_task = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        if persist_path:
+            self.load()
+
+    def key_for(self, view: memoryview):
+        """计算缓存键，语音过长时返回 None"""
+        pcm = pcm_payload(view)
+        if not len(pcm) or len(pcm) > self.max_audio_bytes:
+            return None
+        return hashlib.blake2b(pcm, digest_size=16).hexdigest()
+
+    def get(self, key: str):
+        item = self.entries.get(key)
+        if item is None:
+            self.stats["misses"] += 1
+            return None
+        text, stored_at = item
+        if time.time() - stored_at > self.ttl:
+            self._pop(key)
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return text
+
+    def put(self, key: str, text: str, stored_at: float = None):
+        if key in self.entries:
+            self._pop(key)
+        self.entries[key] = (text, stored_at or time.time())
+        self.bytes += _cost(text)
+        self.stats["stores"] += 1
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._pop(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+        if self.persist_path:
+            self._dirty = True
+            self._schedule_save()
+
+    def _pop(self, key: str):
+        text, _ = self.entries.pop(key)
+        self.bytes -= _cost(text)
+
+    def snapshot(self) -> dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hit_rate": round(self.stats["hits"] / total, 3) if total else 0.0,
+            **self.stats,
+        }
+
+    def load(self):
+        """从文件加载未过期的缓存，文件不存在或损坏时从空缓存开始"""
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"读取语音识别缓存失败: {e}")
+            return
+        if not isinstance(items, list):
+            print("读取语音识别缓存失败: 文件格式错误")
+            return
+        now = time.time()
+        skipped = 0
+        # 文件中按从旧到新的顺序保存，依次放入即可恢复 LRU 顺序
+        for item in items:
+            try:
+                key, text, stored_at = item
+                if not isinstance(key, str) or not isinstance(text, str):
+                    raise TypeError("键和文本必须是字符串")
+                stored_at = float(stored_at)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            if now - stored_at <= self.ttl:
+                self.put(key, text, stored_at)
+        if skipped:
+            print(f"语音识别缓存文件中有 {skipped} 条格式错误，已跳过")
+        self._dirty = False
+        self.stats["stores"] = 0
+        print(f"已加载语音识别缓存: {len(self.entries)} 条")
+
+    def _schedule_save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+
+    async def flush(self):
+        """把缓存写入文件"""
+        if not self.persist_path or not self._dirty:
+            return
+        self._dirty = False
+        items = [[key, text, stored_at] for key, (text, stored_at) in self.entries.items()]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_json_atomic, self.persist_path, items, None)
+        except OSError as e:
+            print(f"保存语音识别缓存失败: {e}")
+
+
+def _cost(text: str) -> int:
+    return len(text.encode("utf-8")) + ENTRY_OVERHEAD
@@ -0,0 +1,154 @@
+import asyncio
+import ssl
+import time
+
+import websockets
+from websockets.protocol import State
+
+
+class ASRPoolExhausted(Exception):
+    """并发识别会话已达上限"""
+
+
+class FunASRPool:
+    """FunASR长连接池：预热连接、健康检查、断线退避重连、并发会话上限"""
+
+    # 所有连接共用一个SSL上下文
+    _ssl_context = None
+
+    def __init__(self, funasr_host: str, max_sessions: int = 4, warm_connections: int = 1,
+                 ping_interval: float = 20.0, connect_timeout: float = 5.0,
+                 acquire_timeout: float = 5.0, backoff_initial: float = 0.5,
+                 backoff_max: float = 30.0):
+        self.funasr_host = funasr_host
+        self.max_sessions = max_sessions
+        self.warm_connections = min(warm_connections, max_sessions)
+        self.ping_interval = ping_interval
+        self.connect_timeout = connect_timeout
+        self.acquire_timeout = acquire_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self._idle = []
+        self._sessions = asyncio.Semaphore(max_sessions)
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        self._maintainer = None
+        self.stats = {"connects": 0, "connect_failures": 0, "reused": 0, "dropped": 0}
+
+    @classmethod
+    def ssl_context(cls) -> ssl.SSLContext:
+        if cls._ssl_context is None:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+            cls._ssl_context = ssl_context
+        return cls._ssl_context
+
+    async def start(self) -> bool:
+        """启动时预热连接并开始健康检查，返回FunASR服务是否就绪"""
+        if not self.funasr_host:
+            print("FunASR服务未配置，跳过连接预热")
+            return False
+        await self._fill()
+        if self._maintainer is None:
+            self._maintainer = asyncio.create_task(self._maintain())
+        ready = self.ready()
+        print(f"FunASR连接池{'已就绪' if ready else '未就绪，将在后台重连'}: {self.funasr_host}")
+        return ready
+
+    def ready(self) -> bool:
+        return len(self._idle) > 0
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "idle": len(self._idle), "ready": self.ready()}
+
+    async def close(self):
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            self._maintainer = None
+        idle, self._idle = self._idle, []
+        for websocket in idle:
+            await websocket.close()
+
+    async def acquire(self):
+        """取得一个可用连接，优先复用空闲连接"""
+        try:
+            await asyncio.wait_for(self._sessions.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise ASRPoolExhausted(f"FunASR并发会话已达上限: {self.max_sessions}") from None
+        try:
+            while self._idle:
+                websocket = self._idle.pop()
+                if websocket.state is State.OPEN:
+                    self.stats["reused"] += 1
+                    return websocket
+                self.stats["dropped"] += 1
+            return await self._connect()
+        except BaseException:
+            self._sessions.release()
+            raise
+
+    async def release(self, websocket, reusable: bool = True):
+        """归还连接，会话异常结束的连接直接关闭"""
+        try:
+            if (reusable and websocket.state is State.OPEN
+                    and len(self._idle) < self.max_sessions):
+                self._idle.append(websocket)
+            else:
+                self.stats["dropped"] += 1
+                await websocket.close()
+        finally:
+            self._sessions.release()
+
+    async def _connect(self):
+        delay = self._next_attempt - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        uri = self.funasr_host
+        try:
+            websocket = await asyncio.wait_for(websockets.connect(
+                uri, subprotocols=["binary"], ping_interval=None,
+                ssl=self.ssl_context() if uri.startswith("wss://") else None
+            ), timeout=self.connect_timeout)
+        except Exception:
+            self.stats["connect_failures"] += 1
+            self._backoff = min(self.backoff_max, self._backoff * 2 or self.backoff_initial)
+            self._next_attempt = time.monotonic() + self._backoff
+            raise
+        self.stats["connects"] += 1
+        self._backoff = 0.0
+        self._next_attempt = 0.0
+        return websocket
+
+    async def _fill(self):
+        while len(self._idle) < self.warm_connections:
+            try:
+                self._idle.append(await self._connect())
+            except Exception as e:
+                print(f"FunASR连接失败，{self._backoff:.1f}秒后重试: {e}")
+                return
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            for websocket in list(self._idle):
+                if websocket not in self._idle:
+                    # 已被 acquire 取走
+                    continue
+                # 检查期间从空闲列表中取出，不会被 acquire 拿去开始会话
+                self._idle.remove(websocket)
+                try:
+                    pong = await websocket.ping()
+                    await asyncio.wait_for(pong, timeout=self.connect_timeout)
+                except asyncio.CancelledError:
+                    await websocket.close()
+                    raise
+                except Exception:
+                    self.stats["dropped"] += 1
+                    await websocket.close()
+                    continue
+                if len(self._idle) < self.max_sessions:
+                    self._idle.append(websocket)
+                else:
+                    await websocket.close()
+            await self._fill()
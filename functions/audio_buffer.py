@@ -0,0 +1,47 @@
+class AudioBuffer:
+    """一段语音的内存缓冲区：分片只做 memoryview 切片，并统计整条链路的拷贝字节数"""
+
+    def __init__(self, data, source: str = "binary"):
+        self.view = memoryview(data).cast("B")
+        self.source = source
+        self.copies = {}
+        # 识别结果来自缓存
+        self.cache_hit = False
+        # 预处理（重采样、去静音等）的说明，没有预处理时为 None
+        self.preprocess = None
+        # 已知的采样率（解码压缩编码或预处理后得到），None 表示按默认的16kHz处理
+        self.sample_rate = None
+
+    @classmethod
+    def from_base64(cls, content: str) -> "AudioBuffer":
+        """解码base64语音数据，解码本身是唯一的一次拷贝"""
+        import base64
+        buffer = cls(base64.b64decode(content), source="base64")
+        buffer.record_copy("base64_decode", len(buffer.view))
+        return buffer
+
+    def __len__(self):
+        return len(self.view)
+
+    def record_copy(self, stage: str, nbytes: int):
+        self.copies[stage] = self.copies.get(stage, 0) + nbytes
+
+    @property
+    def bytes_copied(self) -> int:
+        return sum(self.copies.values())
+
+    def chunks(self, stride: int):
+        """按 stride 切分音频，返回的是同一块内存上的视图"""
+        for beg in range(0, len(self.view), stride):
+            yield self.view[beg : beg + stride]
+
+    def report(self) -> dict:
+        return {
+            "source": self.source,
+            "bytes": len(self.view),
+            "bytes_copied": self.bytes_copied,
+            "copies": dict(self.copies),
+            "cache_hit": self.cache_hit,
+            "preprocess": self.preprocess,
+            "sample_rate": self.sample_rate,
+        }
@@ -0,0 +1,145 @@
+import numpy as np
+
+from .audio_buffer import AudioBuffer
+
+# 握手时告诉手机服务端支持的语音编码
+# wav: WAV文件或不带头的16位PCM（原来的格式）；pcm: 不带头的16位小端PCM
+AUDIO_ENCODINGS = ("wav", "pcm", "mulaw", "alaw", "ima_adpcm")
+
+# WAV fmt 块中的格式编号
+WAVE_FORMAT_ALAW = 0x0006
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_IMA_ADPCM = 0x0011
+
+DEFAULT_ADPCM_BLOCK_ALIGN = 256
+
+
+class AudioCodecError(ValueError):
+    """编码不支持或数据损坏"""
+
+
+def _mulaw_table() -> np.ndarray:
+    """G.711 μ-law 的256项解码表"""
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    mantissa = u & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_table() -> np.ndarray:
+    """G.711 A-law 的256项解码表"""
+    a = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent = (a >> 4) & 0x07
+    mantissa = a & 0x0F
+    magnitude = np.where(exponent == 0, (mantissa << 4) + 8,
+                         ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    return np.where(a & 0x80, magnitude, -magnitude).astype(np.int16)
+
+
+MULAW_TABLE = _mulaw_table()
+ALAW_TABLE = _alaw_table()
+
+IMA_STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+], dtype=np.int32)
+IMA_INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+
+def _adpcm_tables():
+    """按 (步长索引, 4位码) 预先算好差值和下一个步长索引，解码时每个采样只需两次查表
+
+    表展开成一维，下标为 步长索引 * 16 + 4位码，下一个步长索引也预先乘好16。
+    """
+    step = IMA_STEP_TABLE[:, None]
+    nibble = np.arange(16, dtype=np.int32)[None, :]
+    diff = step >> 3
+    diff = diff + np.where(nibble & 4, step, 0)
+    diff = diff + np.where(nibble & 2, step >> 1, 0)
+    diff = diff + np.where(nibble & 1, step >> 2, 0)
+    diff = np.where(nibble & 8, -diff, diff)
+    next_index = np.clip(np.arange(89, dtype=np.int32)[:, None] + IMA_INDEX_TABLE[None, :], 0, 88)
+    return diff.astype(np.int32).ravel(), (next_index * 16).astype(np.int32).ravel()
+
+
+ADPCM_DIFF, ADPCM_NEXT_INDEX = _adpcm_tables()
+
+
+def decode_mulaw(data) -> np.ndarray:
+    return MULAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def decode_alaw(data) -> np.ndarray:
+    return ALAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def _decode_adpcm_blocks(blocks: np.ndarray) -> np.ndarray:
+    """同时解码多个块：块之间互不依赖，按块向量化，块内逐个采样推进"""
+    predictor = (blocks[:, 0].astype(np.int32) | (blocks[:, 1].astype(np.int32) << 8))
+    predictor = np.where(predictor & 0x8000, predictor - 0x10000, predictor)
+    index = blocks[:, 2].astype(np.int32)
+    if np.any(index > 88):
+        raise AudioCodecError("IMA-ADPCM 块头的步长索引错误")
+    body = blocks[:, 4:]
+    # 每个字节先低4位后高4位；按采样位置排成行，循环里每次取连续的一行
+    nibbles = np.empty((body.shape[1] * 2, len(blocks)), dtype=np.int32)
+    nibbles[0::2] = (body & 0x0F).T
+    nibbles[1::2] = (body >> 4).T
+
+    output = np.empty((nibbles.shape[0] + 1, len(blocks)), dtype=np.int32)
+    output[0] = predictor
+    index = index * 16
+    lookup = np.empty(len(blocks), dtype=np.int32)
+    for i in range(nibbles.shape[0]):
+        np.add(index, nibbles[i], out=lookup)
+        np.add(predictor, ADPCM_DIFF.take(lookup), out=predictor)
+        # np.clip 每次调用的开销是 minimum + maximum 的好几倍
+        np.minimum(predictor, 32767, out=predictor)
+        np.maximum(predictor, -32768, out=predictor)
+        ADPCM_NEXT_INDEX.take(lookup, out=index)
+        output[i + 1] = predictor
+    return output.T.astype(np.int16).reshape(-1)
+
+
+def decode_ima_adpcm(data, block_align: int = DEFAULT_ADPCM_BLOCK_ALIGN) -> np.ndarray:
+    """解码单声道 IMA-ADPCM（与WAV格式0x11相同的分块格式，每块4字节头）"""
+    if block_align <= 4:
+        raise AudioCodecError("IMA-ADPCM 块大小错误")
+    raw = np.frombuffer(data, dtype=np.uint8)
+    full = len(raw) // block_align
+    parts = []
+    if full:
+        parts.append(_decode_adpcm_blocks(raw[:full * block_align].reshape(full, block_align)))
+    tail = raw[full * block_align:]
+    if len(tail) >= 4:
+        # 最后一个不完整的块
+        parts.append(_decode_adpcm_blocks(tail.reshape(1, -1)))
+    if not parts:
+        return np.zeros(0, dtype=np.int16)
+    return np.concatenate(parts)
+
+
+def decode(data, encoding: str, block_align: int = None) -> np.ndarray:
+    """把压缩的语音解码为16位PCM采样"""
+    if encoding == "mulaw":
+        return decode_mulaw(data)
+    if encoding == "alaw":
+        return decode_alaw(data)
+    if encoding == "ima_adpcm":
+        return decode_ima_adpcm(data, block_align or DEFAULT_ADPCM_BLOCK_ALIGN)
+    raise AudioCodecError(f"不支持的语音编码: {encoding}")
+
+
+def decode_audio(audio: AudioBuffer, encoding: str, sample_rate: int = None, block_align: int = None) -> AudioBuffer:
+    """解码 AudioBuffer，返回16位PCM的新 AudioBuffer，拷贝统计沿用原来的"""
+    pcm = decode(audio.view, encoding, block_align).astype("<i2", copy=False).tobytes()
+    decoded = AudioBuffer(pcm, source=audio.source)
+    decoded.copies = dict(audio.copies)
+    decoded.record_copy(f"{encoding}_decode", len(pcm))
+    decoded.sample_rate = sample_rate
+    return decoded
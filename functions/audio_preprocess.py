@@ -0,0 +1,230 @@
+import struct
+
+import numpy as np
+
+from . import audio_codec
+from .audio_buffer import AudioBuffer
+
+# FunASR 需要的格式: 16kHz 单声道 16位 PCM
+TARGET_RATE = 16000
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# WAV里的压缩编码，交给 audio_codec 解码
+WAVE_CODECS = {
+    audio_codec.WAVE_FORMAT_ALAW: "alaw",
+    audio_codec.WAVE_FORMAT_MULAW: "mulaw",
+    audio_codec.WAVE_FORMAT_IMA_ADPCM: "ima_adpcm",
+}
+
+
+class WavFormatError(ValueError):
+    """不支持或损坏的WAV数据"""
+
+
+def parse_wav(view: memoryview):
+    """解析RIFF/WAVE头，返回 (格式字典, data块视图)；不是WAV时返回 (None, 原视图)"""
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        return None, view
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        (chunk_size,) = struct.unpack_from("<I", view, pos + 4)
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if chunk_size < 16:
+                raise WavFormatError("fmt 块长度错误")
+            format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", view, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # 子格式GUID的前两个字节就是实际的格式
+                (format_tag,) = struct.unpack_from("<H", view, body + 24)
+            fmt = {"format_tag": format_tag, "channels": channels, "sample_rate": sample_rate, "bits": bits,
+                   "block_align": block_align}
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavFormatError("data 块之前缺少 fmt 块")
+            # 录音中断时 data 长度可能大于实际数据，按实际长度截取
+            return fmt, view[body:min(body + chunk_size, len(view))]
+        # 块按偶数字节对齐
+        pos = body + chunk_size + (chunk_size & 1)
+    raise WavFormatError("缺少 data 块")
+
+
+def to_float(data: memoryview, fmt: dict) -> np.ndarray:
+    """把PCM数据转换为 [-1, 1] 的 float32 数组，形状为 (帧数, 声道数)"""
+    channels = fmt["channels"] or 1
+    bits = fmt["bits"]
+    format_tag = fmt["format_tag"]
+    if format_tag in WAVE_CODECS:
+        if channels != 1:
+            raise WavFormatError(f"压缩编码的WAV只支持单声道: format={format_tag}, channels={channels}")
+        try:
+            samples = audio_codec.decode(data, WAVE_CODECS[format_tag], fmt.get("block_align"))
+        except audio_codec.AudioCodecError as e:
+            raise WavFormatError(str(e)) from None
+        return (samples.astype(np.float32) / 32768.0).reshape(-1, 1)
+    frame_bytes = channels * bits // 8
+    if frame_bytes <= 0:
+        raise WavFormatError("声道数或位深错误")
+    data = data[:len(data) - len(data) % frame_bytes]
+
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(data, dtype="<f4").astype(np.float32)
+    elif format_tag == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    elif format_tag == WAVE_FORMAT_PCM and bits == 8:
+        # 8位PCM是无符号的
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif format_tag == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8)
+                | (raw[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608.0
+    elif format_tag == WAVE_FORMAT_PCM and bits == 32:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise WavFormatError(f"不支持的WAV格式: format={format_tag}, bits={bits}")
+    return samples.reshape(-1, channels)
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """多声道取平均合成单声道"""
+    if samples.ndim == 1:
+        return samples
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def _lowpass_kernel(cutoff: float, taps: int = 63) -> np.ndarray:
+    """加窗sinc低通滤波器，cutoff 为相对采样率的截止频率（0~0.5）"""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int = TARGET_RATE) -> np.ndarray:
+    """重采样；降采样前先低通滤波防止混叠，整数倍时直接抽取"""
+    if src_rate == dst_rate or not len(samples):
+        return samples
+    if src_rate > dst_rate:
+        kernel = _lowpass_kernel(0.5 * dst_rate / src_rate * 0.9)
+        if src_rate % dst_rate == 0:
+            # 整数倍抽取只计算保留下来的那些输出点
+            half = len(kernel) // 2
+            padded = np.pad(samples, (half, half))
+            windows = np.lib.stride_tricks.sliding_window_view(padded, len(kernel))[::src_rate // dst_rate]
+            return (windows @ kernel[::-1]).astype(np.float32)
+        samples = np.convolve(samples, kernel, mode="same")
+    count = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.arange(count, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def normalize(samples: np.ndarray, target_peak: float = 0.9, max_gain: float = 10.0) -> np.ndarray:
+    """按峰值归一化，放大倍数有上限，避免把底噪放大成“语音”"""
+    if not len(samples):
+        return samples
+    peak = float(np.max(np.abs(samples)))
+    if peak <= 0:
+        return samples
+    gain = min(max_gain, target_peak / peak)
+    return samples * np.float32(gain)
+
+
+def voiced_range(samples: np.ndarray, rate: int, frame_ms: float = 20.0, threshold_db: float = -45.0,
+                 noise_margin_db: float = 12.0, padding_ms: float = 200.0):
+    """基于短时能量的语音端点检测，返回需要保留的 [start, end) 采样范围，没有语音时返回 None
+
+    阈值取固定门限和“底噪 + noise_margin_db”中较高的一个，底噪按能量最低的10%帧估计；
+    整段没有明显的静音段时只用固定门限。
+    """
+    frame = max(1, int(rate * frame_ms / 1000))
+    count = len(samples) // frame
+    if count == 0:
+        return (0, len(samples)) if len(samples) else None
+    frames = samples[:count * frame].reshape(count, frame)
+    energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    noise_floor = float(np.percentile(energy_db, 10))
+    if float(energy_db.max()) - noise_floor < noise_margin_db:
+        # 整段能量相差不大（全是语音或全是静音），估计不出底噪，只按固定门限判断
+        threshold = threshold_db
+    else:
+        threshold = max(threshold_db, noise_floor + noise_margin_db)
+    voiced = np.flatnonzero(energy_db > threshold)
+    if not len(voiced):
+        return None
+    padding = int(rate * padding_ms / 1000)
+    start = max(0, voiced[0] * frame - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame + padding)
+    return start, end
+
+
+def to_int16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+class AudioPreprocessor:
+    """把手机发来的语音整理成FunASR需要的格式：解析WAV头、合成单声道、重采样到16kHz、归一化、去掉首尾静音
+
+    不是WAV的数据按单声道16位PCM处理，采样率取 AudioBuffer.sample_rate，没有时用 raw_rate。
+    """
+
+    def __init__(self, target_rate: int = TARGET_RATE, raw_rate: int = TARGET_RATE, normalize: bool = True,
+                 target_peak: float = 0.9, max_gain: float = 10.0, trim_silence: bool = True,
+                 frame_ms: float = 20.0, threshold_db: float = -45.0, noise_margin_db: float = 12.0,
+                 padding_ms: float = 200.0):
+        self.target_rate = target_rate
+        self.raw_rate = raw_rate
+        self.normalize = normalize
+        self.target_peak = target_peak
+        self.max_gain = max_gain
+        self.trim_silence = trim_silence
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.padding_ms = padding_ms
+
+    def process(self, view: memoryview, sample_rate: int = None):
+        """返回 (16kHz单声道16位PCM字节, 处理说明)"""
+        fmt, data = parse_wav(view)
+        is_wav = fmt is not None
+        if not is_wav:
+            fmt = {"format_tag": WAVE_FORMAT_PCM, "channels": 1, "sample_rate": sample_rate or self.raw_rate,
+                   "bits": 16}
+        samples = downmix(to_float(data, fmt))
+        samples = resample(samples, fmt["sample_rate"], self.target_rate)
+        input_ms = len(samples) * 1000 // self.target_rate
+
+        if self.trim_silence:
+            span = voiced_range(samples, self.target_rate, self.frame_ms, self.threshold_db,
+                                self.noise_margin_db, self.padding_ms)
+            samples = samples[span[0]:span[1]] if span else samples[:0]
+        if self.normalize:
+            samples = normalize(samples, self.target_peak, self.max_gain)
+
+        pcm = to_int16(samples)
+        report = {
+            "wav": is_wav,
+            "sample_rate": fmt["sample_rate"],
+            "channels": fmt["channels"],
+            "bits": fmt["bits"],
+            "input_bytes": len(view),
+            "output_bytes": len(pcm),
+            "input_ms": input_ms,
+            "output_ms": len(pcm) * 500 // self.target_rate,
+        }
+        return pcm, report
+
+    def apply(self, audio: AudioBuffer) -> AudioBuffer:
+        """处理一段语音，返回新的 AudioBuffer，拷贝统计沿用原来的"""
+        pcm, report = self.process(audio.view, audio.sample_rate)
+        processed = AudioBuffer(pcm, source=audio.source)
+        processed.copies = dict(audio.copies)
+        processed.record_copy("preprocess", len(pcm))
+        processed.preprocess = report
+        processed.sample_rate = self.target_rate
+        return processed
@@ -0,0 +1,179 @@
+import asyncio
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+CONFIG_FILE_NAME = "slide_monitor_running_config.json"
+
+# 默认目录：SLIDE_MONITOR_CONFIG_DIR > TEMP > 系统临时目录，可通过 configure() 修改
+_default_directory = None
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class RunningConfigStore:
+    """slide monitor 运行配置文件的共享存储
+
+    - 按 (mtime, size) 缓存解析结果，文件没变就不重新读
+    - 写入先写临时文件再 rename，不会留下写了一半的文件
+    - 并发更新不同字段时合并为一次写入
+    - aread/aupdate 在线程池中执行文件读写，不阻塞事件循环
+    """
+
+    def __init__(self, config_file: str):
+        self.path = config_file
+        self._cache_key = None
+        self._cache = None
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._next_batch = 1
+        self._flushed_batch = 0
+        self._writing = False
+        self._errors = {}
+        self.stats = {"reads": 0, "cache_hits": 0, "writes": 0, "merged_updates": 0}
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _stat_key(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self) -> dict:
+        """返回缓存的文档（内部对象，不要修改）"""
+        key = self._stat_key()
+        if key == self._cache_key:
+            self.stats["cache_hits"] += 1
+            return self._cache
+        with open(self.path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.stats["reads"] += 1
+        self._cache_key, self._cache = key, config
+        return config
+
+    def read(self) -> dict:
+        """读取当前配置，返回副本，调用方可以随意修改"""
+        return copy.deepcopy(self._load())
+
+    def changed_since(self, cache_key):
+        """文件自 cache_key 之后有变化时返回 (新key, 配置副本)，否则返回 (cache_key, None)"""
+        key = self._stat_key()
+        if key == cache_key:
+            return cache_key, None
+        config = self._load()
+        return self._cache_key, copy.deepcopy(config)
+
+    def get(self, key: str, default=None):
+        return copy.deepcopy(self._load().get(key, default))
+
+    def update(self, changes: dict) -> dict:
+        """更新顶层字段并写回文件，返回写入后的配置副本"""
+        with self._cond:
+            self._pending.update(changes)
+            batch = self._next_batch
+            # 已有线程在写，等它把这批更新一起写掉
+            while self._writing and self._flushed_batch < batch:
+                self._cond.wait()
+            if self._flushed_batch >= batch:
+                self.stats["merged_updates"] += 1
+                error = self._errors.get(batch)
+                if error is not None:
+                    raise error
+                return copy.deepcopy(self._cache)
+            self._writing = True
+
+        try:
+            while True:
+                with self._cond:
+                    if not self._pending:
+                        break
+                    pending, self._pending = self._pending, {}
+                    batch = self._next_batch
+                    self._next_batch += 1
+                error = None
+                try:
+                    self._write(pending)
+                except Exception as e:
+                    error = e
+                with self._cond:
+                    if error is not None:
+                        self._errors = {batch: error}
+                    self._flushed_batch = batch
+                    self._cond.notify_all()
+                if error is not None:
+                    raise error
+        finally:
+            with self._cond:
+                self._writing = False
+                # 出错退出时可能还有别的线程的更新没写，唤醒它们让其中一个接着写
+                self._cond.notify_all()
+        return copy.deepcopy(self._cache)
+
+    def _write(self, changes: dict):
+        config = dict(self._load())
+        config.update(changes)
+        write_json_atomic(self.path, config)
+        self.stats["writes"] += 1
+        self._cache_key, self._cache = self._stat_key(), config
+
+    async def aread(self) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(None, self.read)
+
+    async def aupdate(self, changes: dict) -> dict:
+        return await asyncio.get_running_loop().run_in_executor(None, self.update, changes)
+
+
+def write_json_atomic(path: str, data, indent: int = 4):
+    """先写同目录下的临时文件再替换，读的一方不会看到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = "." + os.path.splitext(os.path.basename(path))[0] + "_"
+    fd, temp_path = tempfile.mkstemp(prefix=prefix, suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        _replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def _replace(src: str, dst: str, retries: int = 5):
+    # Windows 上对方正在读文件时 rename 可能失败，短暂重试
+    for attempt in range(retries):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.01 * (attempt + 1))
+
+
+def configure(directory: str = None):
+    """设置运行配置文件所在目录（测试时可指向临时目录）"""
+    global _default_directory
+    with _stores_lock:
+        _default_directory = directory
+        _stores.clear()
+
+
+def default_path() -> str:
+    directory = (_default_directory
+                 or os.getenv("SLIDE_MONITOR_CONFIG_DIR")
+                 or os.getenv("TEMP")
+                 or tempfile.gettempdir())
+    return os.path.join(directory, CONFIG_FILE_NAME)
+
+
+def get_store(config_file: str = None) -> RunningConfigStore:
+    """取得共享的存储实例，同一个文件只有一个实例"""
+    path = os.path.abspath(config_file or default_path())
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = RunningConfigStore(path)
+        return store
@@ -0,0 +1,63 @@
+import asyncio
+
+from .running_config import RunningConfigStore
+
+# 需要推送给客户端的运行状态字段
+STATE_KEYS = ("work_mode", "avatar_command", "active_scene")
+
+
+class StateWatcher:
+    """监视运行配置中的状态字段，变化时回调 on_change(当前状态, 变化的字段列表)
+
+    不论变化来自哪台手机还是主机本身（slide monitor 或手动修改），都只看文件内容。
+    """
+
+    def __init__(self, store: RunningConfigStore, on_change, keys=STATE_KEYS, poll_interval: float = 0.2):
+        self.store = store
+        self.on_change = on_change
+        self.keys = tuple(keys)
+        self.poll_interval = poll_interval
+        self.state = {}
+        self._cache_key = None
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return dict(self.state)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        first = True
+        while True:
+            try:
+                self._cache_key, config = await loop.run_in_executor(
+                    None, self.store.changed_since, self._cache_key
+                )
+            except (OSError, ValueError) as e:
+                # 文件不存在或正被替换，下次再读
+                print(f"读取运行配置失败: {e}")
+                config = None
+            if config is not None:
+                state = {key: config.get(key) for key in self.keys}
+                changed = [key for key in self.keys if state[key] != self.state.get(key)]
+                self.state = state
+                # 第一次读取只记录初始状态
+                if changed and not first:
+                    try:
+                        await self.on_change(dict(state), changed)
+                    except Exception as e:
+                        print(f"推送状态变化失败: {e}")
+                first = False
+            await asyncio.sleep(self.poll_interval)
@@ -1,108 +1,187 @@
-class VoiceASR:
-    def __init__(self, funasr_host=""):
-        self.funasr_host = funasr_host
+import asyncio
+import json
 
-    async def call_funasr_service(self, audio_file_path: str, msg_id: str) -> str:
-        """调用FunASR服务进行语音识别"""
+import websockets
+
+from .asr_cache import ASRCache
+from .asr_pool import FunASRPool
+from .audio_buffer import AudioBuffer
+
+
+class VoiceASRStream:
+    """一次FunASR 2pass识别会话：边收音频边转发，识别结果实时回调"""
+
+    def __init__(self, pool: FunASRPool, session_id: str, on_result=None,
+                 sample_rate: int = 16000, mode: str = "2pass-online",
+                 result_timeout: float = 10.0):
+        self.pool = pool
+        self.session_id = session_id
+        self.on_result = on_result
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.result_timeout = result_timeout
+        self.chunk_size = [5, 10, 5]
+        self.chunk_interval = 10
+        self.websocket = None
+        self.segments = []
+        self.bytes_sent = 0
+        # 是否收到了最终识别结果；超时或连接断开时 finish 返回的只是已收到的部分结果
+        self.completed = False
+        self._final = None
+        self._receiver = None
+
+    @property
+    def stride(self) -> int:
+        """每个音频分片的字节数"""
+        return int(60 * self.chunk_size[1] / self.chunk_interval / 1000 * self.sample_rate * 2)
+
+    async def open(self):
+        """从连接池取得连接并发送初始化消息"""
+        self.websocket = await self.pool.acquire()
+
+        # 发送初始化消息
+        init_message = json.dumps({
+            "mode": self.mode,
+            "chunk_size": self.chunk_size,
+            "chunk_interval": self.chunk_interval,
+            "encoder_chunk_look_back": 4,
+            "decoder_chunk_look_back": 0,
+            "audio_fs": self.sample_rate,
+            "wav_name": f"voice_{self.session_id}",
+            "wav_format": "pcm",
+            "is_speaking": True,
+            "hotwords": "",
+            "itn": True,
+        })
+        try:
+            await self.websocket.send(init_message)
+        except Exception:
+            await self.close(reusable=False)
+            raise
+
+        self._final = asyncio.get_running_loop().create_future()
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def feed(self, data):
+        """转发一段音频数据"""
+        await self.websocket.send(data)
+        self.bytes_sent += len(data)
+
+    async def finish(self, timeout: float = None) -> str:
+        """发送结束标志并等待最终识别结果，收到最终结果即返回
+
+        超时或连接断开时返回已收到的部分结果，completed 为 False。
+        """
+        completed = False
         try:
-            import asyncio
-            import websockets
-            import json
-            import ssl
-            
-            # FunASR服务配置（参考funasr_wss_client.py）
-            mode = "2pass-online"      #2pass #offline      # 识别模式
-            
-            # 读取音频文件
-            with open(audio_file_path, "rb") as f:
-                audio_bytes = f.read()
-            
-            # 计算音频参数
-            sample_rate = 16000
-            chunk_size = [5, 10, 5]
-            chunk_interval = 10
-            stride = int(60 * chunk_size[1] / chunk_interval / 1000 * sample_rate * 2)
-            chunk_num = (len(audio_bytes) - 1) // stride + 1
-
-            # 连接FunASR服务
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            # uri = "wss://{}:{}".format(funasr_host, funasr_port)
-            uri = self.funasr_host
-
-            async with websockets.connect(
-                uri, subprotocols=["binary"], ping_interval=None, ssl=ssl_context
-            ) as websocket:
-
-                # 发送初始化消息
-                init_message = json.dumps({
-                    "mode": mode,
-                    "chunk_size": chunk_size,
-                    "chunk_interval": chunk_interval,
-                    "encoder_chunk_look_back": 4,
-                    "decoder_chunk_look_back": 0,
-                    "audio_fs": sample_rate,
-                    "wav_name": f"voice_{msg_id}",
-                    "wav_format": "pcm",
-                    "is_speaking": True,
-                    "hotwords": "",
-                    "itn": True,
-                })
-
-                await websocket.send(init_message)
-                
-                # 发送音频数据
-                for i in range(chunk_num):
-                    beg = i * stride
-                    data = audio_bytes[beg : beg + stride]
-                    await websocket.send(data)
-                    
-                    if i == chunk_num - 1:
-                        # 发送结束标志
-                        end_message = json.dumps({"is_speaking": False})
-                        await websocket.send(end_message)
-                
-                # 接收识别结果
-                max_wait_time = 10  # 最大等待时间10秒
-                start_time = asyncio.get_event_loop().time()
-                asr_text = []
-                while True:
-                    # 检查是否超时
-                    current_time = asyncio.get_event_loop().time()
-                    if current_time - start_time > max_wait_time:
-                        print(f"FunASR服务响应超时 (ID: {msg_id})")
-                        break
-                    
+            await self.websocket.send(json.dumps({"is_speaking": False}))
+            completed = await asyncio.wait_for(
+                asyncio.shield(self._final), timeout=timeout or self.result_timeout
+            )
+        except asyncio.TimeoutError:
+            print(f"FunASR服务响应超时 (ID: {self.session_id})")
+        except websockets.exceptions.ConnectionClosed:
+            print(f"FunASR连接已关闭 (ID: {self.session_id})")
+        finally:
+            # 只有正常收到最终结果的连接才放回连接池
+            self.completed = bool(completed)
+            await self.close(reusable=self.completed)
+        return "".join(self.segments)
+
+    async def close(self, reusable: bool = False):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            self._receiver = None
+        if self.websocket is not None:
+            websocket, self.websocket = self.websocket, None
+            await self.pool.release(websocket, reusable=reusable)
+
+    async def _receive(self):
+        """接收识别结果，中间结果和最终结果都会回调给 on_result"""
+        try:
+            async for response in self.websocket:
+                response_data = json.loads(response)
+                print(f"FunASR识别响应: {response_data}")
+
+                if "stamp_sents" in response_data:
+                    self.segments.append(response_data.get("text", ""))
+
+                if self.on_result is not None:
                     try:
-                        # 设置接收超时
-                        response = await asyncio.wait_for(websocket.recv(), timeout=5.0)
-                        response_data = json.loads(response)
-                        print(f"FunASR识别响应: {response_data}")
-
-                        if "stamp_sents" in response_data:
-                            asr_text.append(response_data.get("text", ""))
-
-                        recognized_text = response_data.get("text", "")
-                        # 判断结束标记
-                        if response_data.get("is_final", False) == True:
-                            print(f"FunASR识别结果 (ID: {msg_id}): {recognized_text}")
-                            break
-                        else:
-                            print(f"FunASR识别分段 (ID: {msg_id}): {recognized_text}")
-
-                    except asyncio.TimeoutError:
-                        print(f"等待FunASR响应超时 (ID: {msg_id})")
-                        break
-                    except websockets.exceptions.ConnectionClosed:
-                        print(f"FunASR连接已关闭 (ID: {msg_id})")
-                        break
+                        await self.on_result(response_data)
                     except Exception as e:
-                        print(f"接收FunASR响应时发生错误 (ID: {msg_id}): {e}")
-                        break
-                
-                return "".join(asr_text)
-                
+                        print(f"转发识别结果失败 (ID: {self.session_id}): {e}")
+
+                recognized_text = response_data.get("text", "")
+                # 判断结束标记
+                if response_data.get("is_final", False) == True:
+                    print(f"FunASR识别结果 (ID: {self.session_id}): {recognized_text}")
+                    self._final.set_result(True)
+                    break
+                else:
+                    print(f"FunASR识别分段 (ID: {self.session_id}): {recognized_text}")
+        except websockets.exceptions.ConnectionClosed:
+            print(f"FunASR连接已关闭 (ID: {self.session_id})")
+        except Exception as e:
+            print(f"接收FunASR响应时发生错误 (ID: {self.session_id}): {e}")
+        finally:
+            if not self._final.done():
+                self._final.set_result(False)
+
+
+class VoiceASR:
+    def __init__(self, funasr_host="", pool: FunASRPool = None, result_timeout: float = 10.0,
+                 cache: ASRCache = None):
+        self.funasr_host = funasr_host
+        self.pool = pool or FunASRPool(funasr_host, warm_connections=0)
+        self.result_timeout = result_timeout
+        # 识别结果缓存，同一段语音再次发送时不再请求FunASR
+        self.cache = cache
+
+    def open_stream(self, session_id: str, on_result=None, sample_rate: int = 16000) -> VoiceASRStream:
+        """创建流式识别会话，调用方负责 open/feed/finish"""
+        return VoiceASRStream(self.pool, session_id, on_result=on_result,
+                              sample_rate=sample_rate, result_timeout=self.result_timeout)
+
+    async def recognize(self, audio: AudioBuffer, msg_id: str) -> str:
+        """识别内存中的整段语音，按分片视图发送，不落盘也不复制"""
+        if not len(audio):
+            # 预处理后没有语音（整段都是静音）
+            return ""
+        key = self.cache.key_for(audio.view) if self.cache is not None else None
+        if key is not None:
+            text = self.cache.get(key)
+            if text is not None:
+                audio.cache_hit = True
+                return text
+        try:
+            text, completed = await self._recognize(audio, msg_id)
         except Exception as e:
             print(f"调用FunASR服务失败 (ID: {msg_id}): {e}")
-            return f"语音识别服务错误: {str(e)}"
\ No newline at end of file
+            return f"语音识别服务错误: {str(e)}"
+        # 识别为空（静音等）或没有收到最终结果（超时、连接断开）时不缓存
+        if key is not None and text and completed:
+            self.cache.put(key, text)
+        return text
+
+    async def _recognize(self, audio: AudioBuffer, msg_id: str) -> tuple:
+        """返回 (识别文本, 是否收到最终结果)"""
+        stream = self.open_stream(msg_id, sample_rate=audio.sample_rate or 16000)
+        await stream.open()
+        try:
+            # 发送音频数据
+            for chunk in audio.chunks(stream.stride):
+                await stream.feed(chunk)
+        except Exception:
+            await stream.close()
+            raise
+        text = await stream.finish()
+        return text, stream.completed
+
+    async def call_funasr_service(self, audio_file_path: str, msg_id: str) -> str:
+        """调用FunASR服务识别音频文件"""
+        # 读取音频文件
+        with open(audio_file_path, "rb") as f:
+            audio = AudioBuffer(f.read(), source="file")
+        audio.record_copy("file_read", len(audio))
+        return await self.recognize(audio, msg_id)
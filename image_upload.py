@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+图片上传
+
+- 分块上传：image_begin 开始（或续传），二进制帧 image_chunk 按序号发送数据，image_end 结束并校验
+- 收到的数据直接追加写入临时文件，内存里只有还没写盘的分块；每个客户端和全局都有内存预算，
+  超出预算时暂停读取该连接的后续消息，由 TCP 把压力传回手机
+- 完成的图片按 sha256 放进有大小上限的 LRU 缓存（文件 + 缩略图），重复发送同一张图片直接命中
+- 断线后在 resume_ttl 秒内用同一个 upload_id 再次 image_begin 可以从断点继续
+- 缓存只在内存中索引，启动时删除临时目录里上次运行留下的未完成上传和图片文件
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 临时目录中由本模块创建的文件：未完成的上传和按 sha256 命名的图片
+SPOOL_FILE = re.compile(r"upload_[0-9a-f]{32}\.part|[0-9a-f]{64}")
+
+
+class UploadError(Exception):
+    """上传请求不合法"""
+
+
+class MemoryBudget:
+    """异步内存预算，申请不到时等待释放"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        async with self._cond:
+            # 单块超过预算时，等预算全部空出后也放行，避免永远等待
+            await self._cond.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+
+    async def release(self, size: int):
+        async with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+
+class ImageEntry:
+    __slots__ = ("sha256", "path", "size", "width", "height", "thumbnail")
+
+    def __init__(self, sha256, path, size, width=None, height=None, thumbnail=None):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.width = width
+        self.height = height
+        self.thumbnail = thumbnail
+
+    @property
+    def cost(self) -> int:
+        return self.size + len(self.thumbnail or b"")
+
+    def describe(self) -> dict:
+        return {"sha256": self.sha256, "size": self.size, "width": self.width, "height": self.height}
+
+
+class ImageCache:
+    """按 sha256 索引的 LRU 缓存，超出 max_bytes 时删除最久未用的图片文件"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, sha256: str):
+        entry = self.entries.get(sha256)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(sha256)
+        self.stats["hits"] += 1
+        return entry
+
+    def put(self, entry: ImageEntry):
+        old = self.entries.pop(entry.sha256, None)
+        if old is not None:
+            self.bytes -= old.cost
+        self.entries[entry.sha256] = entry
+        self.bytes += entry.cost
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.cost
+            self.stats["evictions"] += 1
+            _remove(evicted.path)
+
+    def snapshot(self) -> dict:
+        return {"images": len(self.entries), "bytes": self.bytes, **self.stats}
+
+
+class Upload:
+    def __init__(self, upload_id: str, owner, size: int, sha256: str, path: str):
+        self.upload_id = upload_id
+        self.owner = owner
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.next_seq = 0
+        # 已排队（不一定已写盘）的字节数
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.file = None
+        self.queue = asyncio.Queue()
+        self.writer = None
+        self.error = None
+        self.touched_at = time.monotonic()
+
+
+class ImageUploads:
+    def __init__(self, spool_dir: str = None, max_image_bytes: int = 20 * 1024 * 1024,
+                 max_chunk_bytes: int = 1024 * 1024, client_budget: int = 4 * 1024 * 1024,
+                 global_budget: int = 16 * 1024 * 1024, resume_ttl: float = 300.0,
+                 cache_max_bytes: int = 200 * 1024 * 1024, thumbnail_size=(320, 180)):
+        self.spool_dir = spool_dir or os.path.join(tempfile.gettempdir(), "multiscreenmate_images")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._clean_spool()
+        self.max_image_bytes = max_image_bytes
+        self.max_chunk_bytes = max_chunk_bytes
+        self.client_budget = client_budget
+        self.resume_ttl = resume_ttl
+        self.thumbnail_size = tuple(thumbnail_size)
+        self.budget = MemoryBudget(global_budget)
+        self.client_budgets = {}
+        self.uploads = {}
+        self.cache = ImageCache(cache_max_bytes)
+        self.stats = {"completed": 0, "resumed": 0, "expired": 0, "bytes_received": 0}
+
+    def _clean_spool(self):
+        """删除上次运行留下的文件：未完成的上传不能再续传，图片不在本次的缓存索引里，不会再被用到"""
+        removed = 0
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError as e:
+            logger.warning(f"读取图片临时目录失败: {e}")
+            return
+        for name in names:
+            if SPOOL_FILE.fullmatch(name):
+                _remove(os.path.join(self.spool_dir, name))
+                removed += 1
+        if removed:
+            logger.info(f"已清理图片临时目录中上次运行留下的 {removed} 个文件")
+
+    def snapshot(self) -> dict:
+        return {
+            "uploads": len(self.uploads),
+            "buffered_bytes": self.budget.used,
+            "cache": self.cache.snapshot(),
+            **self.stats,
+        }
+
+    def _client_budget(self, owner) -> MemoryBudget:
+        budget = self.client_budgets.get(owner)
+        if budget is None:
+            budget = self.client_budgets[owner] = MemoryBudget(self.client_budget)
+        return budget
+
+    async def begin(self, owner, content: dict) -> dict:
+        """开始或续传一次上传，返回回复字段"""
+        self._expire()
+        sha256 = content.get('sha256')
+        if sha256:
+            entry = self.cache.get(sha256)
+            if entry is not None:
+                return {"cached": True, **entry.describe()}
+
+        upload_id = content.get('upload_id')
+        upload = self.uploads.get(upload_id) if upload_id else None
+        if upload is not None:
+            if upload.owner != owner:
+                raise UploadError("上传ID属于其它客户端")
+            if upload.error is not None:
+                raise UploadError(f"上传已失败: {upload.error}")
+            upload.touched_at = time.monotonic()
+            self.stats["resumed"] += 1
+            return {"upload_id": upload.upload_id, "next_seq": upload.next_seq, "received": upload.received,
+                    "chunk_size": self.max_chunk_bytes}
+
+        size = content.get('size')
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("size 应为正整数")
+        if size > self.max_image_bytes:
+            raise UploadError(f"图片过大，上限 {self.max_image_bytes} 字节")
+        upload_id = upload_id or uuid.uuid4().hex
+        path = os.path.join(self.spool_dir, f"upload_{uuid.uuid4().hex}.part")
+        upload = self.uploads[upload_id] = Upload(upload_id, owner, size, sha256, path)
+        return {"upload_id": upload_id, "next_seq": 0, "received": 0, "chunk_size": self.max_chunk_bytes}
+
+    async def chunk(self, owner, upload_id: str, seq: int, data, reply):
+        """接收一个分块：申请内存预算后排队写盘，写完后调用 reply(回复字段)
+
+        预算不足时在这里等待，调用方（连接的读循环）随之暂停读取。
+        """
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.owner != owner:
+            raise UploadError("上传不存在或已过期")
+        if upload.error is not None:
+            raise UploadError(f"上传已失败: {upload.error}")
+        if seq < upload.next_seq:
+            # 重发的分块，已经收到过
+            await reply({"upload_id": upload_id, "next_seq": upload.next_seq, "duplicate": True})
+            return
+        if seq != upload.next_seq:
+            raise UploadError(f"分块序号不连续，应为 {upload.next_seq}")
+        size = len(data)
+        if size > self.max_chunk_bytes:
+            raise UploadError(f"分块过大，上限 {self.max_chunk_bytes} 字节")
+        if upload.received + size > upload.size:
+            raise UploadError("数据超过声明的大小")
+
+        upload.next_seq += 1
+        upload.received += size
+        upload.touched_at = time.monotonic()
+        client_budget = self._client_budget(owner)
+        await client_budget.acquire(size)
+        await self.budget.acquire(size)
+        upload.queue.put_nowait((seq, data, client_budget, reply))
+        if upload.writer is None or upload.writer.done():
+            upload.writer = asyncio.create_task(self._write_chunks(upload))
+
+    async def _write_chunks(self, upload: Upload):
+        loop = asyncio.get_running_loop()
+        while not upload.queue.empty():
+            seq, data, client_budget, reply = upload.queue.get_nowait()
+            try:
+                if upload.error is None:
+                    await loop.run_in_executor(None, self._append, upload, data)
+                    self.stats["bytes_received"] += len(data)
+            except OSError as e:
+                upload.error = str(e)
+                logger.error(f"写入图片临时文件失败 ({upload.upload_id}): {e}")
+            finally:
+                size = len(data)
+                await self.budget.release(size)
+                await client_budget.release(size)
+            response = {"upload_id": upload.upload_id, "seq": seq, "next_seq": upload.next_seq}
+            if upload.error is not None:
+                response["error"] = upload.error
+            try:
+                await reply(response)
+            except Exception:
+                # 连接已断开，等客户端续传
+                pass
+
+    @staticmethod
+    def _append(upload: Upload, data):
+        if upload.file is None:
+            upload.file = open(upload.path, "ab")
+        upload.file.write(data)
+        upload.hasher.update(data)
+
+    async def end(self, owner, upload_id: str) -> dict:
+        """等所有分块写完，校验大小和哈希，生成缩略图放入缓存"""
+        self._expire()
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload.owner != owner:
+            raise UploadError("上传不存在或已过期")
+        if upload.writer is not None:
+            await upload.writer
+        if upload.error is not None:
+            self._discard(upload)
+            raise UploadError(f"上传失败: {upload.error}")
+        if upload.received != upload.size:
+            raise UploadError(f"数据不完整: {upload.received}/{upload.size} 字节")
+        del self.uploads[upload_id]
+        if upload.file is not None:
+            upload.file.close()
+        digest = upload.hasher.hexdigest()
+        if upload.sha256 and upload.sha256 != digest:
+            _remove(upload.path)
+            raise UploadError("sha256 校验失败")
+        entry = await self._store(digest, upload.path, upload.size)
+        return {"cached": False, **entry.describe()}
+
+    async def store_bytes(self, data: bytes) -> dict:
+        """一次性收到的整张图片（base64 的 image 命令）"""
+        if len(data) > self.max_image_bytes:
+            raise UploadError(f"图片过大，上限 {self.max_image_bytes} 字节")
+        digest = hashlib.sha256(data).hexdigest()
+        entry = self.cache.get(digest)
+        if entry is not None:
+            return {"cached": True, **entry.describe()}
+        path = os.path.join(self.spool_dir, f"upload_{uuid.uuid4().hex}.part")
+        await asyncio.get_running_loop().run_in_executor(None, _write_file, path, data)
+        entry = await self._store(digest, path, len(data))
+        return {"cached": False, **entry.describe()}
+
+    async def _store(self, digest: str, spool_path: str, size: int) -> ImageEntry:
+        entry = self.cache.get(digest)
+        if entry is not None:
+            _remove(spool_path)
+            return entry
+        path = os.path.join(self.spool_dir, digest)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, os.replace, spool_path, path)
+        width, height, thumbnail = await loop.run_in_executor(None, self._make_thumbnail, path)
+        entry = ImageEntry(digest, path, size, width, height, thumbnail)
+        self.cache.put(entry)
+        self.stats["completed"] += 1
+        return entry
+
+    def _make_thumbnail(self, path: str):
+        """安装了 Pillow 时生成 JPEG 缩略图，否则只保存原文件"""
+        if Image is None:
+            return None, None, None
+        try:
+            with Image.open(path) as image:
+                width, height = image.size
+                # JPEG 直接按缩小后的尺寸解码，不把整张大图解到内存里
+                image.draft("RGB", self.thumbnail_size)
+                image.thumbnail(self.thumbnail_size)
+                output = io.BytesIO()
+                image.convert("RGB").save(output, "JPEG", quality=80)
+                return width, height, output.getvalue()
+        except Exception as e:
+            logger.warning(f"生成缩略图失败: {e}")
+            return None, None, None
+
+    def _expire(self):
+        now = time.monotonic()
+        for upload in list(self.uploads.values()):
+            if now - upload.touched_at > self.resume_ttl and (upload.writer is None or upload.writer.done()):
+                self.stats["expired"] += 1
+                self._discard(upload)
+        for owner, budget in list(self.client_budgets.items()):
+            if budget.used == 0:
+                del self.client_budgets[owner]
+
+    def _discard(self, upload: Upload):
+        self.uploads.pop(upload.upload_id, None)
+        if upload.file is not None:
+            upload.file.close()
+        _remove(upload.path)
+
+
+def decode_base64(content: str) -> bytes:
+    try:
+        return base64.b64decode(content, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise UploadError(f"Base64解码失败: {e}") from None
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
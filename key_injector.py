@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+按键注入子系统
+
+所有按键都由单独的工作线程通过有界队列依次注入，事件循环只负责投递和等待结果，
+不会再被 pyautogui.PAUSE 或 GetKeyState 之类的同步调用卡住。
+"""
+
+import asyncio
+import ctypes
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+ARROW_KEYS = ('Up', 'Down', 'Left', 'Right')
+
+# 按键序列和宏可以使用的按键，按小写名称查找规范写法
+KEY_NAMES = {name.lower(): name for name in (
+    'Left', 'Right', 'Up', 'Down', 'Space', 'Enter', 'Tab', 'Escape', 'Backspace', 'Delete',
+    'Home', 'End', 'PageUp', 'PageDown',
+    *(f'F{i}' for i in range(1, 13)),
+    *'abcdefghijklmnopqrstuvwxyz0123456789',
+)}
+MODIFIERS = {'ctrl': 'ctrl', 'shift': 'shift', 'alt': 'alt', 'win': 'win'}
+
+# 翻页合并用：相对移动的按键和跳到开头/结尾的按键
+RELATIVE_KEYS = frozenset(('Left', 'Right', 'Up', 'Down', 'PageUp', 'PageDown', 'Space'))
+ABSOLUTE_KEYS = frozenset(('Home', 'End'))
+NAV_STEP = "step"
+NAV_JUMP = "jump"
+
+
+class InjectorBusy(Exception):
+    """注入队列已满"""
+
+
+class KeyBatchError(ValueError):
+    """按键序列格式错误"""
+
+
+class FailSafeTriggered(Exception):
+    """pyautogui 安全保护触发"""
+
+
+class InjectionBackend:
+    """按键注入后端接口"""
+    name = "base"
+
+    def press(self, key: str):
+        raise NotImplementedError
+
+    def hotkey(self, keys: tuple):
+        """依次按下 keys（前面是修饰键），再逆序抬起"""
+        raise NotImplementedError
+
+    def numlock_on(self):
+        """返回 NumLock 是否开启，无法探测时返回 None"""
+        return None
+
+
+class PyAutoGuiBackend(InjectionBackend):
+    name = "pyautogui"
+
+    def __init__(self, pause: float = 0.1, failsafe: bool = True):
+        import pyautogui
+        self.pyautogui = pyautogui
+        # 设置pyautogui安全设置
+        pyautogui.FAILSAFE = failsafe
+        pyautogui.PAUSE = pause
+
+    def press(self, key: str):
+        try:
+            self.pyautogui.press(key)
+        except self.pyautogui.FailSafeException as e:
+            raise FailSafeTriggered(str(e)) from e
+
+    def hotkey(self, keys: tuple):
+        try:
+            self.pyautogui.hotkey(*keys)
+        except self.pyautogui.FailSafeException as e:
+            raise FailSafeTriggered(str(e)) from e
+
+    def numlock_on(self):
+        if sys.platform != 'win32':
+            return None
+        return bool(ctypes.windll.user32.GetKeyState(0x90) & 1)
+
+
+class _MOUSEINPUT(ctypes.Structure):
+    _fields_ = [("dx", ctypes.c_long),
+                ("dy", ctypes.c_long),
+                ("mouseData", ctypes.c_ulong),
+                ("dwFlags", ctypes.c_ulong),
+                ("time", ctypes.c_ulong),
+                ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class _KEYBDINPUT(ctypes.Structure):
+    _fields_ = [("wVk", ctypes.c_ushort),
+                ("wScan", ctypes.c_ushort),
+                ("dwFlags", ctypes.c_ulong),
+                ("time", ctypes.c_ulong),
+                ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class _HARDWAREINPUT(ctypes.Structure):
+    _fields_ = [("uMsg", ctypes.c_ulong),
+                ("wParamL", ctypes.c_ushort),
+                ("wParamH", ctypes.c_ushort)]
+
+
+class _INPUTUNION(ctypes.Union):
+    _fields_ = [("mi", _MOUSEINPUT),
+                ("ki", _KEYBDINPUT),
+                ("hi", _HARDWAREINPUT)]
+
+
+class _INPUT(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_ulong),
+                ("union", _INPUTUNION)]
+
+
+class SendInputBackend(InjectionBackend):
+    """直接调用 Win32 SendInput，一次系统调用完成按下和抬起"""
+    name = "sendinput"
+
+    INPUT_KEYBOARD = 1
+    KEYEVENTF_EXTENDEDKEY = 0x0001
+    KEYEVENTF_KEYUP = 0x0002
+
+    VK_CODES = {
+        'Left': 0x25, 'Up': 0x26, 'Right': 0x27, 'Down': 0x28,
+        'Space': 0x20, 'Enter': 0x0D, 'numlock': 0x90,
+        'Tab': 0x09, 'Escape': 0x1B, 'Backspace': 0x08, 'Delete': 0x2E,
+        'Home': 0x24, 'End': 0x23, 'PageUp': 0x21, 'PageDown': 0x22,
+        'ctrl': 0x11, 'shift': 0x10, 'alt': 0x12, 'win': 0x5B,
+        **{f'F{i}': 0x6F + i for i in range(1, 13)},
+        # 字母和数字的虚拟键码就是大写字符的编码
+        **{c: ord(c.upper()) for c in 'abcdefghijklmnopqrstuvwxyz0123456789'},
+    }
+    EXTENDED_KEYS = {'Left', 'Up', 'Right', 'Down', 'numlock', 'Delete', 'Home', 'End', 'PageUp', 'PageDown', 'win'}
+
+    def __init__(self):
+        if sys.platform != 'win32':
+            raise OSError("SendInput 后端仅支持 Windows")
+        self.user32 = ctypes.windll.user32
+
+    def press(self, key: str):
+        self.hotkey((key,))
+
+    def hotkey(self, keys: tuple):
+        """整个组合键的按下和抬起放在一次 SendInput 调用里"""
+        events = [(key, 0) for key in keys] + [(key, self.KEYEVENTF_KEYUP) for key in reversed(keys)]
+        inputs = (_INPUT * len(events))()
+        for i, (key, up) in enumerate(events):
+            vk = self.VK_CODES.get(key)
+            if vk is None:
+                raise ValueError(f"SendInput 不支持的按键: {key}")
+            flags = self.KEYEVENTF_EXTENDEDKEY if key in self.EXTENDED_KEYS else 0
+            inputs[i].type = self.INPUT_KEYBOARD
+            inputs[i].union.ki = _KEYBDINPUT(vk, 0, flags | up, 0, 0)
+        sent = self.user32.SendInput(len(events), ctypes.byref(inputs), ctypes.sizeof(_INPUT))
+        if sent != len(events):
+            raise OSError(f"SendInput 失败: {ctypes.get_last_error()}")
+
+    def numlock_on(self):
+        return bool(self.user32.GetKeyState(0x90) & 1)
+
+
+class RecordingBackend(InjectionBackend):
+    """只记录按键的假后端，用于无桌面环境下的测试和压测"""
+    name = "recording"
+
+    def __init__(self, press_delay: float = 0.0, numlock: bool = False, max_records: int = 10000):
+        self.press_delay = press_delay
+        self.numlock = numlock
+        self.records = deque(maxlen=max_records)
+
+    def press(self, key: str):
+        if self.press_delay:
+            time.sleep(self.press_delay)
+        if key == 'numlock':
+            self.numlock = not self.numlock
+        self.records.append((time.perf_counter(), key))
+
+    def hotkey(self, keys: tuple):
+        self.press('+'.join(keys))
+
+    def numlock_on(self):
+        return self.numlock
+
+
+BACKENDS = {
+    PyAutoGuiBackend.name: PyAutoGuiBackend,
+    SendInputBackend.name: SendInputBackend,
+    RecordingBackend.name: RecordingBackend,
+}
+
+
+def _key_name(name) -> str:
+    if not isinstance(name, str) or name.lower() not in KEY_NAMES:
+        raise KeyBatchError(f"不支持的按键: {name}")
+    return KEY_NAMES[name.lower()]
+
+
+def _chord(names) -> tuple:
+    """组合键：前面都是修饰键，最后一个是普通按键"""
+    if not isinstance(names, list) or len(names) < 2:
+        raise KeyBatchError(f"组合键格式错误: {names}")
+    modifiers = []
+    for name in names[:-1]:
+        if not isinstance(name, str) or name.lower() not in MODIFIERS:
+            raise KeyBatchError(f"不支持的修饰键: {name}")
+        modifiers.append(MODIFIERS[name.lower()])
+    return (*modifiers, _key_name(names[-1]))
+
+
+def compile_steps(spec, max_steps: int = 64, max_delay_ms: float = 5000) -> tuple:
+    """校验并展开按键序列，返回 (类型, 值) 元组
+
+    每一步可以是:
+    - "Right"：单个按键
+    - "ctrl+Home" 或 {"hotkey": ["ctrl", "Home"]}：组合键
+    - {"key": "Right", "repeat": 5}：重复按同一个键
+    - {"delay": 200}：等待的毫秒数
+    """
+    if not isinstance(spec, list) or not spec:
+        raise KeyBatchError("按键序列应为非空列表")
+    steps = []
+    total_delay = 0.0
+    for item in spec:
+        if isinstance(item, str):
+            steps.append(("hotkey", _chord(item.split('+'))) if '+' in item else ("press", _key_name(item)))
+        elif isinstance(item, dict) and 'hotkey' in item:
+            steps.append(("hotkey", _chord(item['hotkey'])))
+        elif isinstance(item, dict) and 'key' in item:
+            repeat = item.get('repeat', 1)
+            if not isinstance(repeat, int) or repeat < 1:
+                raise KeyBatchError(f"repeat 应为正整数: {repeat}")
+            steps.extend([("press", _key_name(item['key']))] * min(repeat, max_steps + 1))
+        elif isinstance(item, dict) and 'delay' in item:
+            delay = item['delay']
+            if not isinstance(delay, (int, float)) or delay < 0:
+                raise KeyBatchError(f"delay 应为非负的毫秒数: {delay}")
+            total_delay += delay
+            steps.append(("delay", delay / 1000))
+        else:
+            raise KeyBatchError(f"无法识别的步骤: {item}")
+        if len(steps) > max_steps:
+            raise KeyBatchError(f"按键序列超过 {max_steps} 步")
+    if total_delay > max_delay_ms:
+        raise KeyBatchError(f"按键序列的等待时间合计超过 {max_delay_ms} 毫秒")
+    return tuple(steps)
+
+
+def navigation_kind(steps: tuple):
+    """判断编译好的按键序列对翻页位置的影响
+
+    - NAV_JUMP：含有 Home/End（包括 ctrl+Home 这类组合键），执行后的位置与之前的翻页无关
+    - NAV_STEP：只有相对移动的按键（和等待），被后面的 NAV_JUMP 覆盖时可以不执行
+    - None：其它按键，不参与合并
+    """
+    relative = True
+    for kind, value in steps:
+        if kind == "delay":
+            continue
+        key = value[-1] if kind == "hotkey" else value
+        if key in ABSOLUTE_KEYS:
+            return NAV_JUMP
+        if kind == "hotkey" or key not in RELATIVE_KEYS:
+            relative = False
+    return NAV_STEP if relative and steps else None
+
+
+def create_backend(name: str = "pyautogui", **options) -> InjectionBackend:
+    """根据名称创建注入后端"""
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"未知的按键注入后端: {name}") from None
+    return backend_cls(**options)
+
+
+class KeyInjector:
+    """单线程按键注入器，按投递顺序依次执行"""
+
+    def __init__(self, backend: InjectionBackend, queue_size: int = 64, numlock_refresh: float = 5.0,
+                 max_batch_steps: int = 64, max_batch_delay_ms: float = 5000):
+        self.backend = backend
+        self.max_batch_steps = max_batch_steps
+        self.max_batch_delay_ms = max_batch_delay_ms
+        self.queue = queue.Queue(maxsize=queue_size)
+        # NumLock 状态缓存，超过 numlock_refresh 秒才重新探测（用户可能手动切换）
+        self.numlock_refresh = numlock_refresh
+        self._numlock_on = None
+        self._numlock_checked_at = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="key-injector", daemon=True)
+            self._thread.start()
+            logger.info(f"按键注入线程已启动，后端: {self.backend.name}")
+
+    def stop(self, timeout: float = 1.0):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def snapshot(self) -> dict:
+        return {"backend": self.backend.name, "queue_depth": self.queue.qsize()}
+
+    def compile(self, spec) -> tuple:
+        """按本注入器的上限校验按键序列，格式错误时抛出 KeyBatchError"""
+        return compile_steps(spec, self.max_batch_steps, self.max_batch_delay_ms)
+
+    async def press(self, key: str, client_id=None) -> dict:
+        """投递按键并等待注入完成，返回排队和注入耗时"""
+        return await self._submit(key, client_id)
+
+    async def press_batch(self, steps: tuple, client_id=None) -> dict:
+        """投递 compile() 得到的按键序列，两次等待之间的按键连续注入，中间不会插入其它客户端的按键
+
+        等待步骤在事件循环里 sleep，不占用所有客户端共用的注入线程，其它手机的按键可以在等待期间注入。
+        返回值另外带有每一步相对开始注入的时间和耗时"""
+        started_at = time.perf_counter()
+        timings = []
+        queue_wait_ms = 0.0
+        segment = []
+        for step in (*steps, None):
+            if step is not None and step[0] != "delay":
+                segment.append(step)
+                continue
+            if segment:
+                result = await self._submit((tuple(segment), started_at), client_id)
+                queue_wait_ms += result["queue_wait_ms"]
+                timings.extend(result["steps"])
+                segment = []
+            if step is not None:
+                step_at = time.perf_counter()
+                await asyncio.sleep(step[1])
+                timings.append({
+                    "step": "delay",
+                    "at_ms": round((step_at - started_at) * 1000, 3),
+                    "ms": round((time.perf_counter() - step_at) * 1000, 3),
+                })
+        return {
+            "queue_wait_ms": round(queue_wait_ms, 3),
+            "inject_ms": round((time.perf_counter() - started_at) * 1000 - queue_wait_ms, 3),
+            "steps": timings,
+        }
+
+    async def _submit(self, work, client_id) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self.queue.put_nowait((work, client_id, loop, future, time.perf_counter()))
+        except queue.Full:
+            raise InjectorBusy("按键队列已满") from None
+        return await future
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            work, client_id, loop, future, enqueued_at = item
+            started_at = time.perf_counter()
+            try:
+                steps = self._inject(work) if isinstance(work, str) else self._inject_batch(*work)
+                result = {
+                    "queue_wait_ms": round((started_at - enqueued_at) * 1000, 3),
+                    "inject_ms": round((time.perf_counter() - started_at) * 1000, 3),
+                }
+                if steps is not None:
+                    result["steps"] = steps
+                loop.call_soon_threadsafe(_set_result, future, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+
+    def _inject_batch(self, steps: tuple, started_at: float) -> list:
+        """连续注入一段不含等待的按键，时间相对 press_batch 开始的时刻"""
+        timings = []
+        for kind, value in steps:
+            step_at = time.perf_counter()
+            if kind == "hotkey":
+                if value[-1] in ARROW_KEYS and self._numlock_cached():
+                    self.backend.press('numlock')
+                    self._numlock_on = False
+                self.backend.hotkey(value)
+                name = '+'.join(value)
+            else:
+                self._inject(value)
+                name = value
+            timings.append({
+                "step": name,
+                "at_ms": round((step_at - started_at) * 1000, 3),
+                "ms": round((time.perf_counter() - step_at) * 1000, 3),
+            })
+        return timings
+
+    def _inject(self, key: str):
+        # 为避免部分101键盘的小键盘num lock键影响上下左右的输出
+        # 先检查 num lock 键的状态,如果开启则关闭
+        if key in ARROW_KEYS and self._numlock_cached():
+            self.backend.press('numlock')
+            self._numlock_on = False
+        self.backend.press(key)
+
+    def _numlock_cached(self) -> bool:
+        now = time.monotonic()
+        if self._numlock_on is None or now - self._numlock_checked_at > self.numlock_refresh:
+            self._numlock_on = bool(self.backend.numlock_on())
+            self._numlock_checked_at = now
+        return self._numlock_on
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
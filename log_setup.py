@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+日志配置
+
+- 事件循环里只把日志记录放进队列，文件和控制台输出由后台线程的 QueueListener 完成
+- 日志文件按大小或时间滚动
+- 消息收发这类高频日志可以按命令采样、限速，语音和图片的负载内容默认不记录
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 当前正在处理的命令，以及这条消息的收发日志是否被采样记录
+current_command = ContextVar('current_command', default=None)
+_sampled = ContextVar('hot_path_sampled', default=True)
+
+
+def load_logging_options(config_path: str = 'config.json') -> dict:
+    """从配置文件读取 logging 段，读不到时使用默认值"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('logging', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def setup_logging(options: dict = None) -> logging.handlers.QueueListener:
+    """配置根日志器，返回已启动的 QueueListener"""
+    options = options or {}
+    logs_dir = options.get('dir', 'logs')
+    # 创建logs目录
+    os.makedirs(logs_dir, exist_ok=True)
+
+    # 配置日志文件
+    log_filename = datetime.now().strftime("server_%Y%m%d_%H%M%S.log")
+    log_filepath = os.path.join(logs_dir, log_filename)
+    if options.get('rotation', 'size') == 'time':
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_filepath,
+            when=options.get('when', 'midnight'),
+            backupCount=options.get('backup_count', 7),
+            encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_filepath,
+            maxBytes=options.get('max_bytes', 10 * 1024 * 1024),
+            backupCount=options.get('backup_count', 5),
+            encoding='utf-8'
+        )
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [file_handler, logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(options.get('level', 'INFO'))
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    root.info(f"日志文件已创建: {log_filepath}")
+    return listener
+
+
+def stop_listener(listener: logging.handlers.QueueListener):
+    """停止后台日志线程并写完队列中剩余的日志，可重复调用"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+class HotPathLog:
+    """消息收发日志：按命令采样、限速，可关闭负载内容"""
+
+    def __init__(self, logger: logging.Logger, options: dict = None):
+        options = options or {}
+        self.logger = logger
+        # {"key": 10} 表示 key 命令每10条记录1条
+        self.sample = options.get('sample', {})
+        # {"key": 20} 表示 key 命令每秒最多记录20条
+        self.rate_limit = options.get('rate_limit', {})
+        self.payload_commands = set(options.get('no_payload_commands', ['voice', 'image', 'image_chunk']))
+        self._counts = {}
+        self._buckets = {}
+        self._suppressed = {}
+
+    def allow(self, command) -> bool:
+        if not self.logger.isEnabledFor(logging.INFO):
+            return False
+        every = self.sample.get(command, 1)
+        if every > 1:
+            count = self._counts.get(command, 0)
+            self._counts[command] = count + 1
+            if count % every:
+                return False
+        rate = self.rate_limit.get(command)
+        if rate:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(command, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens < 1:
+                self._buckets[command] = (tokens, now)
+                self._suppressed[command] = self._suppressed.get(command, 0) + 1
+                return False
+            self._buckets[command] = (tokens - 1, now)
+        return True
+
+    def begin(self, command) -> bool:
+        """开始处理一条消息，决定这条消息的收发日志是否记录"""
+        current_command.set(command)
+        sampled = self.allow(command)
+        _sampled.set(sampled)
+        return sampled
+
+    def _suffix(self, command) -> str:
+        suppressed = self._suppressed.pop(command, 0)
+        return f" (限速省略 {suppressed} 条)" if suppressed else ""
+
+    def inbound(self, command, msg_id, message):
+        if not _sampled.get():
+            return
+        # 二进制帧的内容是音频或图片数据，只记录长度
+        if command in self.payload_commands or not isinstance(message, str):
+            self.logger.info(f"收到消息: command={command}, msg_id={msg_id}, 长度 {len(message)}{self._suffix(command)}")
+        else:
+            self.logger.info(f"收到消息: {message[:150]}...{self._suffix(command)}")
+
+    def response(self, payload: str):
+        if _sampled.get():
+            self.logger.info(payload)
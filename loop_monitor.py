@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+事件循环卡顿监控
+
+- 循环里的协程每隔 interval 醒来一次，实际醒来时间比预定时间晚多少就是调度延迟，记入 loop_lag 直方图
+- 看门狗线程检查协程上次醒来的时间，超过 threshold_ms 还没醒来说明事件循环被同步调用卡住了，
+  这时事件循环线程的调用栈就停在卡住的地方（pyautogui.press、json.dump、base64 解码……），记录到日志；
+  如果事件循环线程停在 select 上，说明它在等别的线程释放GIL，这时把其它线程的调用栈也记下来
+- 同一次卡顿只记录一次调用栈，两次记录之间至少间隔 cooldown 秒，避免持续卡顿时刷屏
+
+空闲时只有一个定时醒来的协程和一个定时醒来的线程，几乎没有开销。
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.1, threshold_ms: float = 100.0, cooldown: float = 30.0,
+                 stack_limit: int = 30, observe=None):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.cooldown = cooldown
+        self.stack_limit = stack_limit
+        # observe(毫秒) 记录每次测得的调度延迟
+        self.observe = observe
+        self.stats = {"max_lag_ms": 0.0, "stalls": 0, "stack_dumps": 0}
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """在事件循环中启动，重复调用无效"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            lag_ms = lag * 1000
+            if lag_ms > self.stats["max_lag_ms"]:
+                self.stats["max_lag_ms"] = round(lag_ms, 3)
+            if lag >= self.threshold:
+                self.stats["stalls"] += 1
+                logger.warning(f"事件循环卡顿 {lag_ms:.1f} ms")
+            if self.observe is not None:
+                self.observe(lag_ms)
+
+    def _watch(self):
+        """看门狗线程：事件循环超过阈值没有醒来时记录它的调用栈"""
+        dumped_for = None
+        last_dump = float("-inf")
+        check_every = max(self.threshold / 2, 0.01)
+        while not self._stopped.wait(check_every):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or dumped_for == heartbeat:
+                continue
+            dumped_for = heartbeat
+            now = time.monotonic()
+            if now - last_dump < self.cooldown:
+                continue
+            last_dump = now
+            frames = sys._current_frames()
+            frame = frames.pop(self._loop_thread_id, None)
+            if frame is None:
+                continue
+            message = f"事件循环已阻塞 {blocked * 1000:.0f} ms，事件循环线程当前的调用栈:\n{self._format(frame)}"
+            if frame.f_code.co_filename.endswith("selectors.py"):
+                frames.pop(threading.get_ident(), None)
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, other in frames.items():
+                    message += f"\n线程 {names.get(thread_id, thread_id)} 的调用栈:\n{self._format(other)}"
+            del frame, frames
+            self.stats["stack_dumps"] += 1
+            logger.warning(message)
+
+    def _format(self, frame) -> str:
+        return "".join(traceback.format_stack(frame, limit=self.stack_limit))
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+消息编解码
+
+安装了 orjson 时使用 orjson，否则回退到标准库 json。
+dumps 始终返回 str，保证 websocket 发出去的是文本帧。
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    NAME = "orjson"
+    # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
+    DecodeError = orjson.JSONDecodeError
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    NAME = "json"
+    DecodeError = json.JSONDecodeError
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data):
+        return json.loads(data)
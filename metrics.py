@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+运行指标
+
+按命令统计收到消息到回复完成的延迟直方图、错误数、处理中的请求数，以及连接数和各处理阶段
+（按键排队/注入、语音识别、功能执行、slide monitor 确认）的耗时。
+直方图使用固定分桶，记录一次只是一次二分查找加计数，可以在生产环境常开。
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 直方图分桶上界（毫秒）
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+
+    def quantile(self, q: float) -> float:
+        """按分桶估算分位数，返回所在桶的上界"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+        }
+
+
+class CommandStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.in_flight = 0
+
+    def snapshot(self) -> dict:
+        return {**self.latency.snapshot(), "errors": self.errors, "in_flight": self.in_flight}
+
+
+class Metrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.commands = {}
+        self.stages = {}
+        self.connected_clients = 0
+        # 其它模块的统计（名称 -> 返回字典的函数），在 snapshot 时一并输出
+        self.sources = {}
+
+    def command(self, command) -> CommandStats:
+        stats = self.commands.get(command)
+        if stats is None:
+            stats = self.commands[command] = CommandStats()
+        return stats
+
+    @contextmanager
+    def track(self, command, received: float = None):
+        """统计一条命令从收到到处理完成的耗时
+
+        received 为收到消息时的 time.perf_counter()，耗时包括在调度器中排队的时间；
+        错误数由错误回复统一计入（error），这里不再重复计数。
+        """
+        stats = self.command(command)
+        stats.in_flight += 1
+        started = time.perf_counter() if received is None else received
+        try:
+            yield stats
+        finally:
+            stats.in_flight -= 1
+            stats.latency.observe((time.perf_counter() - started) * 1000)
+
+    def error(self, command):
+        self.command(command).errors += 1
+
+    def observe_stage(self, stage: str, value_ms: float):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(value_ms)
+
+    def add_source(self, name: str, func):
+        self.sources[name] = func
+
+    def snapshot(self) -> dict:
+        snapshot = {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "connected_clients": self.connected_clients,
+            "commands": {str(name): stats.snapshot() for name, stats in self.commands.items()},
+            "stages": {name: histogram.snapshot() for name, histogram in self.stages.items()},
+        }
+        for name, func in self.sources.items():
+            try:
+                snapshot[name] = func()
+            except Exception as e:
+                snapshot[name] = {"error": str(e)}
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines = [
+            "# TYPE msm_connected_clients gauge",
+            f"msm_connected_clients {self.connected_clients}",
+            "# TYPE msm_command_latency_ms histogram",
+        ]
+        for name, stats in self.commands.items():
+            lines.extend(_histogram_lines("msm_command_latency_ms", f'command="{name}"', stats.latency))
+        lines.append("# TYPE msm_command_errors_total counter")
+        lines.extend(f'msm_command_errors_total{{command="{name}"}} {stats.errors}'
+                     for name, stats in self.commands.items())
+        lines.append("# TYPE msm_command_in_flight gauge")
+        lines.extend(f'msm_command_in_flight{{command="{name}"}} {stats.in_flight}'
+                     for name, stats in self.commands.items())
+        lines.append("# TYPE msm_stage_latency_ms histogram")
+        for name, histogram in self.stages.items():
+            lines.extend(_histogram_lines("msm_stage_latency_ms", f'stage="{name}"', histogram))
+        return "\n".join(lines) + "\n"
+
+    async def serve_prometheus(self, host: str = "127.0.0.1", port: int = 9108):
+        """启动本地HTTP端点，任何路径都返回指标文本"""
+        async def handle(reader, writer):
+            try:
+                # 只需要读完请求头，不关心路径
+                await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+                body = self.render_prometheus().encode("utf-8")
+                writer.write(b"HTTP/1.1 200 OK\r\n"
+                             b"Content-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                             b"Connection: close\r\n\r\n" + body)
+                await writer.drain()
+            except Exception:
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.info(f"指标端点已启动: http://{host}:{port}/metrics")
+        return server
+
+
+def _histogram_lines(metric: str, labels: str, histogram: Histogram):
+    cumulative = 0
+    for bound, n in zip(histogram.buckets, histogram.counts):
+        cumulative += n
+        yield f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    yield f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f'{metric}_sum{{{labels}}} {round(histogram.sum, 3)}'
+    yield f'{metric}_count{{{labels}}} {histogram.count}'
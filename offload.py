@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+大消息的解析和base64解码
+
+json.loads 和 base64.b64decode 执行期间一直持有GIL，直接放到线程池里事件循环照样被卡住，
+所以按消息大小分三档：
+- 小于 process_min_bytes 的消息直接在事件循环里解析，按键、设置等控制消息只要几微秒
+- 其中超过 inline_max_bytes 的base64内容在线程池里按 chunk_bytes 分段解码，每段之间可以切换线程，
+  事件循环最多被卡住一段的时间
+- 不小于 process_min_bytes 的文本消息整条交给进程池，JSON解析和语音、图片的base64解码都在子进程里完成，
+  事件循环这边只剩收发数据的内存拷贝；进程池在第一次用到时才创建，出错时退回到前两档
+"""
+
+import asyncio
+import base64
+import binascii
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import message_codec as codec
+
+logger = logging.getLogger(__name__)
+
+
+def parse_and_decode(raw: bytes):
+    """子进程中执行：解析消息，并把语音和图片的base64内容解码成 bytes；解析失败时返回 None
+
+    解码失败的内容保持原样，由命令处理函数按原来的流程报告错误。
+    """
+    try:
+        data = codec.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return data
+    command, content = data.get('command'), data.get('content')
+    try:
+        if command in ('voice', 'image') and isinstance(content, str):
+            data['content'] = base64.b64decode(content, validate=True)
+        elif command == 'voice' and isinstance(content, dict) and isinstance(content.get('data'), str):
+            content['data'] = base64.b64decode(content['data'], validate=True)
+    except (binascii.Error, ValueError):
+        pass
+    return data
+
+
+def b64decode_chunked(content: str, chunk_bytes: int, validate: bool = False) -> bytes:
+    """分段解码base64，在线程池中执行时每段之间可以切换回事件循环线程"""
+    chunk = max(4, chunk_bytes - chunk_bytes % 4)
+    try:
+        return b"".join(base64.b64decode(content[beg:beg + chunk], validate=True)
+                        for beg in range(0, len(content), chunk))
+    except (binascii.Error, ValueError):
+        if validate:
+            raise
+        # 含有换行等非base64字符时分段会错位，按原来的方式整体解码（忽略非法字符）
+        return base64.b64decode(content)
+
+
+class PayloadDecoder:
+    def __init__(self, inline_max_bytes: int = 64 * 1024, chunk_bytes: int = 64 * 1024,
+                 process_min_bytes: int = 1024 * 1024, process_workers: int = 1):
+        self.inline_max_bytes = inline_max_bytes
+        self.chunk_bytes = chunk_bytes
+        # 0 表示不使用进程池
+        self.process_min_bytes = process_min_bytes
+        self.process_workers = process_workers
+        self._pool = None
+        self.stats = {"thread": 0, "process": 0, "process_failures": 0, "offloaded_bytes": 0}
+
+    def start(self):
+        """提前创建进程池，子进程在后台启动，第一条大消息不必等它"""
+        if self.process_min_bytes:
+            self._process_pool()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # 和Windows上一样用 spawn 启动，不受父进程中线程状态的影响
+            self._pool = ProcessPoolExecutor(self.process_workers, mp_context=multiprocessing.get_context("spawn"))
+            self._pool.submit(int)
+        return self._pool
+
+    def offload(self, message) -> bool:
+        """文本消息是否交给进程池解析"""
+        return bool(self.process_min_bytes) and len(message) >= self.process_min_bytes
+
+    async def loads(self, message):
+        """在进程池中解析文本消息，返回的消息中语音和图片的base64内容已解码为 bytes"""
+        raw = message.encode("utf-8") if isinstance(message, str) else message
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(self._process_pool(), parse_and_decode, raw)
+        except Exception as e:
+            # 子进程异常退出后进程池不能再用，下次重新创建
+            logger.error(f"进程池解析消息失败，改为在本进程解析: {e}")
+            self.stats["process_failures"] += 1
+            self.shutdown()
+            return codec.loads(message)
+        self.stats["process"] += 1
+        self.stats["offloaded_bytes"] += len(raw)
+        if data is None:
+            raise codec.DecodeError("JSON格式错误", "", 0)
+        return data
+
+    async def b64decode(self, content: str, validate: bool = False) -> bytes:
+        """解码base64内容，大内容在线程池中分段解码"""
+        if len(content) <= self.inline_max_bytes:
+            return base64.b64decode(content, validate=validate)
+        self.stats["thread"] += 1
+        self.stats["offloaded_bytes"] += len(content)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, b64decode_chunked, content, self.chunk_bytes, validate)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
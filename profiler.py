@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+按需性能剖析
+
+由管理命令 profile 启动，到时间自动停止，结果写到日志目录：
+- cprofile：cProfile 记录事件循环线程上的所有调用，生成 .prof（可用 snakeviz 等工具查看）和按累计耗时排序的 .txt
+- sample：后台线程定时采集所有线程的调用栈，生成 folded 格式（flamegraph.pl / speedscope 可直接读取），
+  能看到按键注入线程、功能线程池里的阻塞；开销只取决于采样间隔，和消息量无关
+
+同一时间只能运行一个剖析。
+"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class ProfilerBusy(Exception):
+    """已有剖析在运行"""
+
+
+class Profiler:
+    def __init__(self, directory: str = "logs", max_seconds: float = 300.0, sample_interval_ms: float = 5.0):
+        self.directory = directory
+        self.max_seconds = max_seconds
+        self.sample_interval = sample_interval_ms / 1000
+        self.mode = None
+        self.started_at = None
+        self.seconds = None
+        self._profile = None
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+        self._samples = Counter()
+        self._timer = None
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: str = "sample", seconds: float = 30.0) -> dict:
+        """在事件循环线程中调用，seconds 秒后自动停止"""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"剖析方式应为 {PROFILE_MODES} 之一: {mode}")
+        if self.running:
+            raise ProfilerBusy(f"已有 {self.mode} 剖析在运行")
+        seconds = min(float(seconds), self.max_seconds)
+        if seconds <= 0:
+            raise ValueError("剖析时长应大于0")
+        self.mode = mode
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        if mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            # 每次剖析用新的计数和停止事件，上一次的采样线程可能还没退出
+            self._samples = Counter()
+            self._stop_sampling = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, args=(self._samples, self._stop_sampling),
+                                             name="profile-sampler", daemon=True)
+            self._sampler.start()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(seconds, lambda: asyncio.ensure_future(self._stop_and_log()))
+        logger.info(f"开始 {mode} 剖析，{seconds} 秒后自动停止")
+        return self.status()
+
+    async def stop(self) -> str:
+        """停止剖析，在线程池中写出结果，返回文件路径；没有在运行时返回 None"""
+        if not self.running:
+            return None
+        self._timer.cancel()
+        mode, elapsed = self.mode, time.monotonic() - self.started_at
+        self.mode = None
+        if mode == "cprofile":
+            self._profile.disable()
+            profile, self._profile = self._profile, None
+            write, data = self._write_cprofile, profile
+        else:
+            self._stop_sampling.set()
+            sampler, self._sampler = self._sampler, None
+            write, data = self._write_samples, self._samples
+            await asyncio.get_running_loop().run_in_executor(None, sampler.join)
+        path = os.path.join(self.directory, datetime.now().strftime(f"profile_%Y%m%d_%H%M%S_{mode}"))
+        try:
+            path = await asyncio.get_running_loop().run_in_executor(None, write, data, path)
+            logger.info(f"{mode} 剖析已停止（{elapsed:.1f} 秒），结果: {path}")
+        except OSError as e:
+            logger.error(f"写入剖析结果失败: {e}")
+            path = None
+        return path
+
+    async def _stop_and_log(self):
+        try:
+            await self.stop()
+        except Exception as e:
+            logger.error(f"停止剖析失败: {e}")
+
+    def status(self) -> dict:
+        if not self.running:
+            return {"running": False}
+        return {
+            "running": True,
+            "mode": self.mode,
+            "seconds": self.seconds,
+            "elapsed": round(time.monotonic() - self.started_at, 3),
+        }
+
+    def _sample(self, samples: Counter, stop: threading.Event):
+        own = threading.get_ident()
+        names = {}
+        while not stop.wait(self.sample_interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                samples[";".join(reversed(stack))] += 1
+
+    def _write_cprofile(self, profile: cProfile.Profile, path: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(path + ".prof")
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(60)
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+        return path + ".prof"
+
+    def _write_samples(self, samples: Counter, path: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path + ".folded"
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+按客户端和IP的消息限速
+
+每个 client_id 和每个IP各有一个令牌桶，消息要两个桶都有令牌才处理，否则直接回复繁忙错误，
+不再记录日志、排队和注入。按键卡住或重试逻辑出错的手机只会被自己的桶挡住，不影响其它手机；
+没有 client_id 的消息只受IP限制。同一个Wi-Fi下的多台手机可能共用一个出口IP，IP的额度应大于单个客户端。
+"""
+
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    def __init__(self, client_rate: float = 20.0, client_burst: float = 40, ip_rate: float = 50.0,
+                 ip_burst: float = 100, costs: dict = None, max_buckets: int = 4096):
+        # rate 为每秒补充的令牌数，0 表示不限制；burst 为桶的容量，即允许的突发消息数
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        # 按命令设置每条消息消耗的令牌数，默认为1；0 表示不限速
+        self.costs = costs or {}
+        self.max_buckets = max_buckets
+        # (类型, 标识) -> (令牌数, 上次更新时间)，最久没用的桶先淘汰（淘汰的桶相当于满的）
+        self.buckets = OrderedDict()
+        # 正在被限速的桶，只在开始限速时记一次日志
+        self.limited = set()
+        self.stats = {"allowed": 0, "limited_client": 0, "limited_ip": 0}
+
+    def check(self, ip, client_id, command) -> float:
+        """消息可以处理时扣除令牌并返回 0，否则返回需要等待的秒数，不扣令牌"""
+        cost = self.costs.get(command, 1)
+        if cost <= 0:
+            return 0.0
+        now = time.monotonic()
+        checks = []
+        if self.ip_rate and ip:
+            checks.append((("ip", ip), self.ip_rate, self.ip_burst))
+        if self.client_rate and client_id:
+            checks.append((("client", client_id), self.client_rate, self.client_burst))
+        refilled = []
+        for key, rate, burst in checks:
+            tokens, last = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens < cost:
+                self.buckets[key] = (tokens, now)
+                self.buckets.move_to_end(key)
+                self.stats[f"limited_{key[0]}"] += 1
+                if key not in self.limited:
+                    self.limited.add(key)
+                    logger.warning(f"消息过快，开始限速: {key[0]}={key[1]}")
+                return (cost - tokens) / rate
+            refilled.append((key, tokens))
+        for key, tokens in refilled:
+            self.buckets[key] = (tokens - cost, now)
+            self.buckets.move_to_end(key)
+            self.limited.discard(key)
+        while len(self.buckets) > self.max_buckets:
+            key, _ = self.buckets.popitem(last=False)
+            self.limited.discard(key)
+        self.stats["allowed"] += 1
+        return 0.0
+
+    def snapshot(self) -> dict:
+        return {"buckets": len(self.buckets), "limiting": len(self.limited), **self.stats}
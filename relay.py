@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+多主机中继
+
+一台手机只连一台主机，这台主机把 key / function 等命令同时转发给同组的其它主机，所有主机的结果合并成一条回复，
+翻页在所有屏幕上只需要一个网络往返。
+
+- 每台对端主机保持一条长连接，断线后退避重连；同一连接上的多个请求按 msg_id 对应回复，不用等上一条
+- 转发的消息带 relayed 标记，对端只在本机执行不再转发，几台主机互相配置成对端也不会循环
+- 转发时沿用手机的 client_id，msg_id 前加上 client_id，对端的限速和重复消息缓存仍按手机区分；
+  手机重发同一条消息时对端直接返回缓存的回复，不会多翻一页
+- 每台主机的结果带各自的耗时，超时或未连接的主机在回复中标明，不影响其它主机
+"""
+
+import asyncio
+import itertools
+import logging
+import ssl
+import time
+
+import websockets
+
+import message_codec as codec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMANDS = ('key', 'key_batch', 'macro', 'function')
+
+
+def default_timeouts(config: dict, timeout: float) -> dict:
+    """按对端主机的最长正常执行时间估算各命令的超时，在 timeout（网络往返的余量）之上加上：
+
+    - function：功能执行超时（function_pool.timeout 或 functions 中单独设置的最大值）加上 slide monitor 确认超时
+    - key_batch / macro：按键序列中等待时间合计的上限
+    """
+    pool_timeout = config.get('function_pool', {}).get('timeout', 5.0)
+    function_timeout = max([pool_timeout] + [item.get('timeout', pool_timeout)
+                                             for item in config.get('functions') or []])
+    ack_timeout = config.get('ack', {}).get('timeout', 3.0)
+    batch_delay = config.get('key_injector', {}).get('max_batch_delay_ms', 5000) / 1000
+    return {
+        'function': timeout + function_timeout + ack_timeout,
+        'key_batch': timeout + batch_delay,
+        'macro': timeout + batch_delay,
+    }
+
+
+class PeerUnavailable(Exception):
+    """对端主机未连接"""
+
+
+class RelayPeer:
+    """到一台对端主机的长连接"""
+
+    def __init__(self, name: str, uri: str, ssl_context=None, connect_timeout: float = 3.0,
+                 backoff_initial: float = 0.5, backoff_max: float = 10.0):
+        self.name = name
+        self.uri = uri
+        self.ssl_context = ssl_context if uri.startswith("wss://") else None
+        self.connect_timeout = connect_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.websocket = None
+        # 转发的 msg_id -> 等待回复的 Future
+        self.pending = {}
+        self._task = None
+        self._connected = asyncio.Event()
+        self.stats = {"connects": 0, "connect_failures": 0, "requests": 0, "errors": 0, "timeouts": 0,
+                      "last_ms": 0.0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait_connected(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _run(self):
+        backoff = 0.0
+        while True:
+            try:
+                websocket = await websockets.connect(self.uri, ssl=self.ssl_context, compression=None,
+                                                     open_timeout=self.connect_timeout, max_size=None)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                self.stats["connect_failures"] += 1
+                backoff = min(self.backoff_max, backoff * 2 or self.backoff_initial)
+                logger.warning(f"连接中继主机 {self.name} 失败，{backoff:.1f}秒后重试: {e}")
+                await asyncio.sleep(backoff)
+                continue
+            backoff = 0.0
+            self.stats["connects"] += 1
+            self.websocket = websocket
+            self._connected.set()
+            logger.info(f"已连接中继主机 {self.name}: {self.uri}")
+            try:
+                async for message in websocket:
+                    self._dispatch(message)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            finally:
+                self._connected.clear()
+                self.websocket = None
+                self._fail_pending(PeerUnavailable("连接已断开"))
+                await websocket.close()
+            logger.warning(f"中继主机 {self.name} 连接断开，重新连接")
+
+    def _dispatch(self, message):
+        try:
+            data = codec.loads(message)
+        except codec.DecodeError:
+            return
+        future = self.pending.pop(data.get('id'), None) if isinstance(data, dict) else None
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def _fail_pending(self, exc: Exception):
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    async def request(self, message: dict, timeout: float) -> dict:
+        """发送一条命令并等待回复；同一 msg_id 的请求还在等待时共用它的结果"""
+        websocket = self.websocket
+        if websocket is None:
+            raise PeerUnavailable("未连接")
+        msg_id = message['msg_id']
+        future = self.pending.get(msg_id)
+        send = future is None
+        if send:
+            future = self.pending[msg_id] = asyncio.get_running_loop().create_future()
+        try:
+            # 发送也算在超时内，对端不再读取数据时不会卡住有序通道
+            return await asyncio.wait_for(self._send_and_wait(websocket, message, future, send), timeout)
+        except BaseException:
+            # 超时或发送失败后不再等待，回复晚到时直接丢弃
+            if self.pending.get(msg_id) is future:
+                del self.pending[msg_id]
+            if future.done() and not future.cancelled():
+                # 连接断开时 _fail_pending 已设置了异常，取出来避免 "exception was never retrieved"
+                future.exception()
+            raise
+
+    @staticmethod
+    async def _send_and_wait(websocket, message: dict, future, send: bool) -> dict:
+        if send:
+            await websocket.send(codec.dumps(message))
+        return await asyncio.shield(future)
+
+    def snapshot(self) -> dict:
+        return {"connected": self.websocket is not None, "pending": len(self.pending), **self.stats}
+
+
+class RelayGroup:
+    """relay 配置段：本机所在的主机组"""
+
+    def __init__(self, peers: list, name: str = "local", commands=DEFAULT_COMMANDS, timeout: float = 2.0,
+                 timeouts: dict = None, include_local: bool = True, verify_tls: bool = False,
+                 connect_timeout: float = 3.0):
+        self.name = name
+        self.commands = frozenset(commands)
+        self.timeout = timeout
+        # 按命令设置的超时，例如功能命令要等 slide monitor 确认，比翻页慢
+        self.timeouts = timeouts or {}
+        self.include_local = include_local
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if not verify_tls:
+            # 各主机用 generate_cert.py 生成的自签名证书
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        self.peers = [RelayPeer(peer['name'], peer['uri'], context, connect_timeout) for peer in peers]
+        self._ids = itertools.count()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """没有配置对端主机时返回 None"""
+        options = dict(config.get('relay', {}))
+        if not options.pop('enabled', True) or not options.get('peers'):
+            return None
+        options.setdefault('name', config.get('host_name', 'local'))
+        options['timeouts'] = {**default_timeouts(config, options.get('timeout', 2.0)), **options.get('timeouts', {})}
+        return cls(**options)
+
+    def handles(self, command, relayed) -> bool:
+        return not relayed and command in self.commands
+
+    async def start(self, wait: float = 1.0):
+        """连接所有对端主机，最多等待 wait 秒，没连上的在后台继续重连"""
+        for peer in self.peers:
+            peer.start()
+        await asyncio.gather(*(peer.wait_connected(wait) for peer in self.peers))
+        connected = [peer.name for peer in self.peers if peer.websocket is not None]
+        logger.info(f"中继主机已连接 {len(connected)}/{len(self.peers)}: {connected}")
+
+    async def close(self):
+        await asyncio.gather(*(peer.close() for peer in self.peers))
+
+    async def fan_out(self, command, content, msg_id, client_id) -> dict:
+        """把命令并行发给所有对端主机，返回 主机名 -> 结果（带 ms 耗时）"""
+        forward_id = f"{client_id}:{msg_id}" if client_id else f"relay{next(self._ids)}:{msg_id}"
+        message = {"command": command, "msg_id": forward_id, "client_id": client_id, "content": content,
+                   "relayed": True}
+        timeout = self.timeouts.get(command, self.timeout)
+        results = await asyncio.gather(*(self._request(peer, message, timeout) for peer in self.peers))
+        return {peer.name: result for peer, result in zip(self.peers, results)}
+
+    async def _request(self, peer: RelayPeer, message: dict, timeout: float) -> dict:
+        started = time.perf_counter()
+        peer.stats["requests"] += 1
+        try:
+            reply = await peer.request(message, timeout)
+            result = {key: value for key, value in reply.items() if key != 'id'}
+        except asyncio.TimeoutError:
+            peer.stats["timeouts"] += 1
+            result = {"result": "error", "message": f"超时（{timeout}秒）"}
+        except (PeerUnavailable, websockets.exceptions.ConnectionClosed, OSError) as e:
+            result = {"result": "error", "message": f"主机不可用: {e}"}
+        elapsed = round((time.perf_counter() - started) * 1000, 3)
+        if result.get("result") == "error":
+            peer.stats["errors"] += 1
+        peer.stats["last_ms"] = elapsed
+        result["ms"] = elapsed
+        return result
+
+    def snapshot(self) -> dict:
+        return {peer.name: peer.snapshot() for peer in self.peers}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+重复消息的回复缓存
+
+手机断线重连后会用同一个 msg_id 重发还没收到回复的命令。按 (client_id, msg_id) 缓存命令的成功回复，
+重发的消息直接拿到原来的回复，不再重复执行（否则一次点击可能翻两页）。
+
+- 原请求还在执行时，重发的消息等待原请求的结果
+- 只缓存成功的回复；执行失败、被拒绝（服务器繁忙）或连接断开时没有执行的命令，重发时正常执行
+- 回复在发送之前记录，发送时连接断开也不影响重发的消息拿到结果
+- 条目数和总字节数都有上限，超过后按最近使用淘汰，超过 ttl 的条目失效
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+# 每条缓存除回复外的大致开销（键、时间戳、字典槽位）
+ENTRY_OVERHEAD = 160
+
+DEFAULT_COMMANDS = ('key', 'key_batch', 'macro', 'function', 'text', 'voice', 'set')
+
+# 当前正在执行的可缓存命令的键，回复时据此记录
+current_key = ContextVar('replay_key', default=None)
+
+
+class ReplayCache:
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 1024 * 1024, ttl: float = 120.0,
+                 commands=DEFAULT_COMMANDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.commands = frozenset(commands)
+        # key -> (回复, 写入时间)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        # 正在执行的命令 key -> Future，结果为回复或 None（没有成功回复）
+        self.inflight = {}
+        self.stats = {"hits": 0, "waits": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    def key_for(self, command, client_id, msg_id):
+        """不需要去重的命令返回 None；没有 client_id 的消息无法区分来源，也不去重"""
+        if command not in self.commands or not client_id or not isinstance(msg_id, (str, int)):
+            return None
+        return (client_id, msg_id)
+
+    async def lookup(self, key):
+        """返回缓存的回复；原请求正在执行时等待它完成；都没有时返回 None，调用方接着执行命令"""
+        while True:
+            item = self.entries.get(key)
+            if item is not None:
+                payload, stored_at = item
+                if time.monotonic() - stored_at <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return payload
+                self._pop(key)
+                self.stats["expired"] += 1
+            future = self.inflight.get(key)
+            if future is None:
+                return None
+            self.stats["waits"] += 1
+            # 等待的消息被取消时不能连带取消原请求的 Future
+            payload = await asyncio.shield(future)
+            if payload is not None:
+                self.stats["hits"] += 1
+                return payload
+            # 原请求没有成功，可能已有另一条重发的消息开始执行，再检查一次
+
+    def begin(self, key):
+        """开始执行一条可缓存的命令，返回 current_key 的 token"""
+        self.inflight[key] = asyncio.get_running_loop().create_future()
+        return current_key.set(key)
+
+    def record(self, payload: str):
+        """记录当前命令的成功回复，只记录第一条"""
+        key = current_key.get()
+        if key is None or key in self.entries:
+            return
+        self.entries[key] = (payload, time.monotonic())
+        self.bytes += len(payload) + ENTRY_OVERHEAD
+        self.stats["stores"] += 1
+        now = time.monotonic()
+        while self.entries:
+            oldest, (_, stored_at) = next(iter(self.entries.items()))
+            if len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.stats["evictions"] += 1
+            elif now - stored_at > self.ttl:
+                self.stats["expired"] += 1
+            else:
+                break
+            self._pop(oldest)
+
+    def finish(self, key, token):
+        """命令执行结束，唤醒等待的重发消息"""
+        current_key.reset(token)
+        future = self.inflight.pop(key, None)
+        if future is not None and not future.done():
+            item = self.entries.get(key)
+            future.set_result(item[0] if item else None)
+
+    def _pop(self, key):
+        payload, _ = self.entries.pop(key)
+        self.bytes -= len(payload) + ENTRY_OVERHEAD
+
+    def snapshot(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.bytes, "inflight": len(self.inflight), **self.stats}
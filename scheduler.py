@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+连接内的命令调度
+
+每个连接按命令分成几条通道：
+- key / key_batch / macro 走有序通道，按收到的顺序逐条执行，不会被慢命令挡住
+- voice / image / image_end / function 作为后台任务并发执行，受单个客户端和全局的并发上限约束
+- voice_end 作为后台任务执行但不占并发名额（它只是结束一个已经开始的会话）
+- 其它命令（握手、设置、统计等）都很快，直接在读消息的协程里执行
+
+每条命令完成时各自回复，回复顺序不再和请求顺序一致，客户端按 id 对应。
+
+有序通道里还没执行的相对翻页（Right、PageDown 等）遇到随后的 Home/End 时会被合并掉：
+跳转之后的位置和前面翻了几页无关，不必再一页一页地翻过去。被合并的命令直接回复 coalesced。
+"""
+
+import asyncio
+import contextvars
+import logging
+from collections import deque
+
+import websockets
+
+from key_injector import NAV_JUMP, NAV_STEP
+
+logger = logging.getLogger(__name__)
+
+LANE_INLINE = "inline"
+LANE_ORDERED = "ordered"
+LANE_BACKGROUND = "background"
+LANE_DETACHED = "detached"
+
+DEFAULT_LANES = {
+    'key': LANE_ORDERED,
+    'key_batch': LANE_ORDERED,
+    'macro': LANE_ORDERED,
+    'voice': LANE_BACKGROUND,
+    'image': LANE_BACKGROUND,
+    'image_end': LANE_BACKGROUND,
+    'function': LANE_BACKGROUND,
+    'voice_end': LANE_DETACHED,
+}
+
+
+class SchedulerBusy(Exception):
+    """客户端排队的命令过多"""
+
+
+class CommandLimits:
+    """所有连接共享的并发设置和统计"""
+
+    def __init__(self, per_client: int = 2, global_limit: int = 8, per_client_pending: int = 8,
+                 key_queue_size: int = 32, coalesce_keys: bool = True, lanes: dict = None):
+        self.per_client = per_client
+        self.per_client_pending = per_client_pending
+        self.key_queue_size = key_queue_size
+        self.coalesce_keys = coalesce_keys
+        self.lanes = {**DEFAULT_LANES, **(lanes or {})}
+        self.semaphore = asyncio.Semaphore(global_limit)
+        self.global_limit = global_limit
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "CommandLimits":
+        options = dict(config.get('scheduler', {}))
+        if 'global' in options:
+            options['global_limit'] = options.pop('global')
+        return cls(**options)
+
+    def lane(self, command) -> str:
+        return self.lanes.get(command, LANE_INLINE)
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": self.pending - self.running,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "global_limit": self.global_limit,
+        }
+
+
+class ConnectionScheduler:
+    """单个连接的命令调度器"""
+
+    def __init__(self, limits: CommandLimits):
+        self.limits = limits
+        self.semaphore = asyncio.Semaphore(limits.per_client)
+        self.pending = 0
+        self.tasks = set()
+        # 有序通道中还没执行的命令: (factory, 上下文, 翻页类型, 被合并时的回复)
+        self.key_queue = deque()
+        self._key_ready = asyncio.Event()
+        self._key_worker = None
+
+    async def submit(self, command, factory, nav=None, on_coalesced=None):
+        """按命令所在通道执行 factory() 返回的协程，排队过多时抛出 SchedulerBusy
+
+        nav 为有序通道命令的翻页类型（key_injector.navigation_kind），
+        NAV_STEP 的命令被合并时不执行，改为执行 on_coalesced() 回复客户端"""
+        lane = self.limits.lane(command)
+        if lane == LANE_INLINE:
+            await factory()
+            return
+
+        if lane == LANE_ORDERED:
+            coalesced = self._coalesce() if nav == NAV_JUMP and self.limits.coalesce_keys else ()
+            if len(self.key_queue) >= self.limits.key_queue_size:
+                self.limits.rejected += 1
+                raise SchedulerBusy("按键排队过多")
+            if self._key_worker is None:
+                self._key_worker = asyncio.create_task(self._run_ordered())
+            # 带上当前上下文，日志采样和错误统计仍然对应这条命令
+            self.key_queue.append((factory, contextvars.copy_context(), nav, on_coalesced))
+            self._key_ready.set()
+            for reply, context in coalesced:
+                await asyncio.create_task(_guard(reply()), context=context)
+            return
+
+        if lane == LANE_BACKGROUND:
+            if self.pending >= self.limits.per_client_pending:
+                self.limits.rejected += 1
+                raise SchedulerBusy("排队中的命令过多")
+            self.pending += 1
+            self.limits.pending += 1
+            coro = self._run_limited(factory)
+        else:
+            coro = _guard(factory())
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        # 让新任务先执行到第一个等待点，保证它和之后收到的消息的先后顺序
+        await asyncio.sleep(0)
+
+    def _coalesce(self) -> list:
+        """从有序队列中移除还没执行的相对翻页，返回它们的 (回复, 上下文)"""
+        kept, dropped = deque(), []
+        for item in self.key_queue:
+            if item[2] == NAV_STEP and item[3] is not None:
+                dropped.append((item[3], item[1]))
+            else:
+                kept.append(item)
+        if dropped:
+            self.key_queue = kept
+            self.limits.coalesced += len(dropped)
+            logger.info(f"合并了 {len(dropped)} 个排队中的翻页按键")
+        return dropped
+
+    async def _run_ordered(self):
+        while True:
+            while not self.key_queue:
+                self._key_ready.clear()
+                await self._key_ready.wait()
+            factory, context, _, _ = self.key_queue.popleft()
+            task = asyncio.create_task(_guard(factory()), context=context)
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            # 连接断开时正在注入的按键继续执行完，结果照常记入重复消息缓存，重发时不会再按一次
+            await asyncio.shield(task)
+
+    async def _run_limited(self, factory):
+        try:
+            async with self.semaphore, self.limits.semaphore:
+                self.limits.running += 1
+                try:
+                    await _guard(factory())
+                finally:
+                    self.limits.running -= 1
+        finally:
+            self.pending -= 1
+            self.limits.pending -= 1
+
+    async def close(self):
+        """连接断开：丢弃还没执行的按键；正在执行的按键和后台命令继续执行完，回复会因连接关闭而丢弃"""
+        if self._key_worker is not None:
+            self._key_worker.cancel()
+            try:
+                await self._key_worker
+            except asyncio.CancelledError:
+                pass
+            self._key_worker = None
+
+
+async def _guard(coro):
+    try:
+        await coro
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"命令执行失败: {e}")
@@ -1,250 +1,576 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
-import base64
-import json
+import contextvars
+import hashlib
 import logging
+import multiprocessing
 import os
 import ssl
-import tempfile
-import pyautogui
+import time
 import websockets
-import ctypes
 from typing import Any
 from datetime import datetime
 from functions.avatar_switch import sendAvatarText
+import message_codec as codec
+from config_manager import ConfigManager
+from connection_registry import ConnectionRegistry
+from binary_frame import FrameError, is_framed, parse_frame
+from functions import running_config
+from functions.ack_tracker import AckTracker, Issued
+from functions.asr_cache import ASRCache
+from functions.asr_pool import FunASRPool
+from functions.audio_codec import AUDIO_ENCODINGS, AudioCodecError, decode_audio
+from functions.audio_buffer import AudioBuffer
+from functions.audio_preprocess import AudioPreprocessor, WavFormatError
+from functions.state_watcher import StateWatcher
+from functions.voice_asr import VoiceASR
+from function_registry import FunctionRegistry
+from image_upload import ImageUploads, UploadError, decode_base64
+from key_injector import KeyInjector, InjectorBusy, FailSafeTriggered, KeyBatchError, create_backend, navigation_kind
+from log_setup import HotPathLog, current_command, load_logging_options, setup_logging
+from loop_monitor import LoopMonitor
+from metrics import Metrics
+from offload import PayloadDecoder
+from profiler import Profiler, ProfilerBusy
+from rate_limit import RateLimiter
+from relay import RelayGroup
+from replay_cache import ReplayCache, current_key
+from scheduler import LANE_ORDERED, CommandLimits, ConnectionScheduler, SchedulerBusy
+from transport import TransportOptions
 
-# 创建logs目录
-logs_dir = "logs"
-if not os.path.exists(logs_dir):
-    os.makedirs(logs_dir)
-
-# 配置日志文件
-log_filename = datetime.now().strftime("server_%Y%m%d_%H%M%S.log")
-log_filepath = os.path.join(logs_dir, log_filename)
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filepath, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
-logger.info(f"日志文件已创建: {log_filepath}")
+
+
+def require_str(content):
+    """内容必须是非空字符串"""
+    if not content or not isinstance(content, str):
+        return "内容不能为空，应为字符串"
+
+
+def require_dict(content):
+    """内容必须是非空字典"""
+    if not content or not isinstance(content, dict):
+        return "内容格式错误，应为字典"
+
+
+def require_list(content):
+    """内容必须是非空列表"""
+    if not content or not isinstance(content, list):
+        return "内容格式错误，应为列表"
+
+
+def require_payload(content):
+    """内容是base64字符串；大消息在进程池中解析时已解码为 bytes"""
+    if not content or not isinstance(content, (str, bytes)):
+        return "内容不能为空，应为字符串"
+
+
+def require_voice(content):
+    """语音内容是base64字符串，或带编码说明的字典 {"encoding", "sample_rate", "data"}"""
+    if isinstance(content, dict):
+        content = content.get('data')
+    return require_payload(content)
+
+
+def optional_dict(content):
+    """内容可以省略，提供时必须是字典"""
+    if content is not None and not isinstance(content, dict):
+        return "内容格式错误，应为字典"
+
+
+# key 命令支持的按键
+KEY_COMMAND_KEYS = ('Left', 'Right', 'Space', 'Up', 'Down', 'Enter')
+
+# 握手时告诉客户端可以使用的语音编码
+AUDIO_ENCODINGS_JSON = codec.dumps(list(AUDIO_ENCODINGS))
+
+# 修改后需要重启才能生效的配置
+RESTART_KEYS = ('bind_host', 'ssl_cert', 'ssl_key', 'funasr_host', 'slide_monitor_dir', 'asr_pool',
+                'key_injector', 'ack', 'scheduler', 'broadcast', 'logging', 'metrics', 'config_reload',
+                'transport', 'replay_cache', 'rate_limit', 'loop_monitor',
+                'payload_decode', 'relay')
+
+# 可以执行管理命令（profile）的客户端IP，默认只有本机
+DEFAULT_ADMIN_IPS = ('127.0.0.1', '::1')
+
+
+class CapturedReply:
+    """中继时在本机执行命令用：处理函数的回复先记下来，和其它主机的结果合并后再发给手机"""
+
+    def __init__(self, websocket):
+        self.remote_address = websocket.remote_address
+        self.payload = None
+
+    async def send(self, payload):
+        if self.payload is None:
+            self.payload = payload
+
 
 class WebSocketKeyServer:
-    def __init__(self):
-        self.config = self.load_config()
+    def __init__(self, config_path: str = 'config.json'):
+        self.config_path = config_path
+        self.config_manager = ConfigManager(config_path, on_change=self.apply_config)
         self.port = self.config.get('host_port', 56789)
         self.host_name = self.config.get('host_name', 'WebSocketServer')
         self.tag_id = self.config.get('tag_id', '')
         self.funasr_host = self.config.get('funasr_host', '')
+        if self.config.get('slide_monitor_dir'):
+            running_config.configure(self.config['slide_monitor_dir'])
+        self.function_registry = FunctionRegistry.from_config(self.config)
+        self.ack_tracker = AckTracker(running_config.get_store(), **self.config.get('ack', {}))
+        self.key_injector = self.create_key_injector()
+        self.macros = self.compile_macros(self.config)
+        self.asr = self.create_asr()
+        preprocess_options = dict(self.config.get('audio_preprocess', {}))
+        self.preprocessor = AudioPreprocessor(**preprocess_options) if preprocess_options.pop('enabled', True) else None
+        self.images = ImageUploads(**self.config.get('image_upload', {}))
+        # 每个连接当前打开的流式语音会话
+        self.voice_streams = {}
+        self.routes = self.build_routes()
+        self.command_limits = CommandLimits.from_config(self.config)
+        replay_options = dict(self.config.get('replay_cache', {}))
+        self.replay = ReplayCache(**replay_options) if replay_options.pop('enabled', True) else None
+        limit_options = dict(self.config.get('rate_limit', {}))
+        self.rate_limiter = RateLimiter(**limit_options) if limit_options.pop('enabled', True) else None
+        broadcast_options = dict(self.config.get('broadcast', {}))
+        poll_interval = broadcast_options.pop('poll_interval', 0.2)
+        self.connections = ConnectionRegistry(**broadcast_options)
+        self.state_watcher = StateWatcher(running_config.get_store(), self.broadcast_state,
+                                          poll_interval=poll_interval)
+        self.hot_log = HotPathLog(logger, self.config.get('logging', {}))
+        self.transport = TransportOptions.from_config(self.config)
+        self.decoder = PayloadDecoder(**self.config.get('payload_decode', {}))
+        self.relay = RelayGroup.from_config(self.config)
+        monitor_options = dict(self.config.get('loop_monitor', {}))
+        self.loop_monitor = LoopMonitor(observe=lambda lag_ms: self.metrics.observe_stage("loop_lag", lag_ms),
+                                        **monitor_options) if monitor_options.pop('enabled', True) else None
+        self.profiler = Profiler(self.config.get('logging', {}).get('dir', 'logs'),
+                                 **self.config.get('admin', {}).get('profiler', {}))
+        self.metrics = self.create_metrics()
+        self._ws_server = None
+        self._metrics_server = None
+        # TLS会话票据的密钥属于 SSLContext，换端口时复用同一个，客户端已有的票据继续有效
+        self._ssl_context = None
+        # (配置快照, 序列化后的内容)，配置快照被替换后自动失效
+        self._handshake_cache = (None, None)
+
+    @property
+    def config(self) -> dict:
+        """当前配置快照，配置修改时整体替换，不要原地修改"""
+        return self.config_manager.config
 
     async def handle_connection(self, websocket):
         """处理客户端连接"""
         client_ip = websocket.remote_address[0]
         connection_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         logger.info(f"客户端连接 - IP: {client_ip}, 时间: {connection_time}")
+        self.metrics.connected_clients += 1
+        self.connections.register(websocket, client_ip)
+        self.transport.record_connection(websocket)
+        scheduler = ConnectionScheduler(self.command_limits)
         
         try:
             async for message in websocket:
-                logger.info(f"收到消息: {message[:150]}...")
-                await self.handle_message(websocket, message, client_ip)
+                if isinstance(message, bytes):
+                    await self.handle_binary_message(websocket, message, scheduler)
+                    continue
+                await self.handle_message(websocket, message, client_ip, scheduler)
         except websockets.exceptions.ConnectionClosed:
             disconnect_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             logger.info(f"客户端断开连接 - IP: {client_ip}, 连接时间: {connection_time}, 断开时间: {disconnect_time}")
         except Exception as e:
             disconnect_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             logger.error(f"客户端连接异常 - IP: {client_ip}, 连接时间: {connection_time}, 断开时间: {disconnect_time}, 错误: {e}")
+        finally:
+            self.metrics.connected_clients -= 1
+            self.connections.unregister(websocket)
+            await scheduler.close()
+            stream = self.voice_streams.pop(websocket, None)
+            if stream is not None:
+                await stream.close()
+
+    def build_routes(self):
+        """命令分发表: 命令 -> (处理函数, 内容校验函数)"""
+        return {
+            'handshake': (self.handle_handshake, None),
+            'key': (self.handle_key_command, require_str),
+            'key_batch': (self.handle_key_batch_command, require_list),
+            'macro': (self.handle_macro_command, require_str),
+            'set': (self.handle_set_command, require_dict),
+            'text': (self.handle_text_command, require_str),
+            'voice': (self.handle_voice_command, require_voice),
+            'voice_start': (self.handle_voice_start, optional_dict),
+            'voice_end': (self.handle_voice_end, None),
+            'image': (self.handle_image_command, require_payload),
+            'image_begin': (self.handle_image_begin, require_dict),
+            'image_end': (self.handle_image_end, require_dict),
+            'function': (self.handle_function_command, require_str),
+            'stats': (self.handle_stats_command, None),
+            'subscribe': (self.handle_subscribe_command, optional_dict),
+            'profile': (self.handle_profile_command, optional_dict),
+        }
 
-    async def handle_message(self, websocket, message: str, client_ip: str):
-        """处理客户端消息"""
+    async def handle_message(self, websocket, message: str, client_ip: str, scheduler: ConnectionScheduler = None):
+        """处理客户端消息，有调度器时按命令所在通道执行，否则直接执行"""
+        received = time.perf_counter()
+        msg_id = None
         try:
-            data = json.loads(message)
+            # 大消息在进程池中解析，不卡住其它手机的按键
+            data = await self.decoder.loads(message) if self.decoder.offload(message) else codec.loads(message)
             command = data.get('command')
             content = data.get('content')
             msg_id = data.get('msg_id')
             client_id = data.get('client_id')
+            # 其它主机中继过来的消息只在本机执行
+            relayed = data.get('relayed') is True
+            self.hot_log.begin(command)
+            if await self.throttled(websocket, client_ip, client_id, command, msg_id):
+                return
+            self.hot_log.inbound(command, msg_id, message)
             
             if not msg_id:
                 await self.send_error(websocket, "消息ID不能为空")
                 return
+            if client_id and not relayed:
+                self.connections.identify(websocket, client_id)
 
-            if command == 'handshake':
-                await self.handle_handshake(websocket, msg_id)
-            elif command == 'key' and content:
-                await self.handle_key_command(websocket, content, msg_id)
-            elif command == 'set' and content:
-                await self.handle_set_command(websocket, content, msg_id)
-            elif command == 'text' and content:
-                await self.handle_text_command(websocket, content, msg_id)
-            elif command == 'voice' and content:
-                await self.handle_voice_command(websocket, content, msg_id)
-            elif command == 'image' and content:
-                await self.handle_image_command(websocket, content, msg_id)
-            elif command == 'function' and content:
-                await self.handle_function_command(websocket, content, msg_id)
-            else:
+            route = self.routes.get(command)
+            if route is None:
                 logger.info(f"未知命令: {command}")
-                await self.send_error(websocket, f"未知命令: {command}")
+                await self.send_error(websocket, f"未知命令: {command}", msg_id)
+                return
+
+            handler, validate = route
+            error = validate(content) if validate else None
+            if error:
+                await self.send_error(websocket, f"{command} {error}", msg_id)
+                return
+            await self.dispatch(scheduler, websocket, command, handler, content, msg_id, client_id, relayed,
+                                received)
                 
-        except json.JSONDecodeError:
+        except codec.DecodeError:
             await self.send_error(websocket, "JSON格式错误")
         except Exception as e:
             logger.error(f"处理消息时发生错误: {e}")
-            await self.send_error(websocket, "服务器内部错误")
+            await self.send_error(websocket, "服务器内部错误", msg_id)
     
-    async def handle_handshake(self, websocket, msg_id: str):
-        """处理握手命令"""
-        response = {
-            "msg_id": msg_id,
-            "result": "success",
-            "content": self.config
-        }
-        await websocket.send(json.dumps(response))
-        logger.info(json.dumps(response))
+    async def throttled(self, websocket, client_ip, client_id, command, msg_id) -> bool:
+        """超过限速时回复繁忙错误并返回 True，消息不再处理"""
+        if self.rate_limiter is None:
+            return False
+        retry_after = self.rate_limiter.check(client_ip, client_id, command)
+        if not retry_after:
+            return False
+        await self.send_error(websocket, "服务器繁忙: 消息过快", msg_id,
+                              retry_after_ms=round(retry_after * 1000))
+        return True
+
+    def navigation_kind(self, command, content):
+        """有序通道命令的翻页类型，用于合并排队中的翻页"""
+        if command == 'key':
+            return navigation_kind((("press", content),)) if content in KEY_COMMAND_KEYS else None
+        try:
+            if command == 'key_batch':
+                return navigation_kind(self.key_injector.compile(content))
+        except KeyBatchError:
+            return None
+        if command == 'macro' and content in self.macros:
+            return navigation_kind(self.macros[content])
+        return None
+
+    async def dispatch(self, scheduler, websocket, command, handler, content, msg_id, client_id, relayed=False,
+                       received=None):
+        """把已校验的命令交给调度器，received 为收到消息的时间，命令耗时从这里算起"""
+        def run():
+            return self.execute(websocket, command, handler, content, msg_id, client_id, relayed, received)
+
+        def coalesced():
+            # 被后面的 Home/End 覆盖，没有执行
+            return self.send_response(websocket, {"id": msg_id, "result": "success", "coalesced": True})
+
+        if scheduler is None:
+            await run()
+            return
+        nav = None
+        if self.command_limits.coalesce_keys and self.command_limits.lane(command) == LANE_ORDERED:
+            nav = self.navigation_kind(command, content)
+        try:
+            await scheduler.submit(command, run, nav, coalesced)
+        except SchedulerBusy as e:
+            logger.warning(f"命令被拒绝 (ID: {msg_id}): {e}")
+            await self.send_error(websocket, f"服务器繁忙: {e}", msg_id)
+
+    async def execute(self, websocket, command, handler, content, msg_id, client_id, relayed=False,
+                      received=None):
+        """执行一条命令并统计耗时，处理函数抛出的异常统一回复内部错误
+
+        重发的消息（同一 client_id 和 msg_id）直接回复原来的结果，不再执行"""
+        key = self.replay.key_for(command, client_id, msg_id) if self.replay is not None else None
+        if key is not None:
+            payload = await self.replay.lookup(key)
+            if payload is not None:
+                logger.info(f"重复消息，返回缓存的回复 (ID: {msg_id})")
+                await websocket.send(payload)
+                self.hot_log.response(payload)
+                return
+            token = self.replay.begin(key)
+        try:
+            with self.metrics.track(command, received):
+                if self.relay is not None and self.relay.handles(command, relayed):
+                    await self.execute_relayed(websocket, command, handler, content, msg_id, client_id)
+                else:
+                    await handler(websocket, content, msg_id, client_id)
+        except websockets.exceptions.ConnectionClosed:
+            raise
+        except Exception as e:
+            logger.error(f"处理消息时发生错误: {e}")
+            await self.send_error(websocket, "服务器内部错误", msg_id)
+        finally:
+            if key is not None:
+                self.replay.finish(key, token)
+
+    async def execute_relayed(self, websocket, command, handler, content, msg_id, client_id):
+        """本机执行的同时并行转发给中继组的其它主机，所有主机的结果合并成一条回复"""
+        local = None
+        if self.relay.include_local:
+            # 本机的回复只是合并结果的一部分，不能被记作这条消息的缓存回复
+            context = contextvars.copy_context()
+            context.run(current_key.set, None)
+            local = asyncio.create_task(self.run_captured(handler, websocket, content, msg_id, client_id),
+                                        context=context)
+        hosts = await self.relay.fan_out(command, content, msg_id, client_id)
+        if local is not None:
+            hosts = {self.relay.name: await local, **hosts}
+        for name, result in hosts.items():
+            self.metrics.observe_stage(f"relay_{name}", result["ms"])
+
+        response = {"id": msg_id, "result": "success", "hosts": hosts}
+        failed = [name for name, result in hosts.items() if result.get("result") != "success"]
+        if failed:
+            response["result"] = "error" if len(failed) == len(hosts) else "partial"
+            response["message"] = f"以下主机执行失败: {failed}"
+        await self.send_response(websocket, response)
+
+    async def run_captured(self, handler, websocket, content, msg_id, client_id) -> dict:
+        """在本机执行命令，返回去掉 id 的回复和耗时"""
+        capture = CapturedReply(websocket)
+        started = time.perf_counter()
+        try:
+            await handler(capture, content, msg_id, client_id)
+            result = codec.loads(capture.payload) if capture.payload else {"result": "error", "message": "没有回复"}
+            result.pop("id", None)
+        except Exception as e:
+            logger.error(f"本机执行中继命令失败: {e}")
+            result = {"result": "error", "message": "服务器内部错误"}
+        result["ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    async def handle_handshake(self, websocket, content, msg_id: str, client_id=None):
+        """处理握手命令，配置部分预先序列化，配置变化时才重新生成
+
+        握手后的连接默认订阅状态推送"""
+        self.connections.subscribe(websocket)
+        config, content = self._handshake_cache
+        if config is not self.config:
+            config = self.config
+            content = codec.dumps(config)
+            self._handshake_cache = (config, content)
+        payload = (f'{{"msg_id":{codec.dumps(msg_id)},"result":"success","content":{content},'
+                   f'"audio_encodings":{AUDIO_ENCODINGS_JSON}}}')
+        await websocket.send(payload)
+        self.hot_log.response(payload)
     
-    async def handle_key_command(self, websocket, key: str, msg_id: str):
+    async def handle_key_command(self, websocket, key: str, msg_id: str, client_id=None):
         """处理按键命令"""
         try:
             # 验证按键是否支持
-            valid_keys = ['Left', 'Right', 'Space', 'Up', 'Down', 'Enter']
-            if key not in valid_keys:
-                await self.send_error(websocket, f"不支持的按键: {key}")
+            if key not in KEY_COMMAND_KEYS:
+                await self.send_error(websocket, f"不支持的按键: {key}", msg_id)
                 return
                 
-            # 模拟按键操作
-            # 为避免部分101键盘的小键盘num lock键影响上下左右的输出
-            # 先检查 num lock 键的状态,如果开启则关闭
-            if key in ['Up', 'Down', 'Left', 'Right']:
-                if bool(ctypes.windll.user32.GetKeyState(0x90) & 1):
-                    pyautogui.press('numlock')
-
-            pyautogui.press(key)
+            # 交给注入线程执行，注入完成后再回复
+            timing = await self.key_injector.press(key, client_id)
+            self.metrics.observe_stage("inject_queue", timing["queue_wait_ms"])
+            self.metrics.observe_stage("inject", timing["inject_ms"])
             
             response = {
                 "id": msg_id,
-                "result": "success"
+                "result": "success",
+                **timing
             }
-            await websocket.send(json.dumps(response))
-            logger.info(json.dumps(response))
+            await self.send_response(websocket, response)
             
-        except pyautogui.FailSafeException:
-            await self.send_error(websocket, "安全保护触发，无法执行按键")
+        except InjectorBusy:
+            await self.send_error(websocket, "按键队列已满，请稍后重试", msg_id)
+        except FailSafeTriggered:
+            await self.send_error(websocket, "安全保护触发，无法执行按键", msg_id)
+        except websockets.exceptions.ConnectionClosed:
+            # 按键已经注入，只是回复发不出去；成功回复已记入重复消息缓存
+            raise
         except Exception as e:
             logger.error(f"执行按键 {key} 时发生错误: {e}")
-            await self.send_error(websocket, f"执行按键失败: {key}")
+            await self.send_error(websocket, f"执行按键失败: {key}", msg_id)
     
-    async def handle_set_command(self, websocket, content: dict, msg_id: str):
+    async def handle_key_batch_command(self, websocket, content: list, msg_id: str, client_id=None):
+        """处理按键序列命令：整个序列先校验，再依次注入，完成后回复一次"""
+        try:
+            steps = self.key_injector.compile(content)
+        except KeyBatchError as e:
+            await self.send_error(websocket, f"按键序列格式错误: {e}", msg_id)
+            return
+        await self.inject_steps(websocket, steps, msg_id, client_id)
+
+    async def handle_macro_command(self, websocket, name: str, msg_id: str, client_id=None):
+        """执行 config.json 中 macros 定义的按键宏"""
+        steps = self.macros.get(name)
+        if steps is None:
+            await self.send_error(websocket, f"未定义的宏: {name}", msg_id)
+            return
+        await self.inject_steps(websocket, steps, msg_id, client_id)
+
+    async def inject_steps(self, websocket, steps: tuple, msg_id: str, client_id=None):
+        try:
+            timing = await self.key_injector.press_batch(steps, client_id)
+            self.metrics.observe_stage("inject_queue", timing["queue_wait_ms"])
+            self.metrics.observe_stage("inject_batch", timing["inject_ms"])
+            await self.send_response(websocket, {"id": msg_id, "result": "success", **timing})
+        except InjectorBusy:
+            await self.send_error(websocket, "按键队列已满，请稍后重试", msg_id)
+        except FailSafeTriggered:
+            await self.send_error(websocket, "安全保护触发，无法执行按键", msg_id)
+        except websockets.exceptions.ConnectionClosed:
+            # 按键已经注入，只是回复发不出去；成功回复已记入重复消息缓存
+            raise
+        except Exception as e:
+            logger.error(f"执行按键序列时发生错误: {e}")
+            await self.send_error(websocket, f"执行按键序列失败: {e}", msg_id)
+
+    async def handle_set_command(self, websocket, content: dict, msg_id: str, client_id=None):
         """处理设置命令"""
         try:
-            # 验证内容格式
-            if not isinstance(content, dict):
-                await self.send_error(websocket, "内容格式错误，应为字典")
-                return
-                
             # 获取要修改的字段
             new_name = content.get('host_name')
             new_tag_id = content.get('tag_id')
             
             # 检查是否有有效的修改
             if new_name is None and new_tag_id is None:
-                await self.send_error(websocket, "未提供有效的修改字段")
+                await self.send_error(websocket, "未提供有效的修改字段", msg_id)
                 return
             
             # 更新配置
-            updated = False
+            changes = {}
             if new_name is not None and new_name != self.host_name:
                 self.host_name = new_name
-                self.config['host_name'] = new_name
-                updated = True
+                changes['host_name'] = new_name
                 logger.info(f"更新服务器名称: {new_name}")
                 
             if new_tag_id is not None and new_tag_id != self.tag_id:
                 self.tag_id = new_tag_id
-                self.config['tag_id'] = new_tag_id
-                updated = True
+                changes['tag_id'] = new_tag_id
                 logger.info(f"更新tag_id: {new_tag_id}")
             
-            # 保存配置到文件
+            # 延迟合并写入文件
+            updated = bool(changes)
             if updated:
-                self.save_config()
+                self.config_manager.update(changes)
             
             response = {
                 "id": msg_id,
                 "result": "success",
                 "updated": updated
             }
-            await websocket.send(json.dumps(response))
-            logger.info(json.dumps(response))
+            await self.send_response(websocket, response)
             
         except Exception as e:
             logger.error(f"执行设置命令时发生错误: {e}")
-            await self.send_error(websocket, f"设置失败: {str(e)}")
+            await self.send_error(websocket, f"设置失败: {str(e)}", msg_id)
     
-    async def handle_text_command(self, websocket, content: str, msg_id: str):
+    async def handle_text_command(self, websocket, content: str, msg_id: str, client_id=None):
         """处理文本命令"""
         try:
             # 打印语音内容
             logger.info(f"收到文本消息 (ID: {msg_id}): {content}")
             
             # 返回成功响应
-            response = {
-                "id": msg_id,
-                "result": "success"
-            }
-            await websocket.send(json.dumps(response))
-            logger.info(json.dumps(response))
+            await self.send_success(websocket, msg_id)
             
         except Exception as e:
             logger.error(f"处理文本命令时发生错误: {e}")
-            await self.send_error(websocket, f"文本处理失败: {str(e)}")
+            await self.send_error(websocket, f"文本处理失败: {str(e)}", msg_id)
 
-    async def handle_voice_command(self, websocket, content: str, msg_id: str):
-        """处理语音命令 - 使用FunASR服务进行语音转文字"""
+    async def handle_voice_command(self, websocket, content, msg_id: str, client_id=None):
+        """处理语音命令 - 使用FunASR服务进行语音转文字
+
+        content 可以是base64字符串，也可以是字典 {"encoding", "sample_rate", "block_align", "data"}，
+        data 是base64字符串或二进制帧的负载（memoryview）；encoding 为握手时返回的 audio_encodings 之一，默认 wav
+        """
         try:
-            # 解码base64语音数据
-            logger.info(f"收到语音消息 (ID: {msg_id}): 数据长度 {len(content)}")
-            
-            # 解码base64
-            try:
-                audio_data = base64.b64decode(content)
-                logger.info(f"Base64解码成功: {len(audio_data)} 字节")
-            except Exception as e:
-                logger.error(f"Base64解码失败: {e}")
-                await self.send_error(websocket, "语音数据格式错误")
+            options = content if isinstance(content, dict) else {}
+            data = options.get('data', content)
+            logger.info(f"收到语音消息 (ID: {msg_id}): 数据长度 {len(data)}")
+
+            encoding = options.get('encoding') or 'wav'
+            if encoding not in AUDIO_ENCODINGS:
+                await self.send_error(websocket, f"不支持的语音编码: {encoding}", msg_id)
+                return
+            sample_rate = options.get('sample_rate')
+            block_align = options.get('block_align')
+            if any(value is not None and (not isinstance(value, int) or value <= 0)
+                   for value in (sample_rate, block_align)):
+                await self.send_error(websocket, "语音数据格式错误: sample_rate 和 block_align 应为正整数", msg_id)
                 return
-            
-            # 将语音数据保存为临时文件
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_filename = temp_file.name
-            
-            logger.info(f"语音数据保存成功: {temp_filename}")
 
-            # 处理语音
-            from functions.voice_asr import VoiceASR
-            asr = VoiceASR()
-            text = asr.call_funasr_service(temp_filename)
-            # if self.funasr_host == "":
-            #     logger.error("FunASR服务未配置")
-            #     await self.send_error(websocket, "FunASR服务未配置")
-            #     return
+            if isinstance(data, str):
+                # 解码base64，大内容在线程池中分段解码
+                try:
+                    audio = AudioBuffer(await self.decoder.b64decode(data), source="base64")
+                    audio.record_copy("base64_decode", len(audio))
+                    logger.info(f"Base64解码成功: {len(audio)} 字节")
+                except Exception as e:
+                    logger.error(f"Base64解码失败: {e}")
+                    await self.send_error(websocket, "语音数据格式错误", msg_id)
+                    return
+            elif isinstance(data, bytes):
+                # 进程池解析消息时已经解码
+                audio = AudioBuffer(data, source="base64")
+                audio.record_copy("base64_decode", len(audio))
+            else:
+                audio = AudioBuffer(data)
+
+            # μ-law / A-law / IMA-ADPCM 先解码成16位PCM
+            if encoding not in ('wav', 'pcm'):
+                started = time.perf_counter()
+                try:
+                    audio = await self.run_blocking(decode_audio, audio, encoding, sample_rate, block_align)
+                except AudioCodecError as e:
+                    logger.error(f"语音解码失败 (ID: {msg_id}): {e}")
+                    await self.send_error(websocket, f"语音数据格式错误: {e}", msg_id)
+                    return
+                self.metrics.observe_stage("audio_decode", (time.perf_counter() - started) * 1000)
+            else:
+                audio.sample_rate = sample_rate
 
-            # 使用FunASR客户端进行语音识别
-            # text = await self.call_funasr_service(temp_filename, msg_id)
+            # 转成16kHz单声道PCM并去掉首尾静音，CPU计算放到线程池
+            if self.preprocessor is not None:
+                started = time.perf_counter()
+                try:
+                    audio = await self.run_blocking(self.preprocessor.apply, audio)
+                except WavFormatError as e:
+                    logger.error(f"语音数据格式错误 (ID: {msg_id}): {e}")
+                    await self.send_error(websocket, f"语音数据格式错误: {e}", msg_id)
+                    return
+                self.metrics.observe_stage("preprocess", (time.perf_counter() - started) * 1000)
+
+            # 处理语音，音频全程留在内存中
+            started = time.perf_counter()
+            text = await self.asr.recognize(audio, msg_id)
+            self.metrics.observe_stage("asr_cache" if audio.cache_hit else "asr",
+                                       (time.perf_counter() - started) * 1000)
+            logger.info(f"语音数据拷贝统计 (ID: {msg_id}): {audio.report()}")
 
             logger.info("向数字人发送文本消息: %s", text)
-            logger.info(sendAvatarText(text))
-           
-            # 清理临时文件
-            try:
-                os.unlink(temp_filename)
-            except Exception as e:
-                logger.info("remove tempfile fail:", e)
-                pass
+            logger.info(await self.run_blocking(sendAvatarText, text))
             
             # 指定的位置输入文本
             # if len(text) > 0:
@@ -255,106 +581,471 @@ class WebSocketKeyServer:
             response = {
                 "id": msg_id,
                 "result": "success",
-                "text": text
+                "text": text,
+                "bytes_copied": audio.bytes_copied,
+                "cached": audio.cache_hit
             }
-            await websocket.send(json.dumps(response))
-            logger.info(json.dumps(response))
+            await self.send_response(websocket, response)
             
         except Exception as e:
             logger.error(f"处理语音命令时发生错误: {e}")
-            await self.send_error(websocket, f"语音处理失败: {str(e)}")
+            await self.send_error(websocket, f"语音处理失败: {str(e)}", msg_id)
+
+    async def handle_voice_start(self, websocket, content, msg_id: str, client_id=None):
+        """开始流式语音会话，之后的二进制帧直接转发给FunASR"""
+        if websocket in self.voice_streams:
+            await self.send_error(websocket, "已有进行中的语音会话", msg_id)
+            return
+        content = content or {}
+
+        async def relay_result(response_data):
+            # 实时把中间结果和最终结果推送给客户端
+            await websocket.send(codec.dumps({
+                "id": msg_id,
+                "command": "voice_partial",
+                "mode": response_data.get("mode", ""),
+                "text": response_data.get("text", ""),
+                "is_final": response_data.get("is_final", False)
+            }))
+
+        try:
+            stream = self.asr.open_stream(msg_id, on_result=relay_result,
+                                     sample_rate=int(content.get('sample_rate', 16000)))
+            await stream.open()
+        except Exception as e:
+            logger.error(f"连接FunASR服务失败: {e}")
+            await self.send_error(websocket, f"语音识别服务不可用: {str(e)}", msg_id)
+            return
+
+        self.voice_streams[websocket] = stream
+        logger.info(f"流式语音会话开始 (ID: {msg_id})")
+        await self.send_success(websocket, msg_id)
+
+    async def handle_binary_message(self, websocket, data: bytes, scheduler: ConnectionScheduler = None):
+        """处理二进制帧：带帧头的是完整命令，否则转发到当前的流式语音会话"""
+        if is_framed(data):
+            await self.handle_framed_message(websocket, data, scheduler)
+            return
+        stream = self.voice_streams.get(websocket)
+        if stream is None:
+            await self.send_error(websocket, "没有进行中的语音会话")
+            return
+        try:
+            await stream.feed(data)
+        except Exception as e:
+            logger.error(f"转发语音数据失败 (ID: {stream.session_id}): {e}")
+            self.voice_streams.pop(websocket, None)
+            await stream.close()
+            await self.send_error(websocket, f"语音处理失败: {str(e)}", stream.session_id)
 
-    async def handle_image_command(self, websocket, content: str, msg_id: str):
+    async def handle_framed_message(self, websocket, data: bytes, scheduler: ConnectionScheduler = None):
+        """处理带帧头的二进制命令，负载以 memoryview 传递"""
+        received = time.perf_counter()
+        try:
+            header, payload = parse_frame(data)
+        except FrameError as e:
+            await self.send_error(websocket, str(e))
+            return
+        command = header.get('command')
+        msg_id = header.get('msg_id')
+        self.hot_log.begin(command)
+        if await self.throttled(websocket, websocket.remote_address[0], header.get('client_id'), command, msg_id):
+            return
+        self.hot_log.inbound(command, msg_id, data)
+        if not msg_id:
+            await self.send_error(websocket, "消息ID不能为空")
+            return
+        if command == 'voice' and len(payload):
+            await self.dispatch(scheduler, websocket, command, self.handle_voice_command,
+                                dict(header, data=payload), msg_id, header.get('client_id'), received=received)
+        elif command == 'image_chunk':
+            await self.dispatch(scheduler, websocket, command, self.handle_image_chunk,
+                                dict(header, data=payload), msg_id, header.get('client_id'), received=received)
+        else:
+            logger.info(f"未知二进制命令: {command}")
+            await self.send_error(websocket, f"未知二进制命令: {command}", msg_id)
+
+    async def handle_voice_end(self, websocket, content, msg_id: str, client_id=None):
+        """结束流式语音会话，返回最终识别结果"""
+        stream = self.voice_streams.pop(websocket, None)
+        if stream is None:
+            await self.send_error(websocket, "没有进行中的语音会话", msg_id)
+            return
+        try:
+            text = await stream.finish()
+            logger.info(f"流式语音会话结束 (ID: {stream.session_id}): {stream.bytes_sent} 字节")
+
+            logger.info("向数字人发送文本消息: %s", text)
+            logger.info(await self.run_blocking(sendAvatarText, text))
+
+            response = {
+                "id": msg_id,
+                "result": "success",
+                "text": text
+            }
+            await self.send_response(websocket, response)
+        except Exception as e:
+            logger.error(f"处理语音命令时发生错误: {e}")
+            await self.send_error(websocket, f"语音处理失败: {str(e)}", msg_id)
+
+    async def handle_image_command(self, websocket, content, msg_id: str, client_id=None):
+        """一条消息发送整张图片（base64，进程池解析的大消息已解码为 bytes），大图片请用分块上传"""
         logger.info(f"收到图片消息 (ID: {msg_id}): 数据长度 {len(content)}")
+        try:
+            if isinstance(content, bytes):
+                if len(content) > self.images.max_image_bytes:
+                    raise UploadError(f"图片过大，上限 {self.images.max_image_bytes} 字节")
+                data = content
+            elif len(content) > self.images.max_image_bytes * 4 // 3 + 4:
+                raise UploadError(f"图片过大，上限 {self.images.max_image_bytes} 字节")
+            elif len(content) > self.decoder.inline_max_bytes:
+                try:
+                    data = await self.decoder.b64decode(content, validate=True)
+                except ValueError as e:
+                    raise UploadError(f"Base64解码失败: {e}") from None
+            else:
+                data = decode_base64(content)
+            result = await self.images.store_bytes(data)
+        except UploadError as e:
+            await self.send_error(websocket, str(e), msg_id)
+            return
+        await self.send_response(websocket, {"id": msg_id, "result": "success", **result})
+
+    def upload_owner(self, websocket, client_id):
+        """上传归属：有 client_id 时按 client_id（可以换连接续传），否则按连接"""
+        return client_id or websocket
+
+    async def handle_image_begin(self, websocket, content: dict, msg_id: str, client_id=None):
+        """开始或续传分块图片上传"""
+        try:
+            result = await self.images.begin(self.upload_owner(websocket, client_id), content)
+        except UploadError as e:
+            await self.send_error(websocket, str(e), msg_id)
+            return
+        await self.send_response(websocket, {"id": msg_id, "result": "success", **result})
 
-    async def handle_function_command(self, websocket, content: str, msg_id: str):
+    async def handle_image_chunk(self, websocket, content: dict, msg_id: str, client_id=None):
+        """接收一个图片分块，写盘后回复；内存预算不足时在这里等待"""
+        async def reply(result):
+            response = {"id": msg_id, "result": "error" if "error" in result else "success", **result}
+            await self.send_response(websocket, response)
+
+        seq = content.get('seq')
+        if not isinstance(seq, int):
+            await self.send_error(websocket, "seq 应为整数", msg_id)
+            return
+        try:
+            await self.images.chunk(self.upload_owner(websocket, client_id), content.get('upload_id'),
+                                    seq, content['data'], reply)
+        except UploadError as e:
+            await self.send_error(websocket, str(e), msg_id)
+
+    async def handle_image_end(self, websocket, content: dict, msg_id: str, client_id=None):
+        """结束分块上传，校验后回复图片信息"""
+        try:
+            result = await self.images.end(self.upload_owner(websocket, client_id), content.get('upload_id'))
+        except UploadError as e:
+            await self.send_error(websocket, str(e), msg_id)
+            return
+        logger.info(f"图片上传完成 (ID: {msg_id}): {result['sha256']} {result['size']} 字节")
+        await self.send_response(websocket, {"id": msg_id, "result": "success", **result})
+
+    async def handle_function_command(self, websocket, content: str, msg_id: str, client_id=None):
         logger.info(f"收到功能命令 (ID: {msg_id}): {content}")
         try:
-            import functions
-            func = getattr(functions, content)
-            logger.info(f"run function: {func}()")
-            run_result = func()
+            entry = self.function_registry.get(content)
+            logger.info(f"run function: {entry.name}()")
+            started = time.perf_counter()
+            run_result = await self.function_registry.call(entry.name)
+            self.metrics.observe_stage("function", (time.perf_counter() - started) * 1000)
             logger.info(run_result)
             response = {
                 "id": msg_id,
                 "result": "success",
                 "text": f"{run_result}"
             }
-            await websocket.send(json.dumps(response))
+            # 功能下发了命令时，等slide monitor确认执行完成后再回复
+            if entry.ack_key and isinstance(run_result, Issued):
+                ack = await self.ack_tracker.wait_for(entry.ack_key)
+                self.metrics.observe_stage("ack", ack["ack_ms"])
+                response["ack"] = "confirmed" if ack["acknowledged"] else "timeout"
+                response["ack_ms"] = ack["ack_ms"]
+                if not ack["acknowledged"]:
+                    response["result"] = "error"
+                    logger.warning(f"slide monitor 未确认功能命令 (ID: {msg_id}): {content}")
+            await self.send_response(websocket, response)
         except Exception as e:
-            logger.info(f"error in run function: {content}:", e)
+            logger.info(f"error in run function: {content}: {e}")
             response = {
                 "id": msg_id,
                 "result": "error",
                 "text": f"{e}"
             }
-            await websocket.send(json.dumps(response))
+            await self.send_response(websocket, response)
 
-            
+    async def handle_stats_command(self, websocket, content, msg_id: str, client_id=None):
+        """返回运行指标"""
+        response = {
+            "id": msg_id,
+            "result": "success",
+            "content": self.metrics.snapshot()
+        }
+        await self.send_response(websocket, response)
 
-    def load_config(self):
-        """加载配置文件"""
-        try:
-            with open('config.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            logger.error("配置文件 config.json 未找到")
-            raise
-        except json.JSONDecodeError as e:
-            logger.error(f"配置文件格式错误: {e}")
-            raise
+    async def handle_subscribe_command(self, websocket, content, msg_id: str, client_id=None):
+        """订阅或取消订阅状态推送，回复当前状态"""
+        enabled = bool((content or {}).get('enabled', True))
+        self.connections.subscribe(websocket, enabled)
+        response = {
+            "id": msg_id,
+            "result": "success",
+            "subscribed": enabled,
+            "content": self.state_watcher.snapshot()
+        }
+        await self.send_response(websocket, response)
 
-    def save_config(self):
-        """保存配置到config.json文件"""
-        try:
-            with open('config.json', 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=4)
-            logger.info("配置已保存到config.json")
-        except Exception as e:
-            logger.error(f"保存配置失败: {e}")
-            raise
-    
-    async def send_error(self, websocket, error_msg: str):
-        """发送错误响应"""
+    async def handle_profile_command(self, websocket, content, msg_id: str, client_id=None):
+        """管理命令：开始、停止剖析或查看状态，只允许 admin.allowed_ips 中的IP"""
+        allowed = self.config.get('admin', {}).get('allowed_ips', DEFAULT_ADMIN_IPS)
+        if websocket.remote_address[0] not in allowed:
+            logger.warning(f"拒绝管理命令 profile - IP: {websocket.remote_address[0]}")
+            await self.send_error(websocket, "没有权限执行管理命令", msg_id)
+            return
+        content = content or {}
+        action = content.get('action', 'status')
+        if action == 'start':
+            try:
+                status = self.profiler.start(content.get('mode', 'sample'), content.get('seconds', 30))
+            except ProfilerBusy as e:
+                await self.send_error(websocket, str(e), msg_id)
+                return
+            except (TypeError, ValueError) as e:
+                await self.send_error(websocket, f"profile 参数错误: {e}", msg_id)
+                return
+        elif action == 'stop':
+            path = await self.profiler.stop()
+            status = {"running": False, "path": path}
+        elif action == 'status':
+            status = self.profiler.status()
+        else:
+            await self.send_error(websocket, f"profile 不支持的操作: {action}", msg_id)
+            return
+        await self.send_response(websocket, {"id": msg_id, "result": "success", "content": status})
+
+    async def broadcast_state(self, state: dict, changed: list):
+        """运行状态变化时推送给所有订阅的客户端"""
+        message = codec.dumps({"command": "state", "content": state, "changed": changed})
+        delivered = self.connections.broadcast(message)
+        logger.info(f"推送状态变化 {changed}: {delivered} 个客户端")
+
+    async def run_blocking(self, func, *args):
+        """在线程池中执行会读写文件的同步函数，避免阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def create_metrics(self):
+        """创建指标收集器，并接入各子系统自己的统计"""
+        metrics = Metrics()
+        # 功能列表修改后注册表会被替换，统计始终取当前的
+        metrics.add_source("functions", lambda: self.function_registry.stats())
+        metrics.add_source("config", self.config_manager.snapshot)
+        metrics.add_source("key_injector", self.key_injector.snapshot)
+        metrics.add_source("asr_pool", self.asr.pool.snapshot)
+        if self.asr.cache is not None:
+            metrics.add_source("asr_cache", self.asr.cache.snapshot)
+        metrics.add_source("images", self.images.snapshot)
+        metrics.add_source("connections", self.connections.snapshot)
+        metrics.add_source("scheduler", self.command_limits.snapshot)
+        metrics.add_source("transport", self.transport.snapshot)
+        if self.replay is not None:
+            metrics.add_source("replay_cache", self.replay.snapshot)
+        if self.rate_limiter is not None:
+            metrics.add_source("rate_limit", self.rate_limiter.snapshot)
+        if self.loop_monitor is not None:
+            metrics.add_source("loop_monitor", self.loop_monitor.snapshot)
+        metrics.add_source("payload_decode", self.decoder.snapshot)
+        if self.relay is not None:
+            metrics.add_source("relay", self.relay.snapshot)
+        metrics.add_source("running_config", lambda: dict(running_config.get_store().stats))
+        return metrics
+
+    def count_error(self):
+        """错误响应计入当前命令的错误数（只统计已知命令，避免任意命令名撑大指标）"""
+        command = current_command.get()
+        if command in self.routes:
+            self.metrics.error(command)
+
+    def create_key_injector(self):
+        """根据配置创建按键注入器"""
+        options = dict(self.config.get('key_injector', {}))
+        backend_name = options.pop('backend', 'pyautogui')
+        backend_options = options.pop('backend_options', {})
+        injector = KeyInjector(create_backend(backend_name, **backend_options), **options)
+        injector.start()
+        return injector
+
+    def compile_macros(self, config: dict) -> dict:
+        """启动时把 macros 中的按键宏编译好，格式错误的宏跳过并记录日志"""
+        macros = {}
+        for name, spec in config.get('macros', {}).items():
+            try:
+                macros[name] = self.key_injector.compile(spec)
+            except KeyBatchError as e:
+                logger.error(f"按键宏 {name} 格式错误，已忽略: {e}")
+        return macros
+
+    def create_asr(self):
+        """根据配置创建FunASR连接池和识别器"""
+        options = dict(self.config.get('asr_pool', {}))
+        result_timeout = options.pop('result_timeout', 10.0)
+        pool = FunASRPool(self.funasr_host, **options)
+        cache_options = dict(self.config.get('asr_cache', {}))
+        cache = ASRCache(**cache_options) if cache_options.pop('enabled', True) else None
+        return VoiceASR(self.funasr_host, pool=pool, result_timeout=result_timeout, cache=cache)
+
+    async def send_response(self, websocket, response: dict):
+        """序列化一次，发送并记录日志"""
+        payload = codec.dumps(response)
+        if response.get("result") == "error":
+            self.count_error()
+        elif self.replay is not None:
+            self.replay.record(payload)
+        await websocket.send(payload)
+        self.hot_log.response(payload)
+
+    async def send_success(self, websocket, msg_id: str):
+        """发送不带其它字段的成功响应"""
+        payload = f'{{"id":{codec.dumps(msg_id)},"result":"success"}}'
+        if self.replay is not None:
+            self.replay.record(payload)
+        await websocket.send(payload)
+        self.hot_log.response(payload)
+
+    async def send_error(self, websocket, error_msg: str, msg_id: str = None, **extra):
+        """发送错误响应，extra 为附加的字段（例如限速时的 retry_after_ms）"""
         error_response = {
             "result": "error",
-            "message": error_msg
+            "message": error_msg,
+            **extra
         }
-        await websocket.send(json.dumps(error_response))
+        if msg_id:
+            error_response["id"] = msg_id
+        self.count_error()
+        await websocket.send(codec.dumps(error_response))
     
-    async def start_server(self):
-        """启动WebSocket服务器"""
+    async def listen(self, port: int):
+        """在指定端口上启动WebSocket服务器"""
+        ssl_context = self._ssl_context
+        server = await websockets.serve(
+            self.handle_connection,
+            self.config.get('bind_host', '0.0.0.0'),
+            port,
+            ssl=ssl_context,
+            **self.transport.serve_kwargs()
+        )
+        port = server.sockets[0].getsockname()[1]
+        logger.info(f"{'WSS' if ssl_context else 'WS'}服务器启动成功，监听端口: {port}")
+        return server
+
+    async def serve(self):
+        """启动WebSocket服务器并返回服务器对象"""
         # 创建SSL上下文
-        ssl_context = self.create_ssl_context()
-        
-        if ssl_context:
-            server = await websockets.serve(
-                self.handle_connection, 
-                "0.0.0.0", 
-                self.port, 
-                ssl=ssl_context
-            )
-            logger.info(f"WSS服务器启动成功，监听端口: {self.port}")
-        else:
-            server = await websockets.serve(
-                self.handle_connection, 
-                "0.0.0.0", 
-                self.port
-            )
-            logger.info(f"WS服务器启动成功，监听端口: {self.port}")
+        self._ssl_context = self.create_ssl_context()
+        self._ws_server = await self.listen(self.port)
             
         logger.info(f"主机名称: {self.host_name}")
         logger.info(f"tag_id: {self.tag_id}")
 
-        # 保持服务器运行
-        await server.wait_closed()
-    
+        # 预热FunASR连接，避免开机后的第一条语音承担建连开销
+        await self.asr.pool.start()
+        self.state_watcher.start()
+        self.config_manager.start()
+        if self.loop_monitor is not None:
+            self.loop_monitor.start()
+        self.decoder.start()
+        if self.relay is not None:
+            await self.relay.start()
+
+        metrics_port = self.config.get('metrics', {}).get('http_port')
+        if metrics_port:
+            self._metrics_server = await self.metrics.serve_prometheus(port=metrics_port)
+        return self._ws_server
+
+    async def start_server(self):
+        """启动WebSocket服务器"""
+        await self.serve()
+
+        # 保持服务器运行，端口修改后换成新的服务器继续等待
+        try:
+            while True:
+                server = self._ws_server
+                await server.wait_closed()
+                if self._ws_server is server:
+                    break
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """关闭服务器，停止 serve() 启动的所有后台任务、线程和进程池"""
+        if self._ws_server is not None:
+            self._ws_server.close()
+            await self._ws_server.wait_closed()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
+        await self.config_manager.stop()
+        await self.state_watcher.stop()
+        if self.loop_monitor is not None:
+            await self.loop_monitor.stop()
+        await self.profiler.stop()
+        self.decoder.shutdown()
+        if self.relay is not None:
+            await self.relay.close()
+        await self.asr.pool.close()
+        if self.asr.cache is not None:
+            await self.asr.cache.flush()
+        self.key_injector.stop()
+        self.function_registry.shutdown()
+
+    async def rebind(self, port: int):
+        """换到新端口监听，已有连接保持不断开"""
+        if self._ws_server is None:
+            self.port = port
+            return
+        try:
+            server = await self.listen(port)
+        except OSError as e:
+            logger.error(f"监听新端口 {port} 失败，继续使用端口 {self.port}: {e}")
+            return
+        old_server, self._ws_server = self._ws_server, server
+        self.port = port
+        old_server.close(close_connections=False)
+        logger.info(f"已切换到新端口: {port}")
+
+    async def apply_config(self, old: dict, new: dict, changed: list):
+        """配置文件被修改后应用能在运行中生效的部分"""
+        self.host_name = new.get('host_name', 'WebSocketServer')
+        self.tag_id = new.get('tag_id', '')
+        if 'functions' in changed or 'function_pool' in changed:
+            registry, self.function_registry = self.function_registry, FunctionRegistry.from_config(new)
+            registry.shutdown(cancel_futures=False)
+            logger.info(f"功能列表已更新: {list(self.function_registry.entries)}")
+        if 'macros' in changed:
+            self.macros = self.compile_macros(new)
+            logger.info(f"按键宏已更新: {list(self.macros)}")
+        restart_needed = [key for key in changed if key in RESTART_KEYS]
+        if restart_needed:
+            logger.warning(f"以下配置需要重启后生效: {restart_needed}")
+        # 握手内容随配置快照自动更新；端口最后处理，新端口上的客户端看到的已是新配置
+        new_port = new.get('host_port', 56789)
+        if 'host_port' in changed and new_port != self.port:
+            await self.rebind(new_port)
+
     def create_ssl_context(self):
         """创建SSL上下文"""
         try:
             # 检查证书文件是否存在
-            cert_file = "server.crt"
-            key_file = "server.key"
+            cert_file = self.config.get('ssl_cert', "server.crt")
+            key_file = self.config.get('ssl_key', "server.key")
             
             if os.path.exists(cert_file) and os.path.exists(key_file):
                 ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
@@ -363,6 +1054,7 @@ class WebSocketKeyServer:
                 ssl_context.load_cert_chain(cert_file, key_file)
                 ssl_context.check_hostname = False
                 ssl_context.verify_mode = ssl.CERT_NONE
+                self.transport.configure_tls(ssl_context)
                 logger.info("SSL上下文创建成功，使用WSS连接")
                 return ssl_context
             else:
@@ -377,10 +1069,10 @@ class WebSocketKeyServer:
 
 
 
-async def main():
+async def main(config_path: str = 'config.json'):
     """主函数"""
     try:
-        server = WebSocketKeyServer()
+        server = WebSocketKeyServer(config_path)
         await server.start_server()
     except KeyboardInterrupt:
         logger.info("服务器被用户中断")
@@ -388,14 +1080,19 @@ async def main():
         logger.error(f"服务器启动失败: {e}")
 
 if __name__ == "__main__":
+    # 打包后的程序在 Windows 上启动解析消息的子进程需要
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="MultiScreenMate 主机服务")
+    parser.add_argument("--config", default="config.json", help="配置文件路径，同一台机器上用不同配置文件可以运行多个实例")
+    args = parser.parse_args()
+    setup_logging(load_logging_options(args.config))
     import tendo.singleton
+    # 每个配置文件一个实例；默认配置文件的锁文件名和以前相同
+    flavor_id = "" if args.config == "config.json" else hashlib.md5(os.path.abspath(args.config).encode()).hexdigest()[:8]
     try:
-        single = tendo.singleton.SingleInstance()
+        single = tendo.singleton.SingleInstance(flavor_id=flavor_id)
     except:
         logger.error("Another instance of the program is already running.")
         exit(1)
-    # 设置pyautogui安全设置
-    pyautogui.FAILSAFE = True
-    pyautogui.PAUSE = 0.1
 
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main(args.config))
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+WebSocket 传输层设置
+
+- 帧和队列上限、写缓冲区水位、心跳间隔按部署配置，传给 websockets.serve
+- 压缩策略：deflate 对几十字节的按键消息几乎省不了流量却要花CPU，二进制帧（语音、图片）本身也压不动，
+  selective 模式只压缩不小于 compress_min_size 的文本消息
+- TLS 会话票据：手机在不稳定的Wi-Fi下频繁重连，恢复会话可以省掉完整的TLS握手；
+  票据密钥跟着 SSLContext 走，所以服务器运行期间只创建一个 SSLContext，换端口时也复用
+"""
+
+import ssl
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import Opcode
+
+# 控制帧（close / ping / pong）的操作码从 8 开始，不能压缩
+CONTROL_OPCODES = frozenset(opcode for opcode in Opcode if opcode >= 8)
+
+COMPRESSION_MODES = ("selective", "deflate", "none")
+
+
+class SelectiveDeflate(PerMessageDeflate):
+    """只压缩足够大的文本消息，其它消息不设置 RSV1 原样发送（RFC 7692 允许逐条消息决定是否压缩）"""
+
+    def __init__(self, *args, min_size: int = 256, compress_binary: bool = False, stats: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+        self.stats = stats if stats is not None else {}
+
+    def encode(self, frame):
+        if frame.opcode in CONTROL_OPCODES:
+            return frame
+        # 只对完整的单帧消息做判断，分片消息的后续帧必须和第一帧一致
+        if frame.opcode is not Opcode.CONT and frame.fin and (
+                len(frame.data) < self.min_size or (frame.opcode is Opcode.BINARY and not self.compress_binary)):
+            self.stats["skipped"] += 1
+            self.stats["skipped_bytes"] += len(frame.data)
+            return frame
+        encoded = super().encode(frame)
+        self.stats["compressed"] += 1
+        self.stats["raw_bytes"] += len(frame.data)
+        self.stats["wire_bytes"] += len(encoded.data)
+        return encoded
+
+
+class SelectiveDeflateFactory(ServerPerMessageDeflateFactory):
+    """协商参数与 websockets 的默认设置相同，协商成功后换成 SelectiveDeflate"""
+
+    def __init__(self, min_size: int = 256, compress_binary: bool = False, **kwargs):
+        kwargs.setdefault("server_max_window_bits", 12)
+        kwargs.setdefault("client_max_window_bits", 12)
+        kwargs.setdefault("compress_settings", {"memLevel": 5})
+        super().__init__(**kwargs)
+        self.min_size = min_size
+        self.compress_binary = compress_binary
+        # 所有连接共享的统计
+        self.stats = {"compressed": 0, "skipped": 0, "raw_bytes": 0, "wire_bytes": 0, "skipped_bytes": 0}
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, SelectiveDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+            compress_binary=self.compress_binary,
+            stats=self.stats,
+        )
+
+
+class TransportOptions:
+    """transport 配置段"""
+
+    def __init__(self, max_size: int = 16 * 1024 * 1024, max_queue: int = 16, write_limit: int = 64 * 1024,
+                 ping_interval: float = 20.0, ping_timeout: float = 20.0, close_timeout: float = 10.0,
+                 open_timeout: float = 10.0, compression: str = "selective", compress_min_size: int = 256,
+                 compress_binary: bool = False, tls_session_tickets: bool = True, tls_num_tickets: int = 2):
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f"transport.compression 应为 {COMPRESSION_MODES} 之一: {compression}")
+        # 0 表示不限制
+        self.max_size = max_size or None
+        self.max_queue = max_queue or None
+        self.write_limit = write_limit
+        self.ping_interval = ping_interval or None
+        self.ping_timeout = ping_timeout or None
+        self.close_timeout = close_timeout
+        self.open_timeout = open_timeout
+        self.compression = compression
+        self.tls_session_tickets = tls_session_tickets
+        self.tls_num_tickets = tls_num_tickets
+        self.deflate = SelectiveDeflateFactory(compress_min_size, compress_binary) if compression == "selective" else None
+        self.stats = {"tls_handshakes": 0, "tls_resumed": 0}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "TransportOptions":
+        return cls(**config.get('transport', {}))
+
+    def serve_kwargs(self) -> dict:
+        """websockets.serve 的传输相关参数"""
+        kwargs = {
+            "max_size": self.max_size,
+            "max_queue": self.max_queue,
+            "write_limit": self.write_limit,
+            "ping_interval": self.ping_interval,
+            "ping_timeout": self.ping_timeout,
+            "close_timeout": self.close_timeout,
+            "open_timeout": self.open_timeout,
+        }
+        if self.compression == "selective":
+            kwargs["compression"] = None
+            kwargs["extensions"] = [self.deflate]
+        else:
+            kwargs["compression"] = "deflate" if self.compression == "deflate" else None
+        return kwargs
+
+    def configure_tls(self, context: ssl.SSLContext):
+        """设置TLS会话恢复"""
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        if self.tls_session_tickets:
+            context.options &= ~ssl.OP_NO_TICKET
+            # TLS 1.3 每次握手发给客户端的票据数
+            context.num_tickets = self.tls_num_tickets
+        else:
+            context.options |= ssl.OP_NO_TICKET
+            context.num_tickets = 0
+
+    def record_connection(self, websocket):
+        """统计TLS握手中恢复会话的比例"""
+        ssl_object = websocket.transport.get_extra_info("ssl_object")
+        if ssl_object is None:
+            return
+        self.stats["tls_handshakes"] += 1
+        if ssl_object.session_reused:
+            self.stats["tls_resumed"] += 1
+
+    def snapshot(self) -> dict:
+        result = {
+            "compression": self.compression,
+            "max_size": self.max_size,
+            "tls_session_tickets": self.tls_session_tickets,
+            **self.stats,
+        }
+        if self.deflate is not None:
+            result.update(self.deflate.stats)
+        return result